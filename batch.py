@@ -0,0 +1,60 @@
+### Searching many queries at once (`Search.search_many`), e.g. for a report that runs hundreds of
+### searches over the same table.
+###
+### Every query is parsed and planned up front. Then, across all of the plans:
+###
+###   (1) a term that several plans have (the same field, search type and term, whatever the query)
+###       is evaluated once, over the whole table, and its rows are handed to every plan that has it
+###   (2) a term that extends another term of the batch ("hdbuy" after "hdb") is only checked over
+###       the rows of the shorter one, as with the result cache (see `cache.py`)
+###
+### Each plan then only evaluates the terms that are its own, and combines the rows as usual.
+
+from collections import OrderedDict
+
+
+def term_key(matcher):
+    """
+    What a matcher's rows depend on. Two matchers of the same key match the same rows
+    (the rest of a matcher, such as the tokens it covers, only matters to its own plan).
+    """
+    return (matcher.__class__.__name__, matcher.field, matcher.search_type, matcher.term)
+
+
+def term_length(key):
+    return len(key[3]) if isinstance(key[3], basestring) else 0
+
+
+def share_terms(plans):
+    """
+    Evaluate the terms that the plans have in common, once, and give their rows to all of their matchers.
+    Returns the number of distinct terms in the plans, and how many of them were evaluated here.
+    """
+    matchers_by_key = OrderedDict()
+    for plan in plans:
+        for matcher in plan.matchers:
+            matchers_by_key.setdefault(term_key(matcher), []).append(matcher)
+
+    known = {} # key ==> the rows of a term evaluated here
+    shared = 0
+    # The shortest terms first, so that the longer ones can be checked over the rows of their prefixes.
+    for key in sorted(matchers_by_key, key=term_length):
+        matchers = matchers_by_key[key]
+        first = matchers[0]
+        if (not first.is_known()) and first.refines_prefix and isinstance(first.term, basestring):
+            for length in xrange(len(first.term) - 1, 0, -1):
+                prefix_rows = known.get(key[:3] + (first.term[:length],))
+                if prefix_rows is not None:
+                    for matcher in matchers:
+                        if matcher.candidates is None:
+                            matcher.candidates = prefix_rows
+                    break
+        # A term of only one plan is left to it: its other terms may well narrow down the rows it has to look at.
+        # An index lookup is done here all the same, as it is for the whole table anyway.
+        if (len(matchers) < 2) and not first.is_known():
+            continue
+        rows = known[key] = first.rows()
+        for matcher in matchers[1:]:
+            matcher.known_rows, matcher.partial_rows, matcher.from_cache = rows, first.partial_rows, first.from_cache
+        shared += 1
+    return len(matchers_by_key), shared
@@ -0,0 +1,250 @@
+### A reproducible benchmark of the search, on synthetic Sales tables.
+###
+###   $ python benchmark.py --sizes 100K,1M --out before.json
+###   ... change something ...
+###   $ python benchmark.py --sizes 100K,1M --out after.json
+###   $ python benchmark.py --compare before.json after.json
+###
+### (1) A table of each size is generated with the `COLUMN_INFO` schema, from a seeded random
+###     generator, so every run (and every version of the code) searches the very same data.
+###     The data files (and their indexes) are kept in `--dir`, and only generated the first time.
+### (2) Each table is searched in a process of its own, so that its peak memory (`ru_maxrss`)
+###     is its own too. Every query of the workload is run `--repeat` times, with the result cache
+###     turned off, timing `tokenize`, `build_search_info` and `search_all` separately
+###     (note that `build_search_info` tokenizes the search itself, so it includes `tokenize`).
+### (3) The results are written as json. `--compare` reads two of them and lists the phases whose
+###     median got slower by more than `--threshold`, exiting with 1 if there is any.
+
+import datetime
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from constants import *
+from dates import datetime_to_serial
+from plan import ENGINE_ROWS, ENGINE_BITMAP
+from columns import ColumnStore
+from search import Search, default_column_info
+from storage import write_store
+
+
+SIZES = [('100K', 100000), ('1M', 1000000), ('10M', 10000000)]
+DEFAULT_SIZES = '100K,1M,10M'
+DEFAULT_REPEAT = 10
+DEFAULT_SEED = 2014
+DEFAULT_THRESHOLD = 0.2  # a phase is a regression if its median is 20% slower...
+MIN_DIFFERENCE = 0.0005  # ...and by more than half a millisecond, which is noise
+PERCENTILES = [50, 90, 99]
+
+# (name, search string): one of each kind of search
+WORKLOAD = [
+    ('edge-token', 'hdb'),
+    ('numeric-exact', '4.99'),
+    ('full-date', '2016-03-04'),
+    ('mixed', 'sdrent 3.99 ca usd'),
+    ('no-match', 'hdbuy zzz'),
+]
+
+TERRITORIES = [
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'HI', 'ID', 'IL', 'IN', 'IA', 'KS', 'KY',
+    'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND',
+    'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY',
+]
+CODES = ['HDBUY', 'SDBUY', 'HDRENT', 'SDRENT', 'UHDBUY', 'UHDRENT']
+PRICES = [0.99, 1.99, 2.99, 3.99, 4.99, 5.99, 7.99, 9.99, 12.99, 14.99, 19.99]
+CURRENCIES = [('USD', 1.0), ('USD', 1.0), ('USD', 1.0), ('EUR', 1.13), ('GBP', 1.31), ('CAD', 0.76), ('AUD', 0.71)]
+FIRST_DATE = int(datetime_to_serial(datetime.datetime(2014, 1, 1)))
+LAST_DATE = int(datetime_to_serial(datetime.datetime(2018, 12, 31)))
+
+
+def synthetic_rows(num_rows, seed=DEFAULT_SEED):
+    """
+    Yield `num_rows` rows of Sales data, formatted like the Wasm data, e.g.
+
+        [134981, 43168.0, 312583, 'AZ', 'SDRENT', 3.99, 'USD', 3.99]
+
+    The same seed always gives the same rows.
+    """
+    rand = random.Random(seed)
+    choice, randint = rand.choice, rand.randint
+    for num in xrange(num_rows):
+        price = choice(PRICES)
+        currency, rate = choice(CURRENCIES)
+        yield [
+            num + 1,
+            float(randint(FIRST_DATE, LAST_DATE)),
+            randint(100000, 999999),
+            choice(TERRITORIES),
+            choice(CODES),
+            price,
+            currency,
+            round(price * rate, 2),
+        ]
+
+
+def synthetic_data(data_dir, label, num_rows, seed=DEFAULT_SEED):
+    """
+    The path of the data file of one table size, generating it if it is not there yet.
+
+    It is also opened once, so its indexes and statistics are built before it is timed.
+    """
+    data_path = os.path.join(data_dir, 'Sales%s-%s.bin' % (label, seed))
+    if not os.path.exists(data_path):
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+        column_info = default_column_info()
+        write_store(data_path, ColumnStore.from_rows(synthetic_rows(num_rows, seed), column_info), column_info)
+    Search(data_path, cache_bytes=0)
+    return data_path
+
+
+def percentiles(times):
+    """
+    The summary of a list of timings (in seconds): min, max, mean and the `PERCENTILES` (nearest rank).
+    """
+    times = sorted(times)
+    summary = {'min': times[0], 'max': times[-1], 'mean': sum(times) / len(times)}
+    for percentile in PERCENTILES:
+        summary['p%s' % percentile] = times[min(len(times) - 1, max(0, -(-percentile * len(times) // 100) - 1))]
+    return summary
+
+
+def peak_memory_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0 # kilobytes, on linux
+
+
+def run_workload(data_path, repeat=DEFAULT_REPEAT, engine=ENGINE_BITMAP):
+    """
+    Open one data file and time every query of the workload on it (this runs in its own process).
+    """
+    t0 = time.time()
+    s = Search(data_path, cache_bytes=0, engine=engine)
+    result = {
+        'NumRows': len(s.store),
+        'OpenSeconds': time.time() - t0,
+        'OpenMemoryMB': peak_memory_mb(),
+        'Queries': {},
+    }
+    for name, q in WORKLOAD:
+        phases = {'tokenize': [], 'build_search_info': [], 'search_all': []}
+        for _ in range(repeat + 1): # the first run only warms up
+            t0 = time.time()
+            s.tokenize(q)
+            t1 = time.time()
+            s.SEARCH_INFO = s.new_search_info()
+            s.SEARCH_INFO['OriginalSearch'] = q
+            s.build_search_info(q)
+            t2 = time.time()
+            skipped = s.check_if_search_can_be_skipped()
+            if not skipped:
+                s.search_all()
+            t3 = time.time()
+            phases['tokenize'].append(t1 - t0)
+            phases['build_search_info'].append(t2 - t1)
+            phases['search_all'].append(t3 - t2)
+        result['Queries'][name] = {
+            'Query': q,
+            'Skipped': skipped,
+            'NumResults': 0 if skipped else s.SEARCH_INFO['NumResults'],
+            'Phases': dict((phase, percentiles(times[1:])) for phase, times in phases.items()),
+        }
+    result['PeakMemoryMB'] = peak_memory_mb()
+    return result
+
+
+def git_version():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=devnull, cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(sizes, data_dir, repeat=DEFAULT_REPEAT, seed=DEFAULT_SEED, engine=ENGINE_BITMAP, label=None):
+    """
+    Generate (if needed) and search a table of each size, each in a new process.
+    """
+    results = {
+        'Label': label,
+        'Version': git_version(),
+        'Python': sys.version.split()[0],
+        'Engine': engine,
+        'Repeat': repeat,
+        'Seed': seed,
+        'Workload': WORKLOAD,
+        'Sizes': {},
+    }
+    for size_label, num_rows in SIZES:
+        if size_label not in sizes:
+            continue
+        print >> sys.stderr, 'Preparing %s rows...' % size_label
+        data_path = synthetic_data(data_dir, size_label, num_rows, seed)
+        print >> sys.stderr, 'Searching %s rows...' % size_label
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--run', data_path, '--repeat', str(repeat), '--engine', engine])
+        results['Sizes'][size_label] = json.loads(output)
+    return results
+
+
+def compare(old, new, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare the medians of two benchmark results. Returns the lines to print and whether anything regressed.
+    """
+    lines, regressed = [], False
+    for size_label, num_rows in SIZES:
+        if (size_label not in old['Sizes']) or (size_label not in new['Sizes']):
+            continue
+        old_size, new_size = old['Sizes'][size_label], new['Sizes'][size_label]
+        lines.append('%s rows (peak memory %.1fMB ==> %.1fMB)' % (size_label, old_size['PeakMemoryMB'], new_size['PeakMemoryMB']))
+        for name, q in new['Workload']:
+            if name not in old_size['Queries']:
+                continue
+            for phase in ('tokenize', 'build_search_info', 'search_all'):
+                before = old_size['Queries'][name]['Phases'][phase]['p50']
+                after = new_size['Queries'][name]['Phases'][phase]['p50']
+                ratio = after / before if before else 1.0
+                is_regression = (ratio > 1 + threshold) and (after - before > MIN_DIFFERENCE)
+                regressed = regressed or is_regression
+                lines.append('  %-14s %-18s %9.4f ==> %9.4f  x%.2f%s' % (name, phase, before, after, ratio, '  REGRESSION' if is_regression else ''))
+            if old_size['Queries'][name]['NumResults'] != new_size['Queries'][name]['NumResults']:
+                regressed = True
+                lines.append('  %-14s results changed: %s ==> %s' % (name, old_size['Queries'][name]['NumResults'], new_size['Queries'][name]['NumResults']))
+    return lines, regressed
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the search on synthetic Sales data.')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='comma-separated table sizes, of %s' % ', '.join(label for label, num_rows in SIZES))
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='runs of each query')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--engine', default=ENGINE_BITMAP, choices=[ENGINE_BITMAP, ENGINE_ROWS])
+    parser.add_argument('--dir', default=os.path.join(tempfile.gettempdir(), 'search-benchmark'), help='where the generated data files are kept')
+    parser.add_argument('--label', help='a name for this run, e.g. the branch')
+    parser.add_argument('--out', help='write the results to this file (instead of stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two results files')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--run', help=argparse.SUPPRESS) # the worker process: search one data file
+    args = parser.parse_args()
+
+    if args.run:
+        print json.dumps(run_workload(args.run, args.repeat, args.engine))
+    elif args.compare:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        lines, regressed = compare(old, new, args.threshold)
+        print '\n'.join(lines)
+        raise SystemExit(1 if regressed else 0)
+    else:
+        results = run_benchmark(args.sizes.split(','), args.dir, args.repeat, args.seed, args.engine, args.label)
+        output = json.dumps(results, indent=4, sort_keys=True)
+        if args.out:
+            with open(args.out, 'w') as f:
+                f.write(output)
+        else:
+            print output
@@ -0,0 +1,252 @@
+### Compressed row bitmaps, and the set-at-a-time engine that combines the terms of a plan with them.
+###
+### A `RowBitmap` splits the rows into chunks of 65536, like a roaring bitmap. Each chunk
+### that has any rows is one container:
+###
+###   - sparse (up to 4096 rows) ==> a sorted `array('H')` of the low 16 bits of the rows
+###   - dense                    ==> a python int, used as a 65536-bit bitset
+###
+### so a term that matched a handful of rows costs a few bytes, and combining two dense
+### chunks is a single bitwise operation on two ints, done in C.
+
+import array
+from binascii import hexlify, unhexlify
+
+
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+LOW_MASK = CHUNK_SIZE - 1
+MAX_SPARSE = 4096 # a sparse container takes 2 bytes a row, a dense one 8KB: the same at 4096 rows
+
+# The set bits of every byte value, to turn a bitset back into rows a byte at a time.
+BYTE_BITS = [tuple(bit for bit in xrange(8) if byte & (1 << bit)) for byte in xrange(256)]
+
+
+def _to_bits(container):
+    if not isinstance(container, array.array):
+        return container
+    data = bytearray(CHUNK_SIZE // 8)
+    for low in container:
+        data[low >> 3] |= 1 << (low & 7)
+    data.reverse()
+    return int(hexlify(data), 16)
+
+
+def _to_bytes(bits):
+    """
+    The bytes of a dense container, lowest rows first.
+    """
+    hex_digits = '%x' % bits
+    data = bytearray(unhexlify(('0' if len(hex_digits) % 2 else '') + hex_digits))
+    data.reverse()
+    return data
+
+
+def _to_lows(container):
+    if isinstance(container, array.array):
+        return container
+    return array.array('H', [(num << 3) + bit for num, byte in enumerate(_to_bytes(container)) if byte for bit in BYTE_BITS[byte]])
+
+
+def _filter_lows(lows, bits, keep):
+    """
+    The ones of the sparse `lows` that are (keep=True) or are not (keep=False) set in the dense `bits`.
+    """
+    data = _to_bytes(bits)
+    size = len(data)
+    return array.array('H', [low for low in lows if bool((low >> 3) < size and data[low >> 3] & (1 << (low & 7))) == keep])
+
+
+def _size(container):
+    if isinstance(container, array.array):
+        return len(container)
+    return bin(container).count('1')
+
+
+def _normalize(container):
+    """
+    Return a container in its smaller form, or None if it is empty.
+    """
+    if isinstance(container, array.array):
+        return container if container else None
+    if not container:
+        return None
+    if _size(container) <= MAX_SPARSE:
+        return _to_lows(container)
+    return container
+
+
+class RowBitmap(object):
+    """
+    A set of rows, as {chunk number: container}.
+    """
+
+    def __init__(self, containers=None):
+        self.containers = containers if containers is not None else {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build a bitmap from a sorted list of rows.
+        """
+        containers = {}
+        chunk = lows = None
+        for row in rows:
+            if (row >> CHUNK_BITS) != chunk:
+                if lows:
+                    containers[chunk] = lows
+                chunk, lows = row >> CHUNK_BITS, array.array('H')
+            lows.append(row & LOW_MASK)
+        if lows:
+            containers[chunk] = lows
+        for chunk, lows in containers.items():
+            if len(lows) > MAX_SPARSE:
+                containers[chunk] = _to_bits(lows)
+        return cls(containers)
+
+    def __len__(self):
+        return sum(_size(container) for container in self.containers.itervalues())
+
+    def __nonzero__(self):
+        return bool(self.containers)
+
+    def __contains__(self, row):
+        container = self.containers.get(row >> CHUNK_BITS)
+        if container is None:
+            return False
+        low = row & LOW_MASK
+        if isinstance(container, array.array):
+            return low in container
+        return bool((container >> low) & 1)
+
+    def __iter__(self):
+        for chunk in sorted(self.containers):
+            base = chunk << CHUNK_BITS
+            for low in _to_lows(self.containers[chunk]):
+                yield base + low
+
+    def __or__(self, other):
+        containers = dict(self.containers)
+        for chunk, container in other.containers.iteritems():
+            mine = containers.get(chunk)
+            if mine is None:
+                containers[chunk] = container
+            elif isinstance(mine, array.array) and isinstance(container, array.array) and (len(mine) + len(container) <= MAX_SPARSE):
+                containers[chunk] = array.array('H', sorted(set(mine).union(container)))
+            else:
+                containers[chunk] = _to_bits(mine) | _to_bits(container)
+        return RowBitmap(containers)
+
+    def __and__(self, other):
+        containers = {}
+        for chunk, container in self.containers.iteritems():
+            theirs = other.containers.get(chunk)
+            if theirs is None:
+                continue
+            if isinstance(container, array.array) or isinstance(theirs, array.array):
+                # At most 4096 rows can be in the result, so test the sparse side's rows one by one.
+                sparse, other_container = (container, theirs) if isinstance(container, array.array) else (theirs, container)
+                if isinstance(other_container, array.array):
+                    result = array.array('H', sorted(set(sparse).intersection(other_container)))
+                else:
+                    result = _filter_lows(sparse, other_container, True)
+            else:
+                result = container & theirs
+            result = _normalize(result)
+            if result is not None:
+                containers[chunk] = result
+        return RowBitmap(containers)
+
+    def __sub__(self, other):
+        containers = {}
+        for chunk, container in self.containers.iteritems():
+            theirs = other.containers.get(chunk)
+            if theirs is None:
+                containers[chunk] = container
+                continue
+            if isinstance(container, array.array):
+                if isinstance(theirs, array.array):
+                    theirs = set(theirs)
+                    result = array.array('H', [low for low in container if low not in theirs])
+                else:
+                    result = _filter_lows(container, theirs, False)
+            else:
+                result = container & ~_to_bits(theirs)
+            result = _normalize(result)
+            if result is not None:
+                containers[chunk] = result
+        return RowBitmap(containers)
+
+
+def combine_bitmaps(plan, matcher_rows):
+    """
+    Work out which rows fully match a plan, given the rows each of its matchers matched (see `match_bitmap`).
+    """
+    return set(match_bitmap(plan, matcher_rows))
+
+
+def match_bitmap(plan, matcher_rows, bitmaps=None):
+    """
+    The bitmap of the rows that fully match a plan, given the rows each of its matchers matched.
+    The bitmaps of the matchers' rows that had to be built are left in `bitmaps` (by matcher number).
+
+    This gives the same result as checking the rows one by one (`Plan.match_row`):
+
+      - on a column that is claimed once matched, only the first of its matchers (in plan order)
+        that matched a row counts on that row ==> its rows minus the rows of the ones before it
+      - a token is covered by the OR of the rows of every matcher that counts for it
+      - a row matches if every token is covered ==> the AND over the tokens
+
+    The exception are the rows that a matcher only partially matched, as those need the reverse
+    check against the search string, which depends on the order the row's matchers are looked at
+    in. Those few rows are still checked one by one.
+    """
+    matchers = plan.matchers
+    bitmaps = bitmaps if bitmaps is not None else {}
+    counted = {}
+
+    def bitmap_of(num):
+        if num not in bitmaps:
+            bitmaps[num] = RowBitmap.from_rows(matcher_rows[num])
+        return bitmaps[num]
+
+    def counted_of(num):
+        if num not in counted:
+            matcher = matchers[num]
+            bitmap = bitmap_of(num)
+            if matcher.claims_column:
+                for before in xrange(num):
+                    if matchers[before].claims_column and (matchers[before].column_bit == matcher.column_bit):
+                        bitmap = bitmap - bitmap_of(before)
+            counted[num] = bitmap
+        return counted[num]
+
+    # The tokens that matched the fewest rows go first, so the result shrinks as fast as it can,
+    # and the bitmaps of the other terms are never built if it is empty by then.
+    def token_size(bit):
+        return sum(len(rows) for matcher, rows in zip(matchers, matcher_rows) if matcher.mask & bit)
+
+    result = None
+    for bit in sorted(plan.token_bits(), key=token_size):
+        covered = RowBitmap()
+        for num, matcher in enumerate(matchers):
+            if matcher.mask & bit:
+                covered = covered | counted_of(num)
+        result = covered if result is None else (result & covered)
+        if not result:
+            return RowBitmap()
+
+    ambiguous = RowBitmap()
+    for num, matcher in enumerate(matchers):
+        if matcher.partial_rows:
+            ambiguous = ambiguous | (counted_of(num) & RowBitmap.from_rows(sorted(matcher.partial_rows)))
+    ambiguous = result & ambiguous
+    if not ambiguous:
+        return result
+
+    checked = []
+    for idx in ambiguous:
+        nums = [num for num in xrange(len(matchers)) if idx in bitmap_of(num)]
+        if plan.match_row(idx, nums):
+            checked.append(idx)
+    return (result - ambiguous) | RowBitmap.from_rows(checked)
@@ -0,0 +1,136 @@
+### A memory-bounded LRU cache of search results, for search-as-you-type.
+###
+### Every keystroke is a new search ("hd", "hdb", "hdbuy", "hdbuy 4.99"), and most of
+### its work was already done by the search before it. Two kinds of entries are kept:
+###
+###   (1) the matches of a whole search, keyed on its tokens ==> repeating a search is free
+###   (2) the rows of each term that had to be scanned for, keyed on its field/searchType/searchAs:
+###         - a term that was already scanned for is not scanned again
+###         - a term that extends a cached one ("hdbuy" after "hdb") is only checked
+###           on the rows that one matched (see `Matcher.candidates`)
+###         - and once the terms of a token are all known, the other tokens' terms only
+###           check the rows those matched ("hdbuy 4.99" after "hdbuy", see `Plan.execute`)
+###
+### Rows are stored as `array.array`s, so the size of an entry is easy to tell. The cache belongs
+### to one version of the data file, and is emptied as soon as it is used with another one.
+
+import array
+import threading
+from collections import OrderedDict
+
+
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+ENTRY_OVERHEAD_BYTES = 200 # a rough guess of what an entry costs besides its rows
+
+
+def pack_rows(rows):
+    return rows if isinstance(rows, array.array) else array.array('L', rows)
+
+
+def rows_size(*row_lists):
+    return ENTRY_OVERHEAD_BYTES + sum(len(rows) * rows.itemsize for rows in row_lists)
+
+
+class LRUCache(object):
+    """
+    A least-recently-used cache that evicts entries once their total size goes over `max_bytes`.
+    It can be shared by the sessions of a server, so every change is made under a lock.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # key ==> (value, size), least recently used first
+        self.size = 0
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class ResultCache(LRUCache):
+    """
+    The results of the searches (and of their terms) over one version of a data file.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, signature=None):
+        LRUCache.__init__(self, max_bytes)
+        self.signature = signature
+
+    def validate(self, signature):
+        """
+        Empty the cache if the data has changed since its entries were made.
+        """
+        if signature != self.signature:
+            self.clear()
+            self.signature = signature
+
+    def get_matches(self, tokens):
+        matches = self.get(('search', tuple(tokens)))
+        return None if matches is None else set(matches)
+
+    def put_matches(self, tokens, matches):
+        matches = pack_rows(sorted(matches))
+        self.put(('search', tuple(tokens)), matches, rows_size(matches))
+
+    def term_key(self, matcher, term=None):
+        return ('term', matcher.__class__.__name__, matcher.field, matcher.search_type, matcher.term if term is None else term)
+
+    def prime(self, plan):
+        """
+        Give the matchers of a plan whatever the cache knows about their terms.
+        """
+        for matcher in plan.matchers:
+            if matcher.is_known():
+                continue
+            entry = self.get(self.term_key(matcher))
+            if entry is not None:
+                matcher.known_rows, partial_rows = entry
+                matcher.partial_rows = set(partial_rows)
+                matcher.from_cache = True
+                continue
+            if not (matcher.refines_prefix and isinstance(matcher.term, basestring)):
+                continue
+            # The longest cached prefix of the term matched the fewest rows.
+            for length in xrange(len(matcher.term) - 1, 0, -1):
+                entry = self.get(self.term_key(matcher, matcher.term[:length]))
+                if entry is not None:
+                    matcher.candidates = entry[0]
+                    break
+
+    def store(self, plan):
+        """
+        Keep the rows of the terms that a plan had to scan for (an index lookup is cheap to redo).
+        """
+        for matcher in plan.matchers:
+            if (matcher.known_rows is None) or matcher.from_cache or (matcher.index is not None):
+                continue
+            known_rows = pack_rows(matcher.known_rows)
+            partial_rows = pack_rows(sorted(matcher.partial_rows))
+            self.put(self.term_key(matcher), (known_rows, partial_rows), rows_size(known_rows, partial_rows))
@@ -0,0 +1,430 @@
+### Columnar, typed in-memory storage for the search table.
+###
+### Instead of a list of rows (each a list of boxed python values), every field
+### is stored as one contiguous column:
+###
+###   - INTEGER/DECIMAL/DATE/DATETIME/TIME/BOOLEAN ==> `array.array` of a fixed width
+###   - STRING                                     ==> one bytes heap + an offsets array
+###
+### Every column also carries a null bitmap, so that a null does not need
+### to be boxed as `None` inside the typed array (a zero is stored in its place).
+###
+### The scan methods evaluate one term over a whole column (or a row range of it)
+### at once and return the sorted row indexes that match. The filter methods do the same
+### for a sorted list of candidate rows, one row at a time.
+
+import array
+import re
+from bisect import bisect_right
+from itertools import izip
+from constants import *
+
+
+# `array` typecodes used for the fixed-width column types.
+# Dates/times are stored as their excel serial number, which can be fractional.
+TYPECODES = {
+    DATA_TYPE_INTEGER: 'l',
+    DATA_TYPE_DECIMAL: 'd',
+    DATA_TYPE_DATE: 'd',
+    DATA_TYPE_DATETIME: 'd',
+    DATA_TYPE_TIME: 'd',
+    DATA_TYPE_BOOLEAN: 'b',
+}
+INTEGRAL_TYPECODES = 'bhilqBHILQ'
+
+# Every string value in the heap is followed by this byte, and the heap itself starts with it.
+# That way a regex can be run over the whole heap at once: the terminator is a non-word
+# character (so `\b` still works at value boundaries) and it anchors full-value matches.
+STRING_TERMINATOR = '\x00'
+
+
+def encode_string(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def exact_pattern(term):
+    return re.compile('(?<=\x00)%s(?=\x00)' % re.escape(encode_string(term)))
+
+
+def startswith_pattern(term, ignore_case=False):
+    return re.compile('(?<=\x00)%s' % re.escape(encode_string(term)), re.IGNORECASE if ignore_case else 0)
+
+
+def edge_pattern(term, ignore_case=False):
+    return re.compile(r'\b%s' % re.escape(encode_string(term)), re.IGNORECASE if ignore_case else 0)
+
+
+def contains_pattern(term, ignore_case=False):
+    return re.compile(re.escape(encode_string(term)), re.IGNORECASE if ignore_case else 0)
+
+
+class NullBitmap(object):
+    """
+    One bit per row, set when the value at that row is null.
+    """
+
+    def __init__(self, bits=None, num_rows=0, null_count=None):
+        self.bits = bits if bits is not None else bytearray()
+        self.num_rows = num_rows
+        self._null_count = null_count # cached, as a mapped bitmap should not be read just to count it
+
+    def append(self, is_null):
+        idx = self.num_rows
+        if idx & 7 == 0:
+            self.bits.append(0)
+        if is_null:
+            self.bits[idx >> 3] |= (1 << (idx & 7))
+            self._null_count = None
+        self.num_rows += 1
+
+    def extend(self, num_rows, null_rows=()):
+        """
+        Add `num_rows` rows at once, of which `null_rows` (counted from the first of them) are null.
+        """
+        start = self.num_rows
+        self.num_rows += num_rows
+        self.bits.extend('\x00' * (((self.num_rows + 7) >> 3) - len(self.bits)))
+        for idx in null_rows:
+            idx += start
+            self.bits[idx >> 3] |= (1 << (idx & 7))
+        if null_rows:
+            self._null_count = None
+
+    def is_null(self, idx):
+        return bool(self.bits[idx >> 3] & (1 << (idx & 7)))
+
+    def has_nulls(self):
+        return self.null_count() > 0
+
+    def null_count(self):
+        if self._null_count is None:
+            self._null_count = sum(bin(byte).count('1') for byte in self.bits)
+        return self._null_count
+
+    def drop_nulls(self, rows):
+        """
+        Remove the null rows from a list of row indexes.
+        """
+        if not self.has_nulls():
+            return rows
+        if not isinstance(self.bits, (bytearray, array.array)):
+            self.bits = self.bits[:] # a mapped bitmap is decoded the first time it is scanned
+        bits = self.bits
+        return [idx for idx in rows if not (bits[idx >> 3] & (1 << (idx & 7)))]
+
+
+class NumericColumn(object):
+    """
+    A fixed-width column (numbers, dates, booleans) backed by an `array.array`.
+    """
+
+    def __init__(self, data_type, values=None, nulls=None):
+        self.data_type = data_type
+        self.values = values if values is not None else array.array(TYPECODES[data_type])
+        self.nulls = nulls if nulls is not None else NullBitmap(num_rows=len(self.values))
+        self.is_integral = self.values.typecode in INTEGRAL_TYPECODES
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, idx):
+        if self.nulls.is_null(idx):
+            return None
+        if self.data_type == DATA_TYPE_BOOLEAN:
+            return bool(self.values[idx])
+        return self.values[idx]
+
+    def append(self, value):
+        self.nulls.append(value is None)
+        if value is None:
+            value = 0
+        elif self.is_integral:
+            value = int(value)
+        self.values.append(value)
+
+    def raw(self):
+        """
+        The column's packed bytes, without copying them.
+        """
+        if hasattr(self.values, 'raw'): # a memory-mapped array
+            return self.values.raw()
+        return buffer(self.values)
+
+    def scan_equal(self, value, start=0, stop=None):
+        """
+        Return the rows whose value == `value`.
+
+        Rather than comparing one boxed value at a time, the value is packed the same way
+        the column is and searched for in the raw bytes. The lookahead finds overlapping
+        candidates, and only the ones aligned to an item boundary are real matches.
+        """
+        stop = len(self) if stop is None else stop
+        if (value is None) or isinstance(value, basestring):
+            return []
+        if self.is_integral:
+            if value != int(value):
+                return []
+            value = int(value)
+        itemsize = self.values.itemsize
+        packed = array.array(self.values.typecode, [value]).tostring()
+        pattern = re.compile('(?=%s)' % re.escape(packed), re.DOTALL)
+        rows = [m.start() // itemsize for m in pattern.finditer(self.raw(), start * itemsize, stop * itemsize) if m.start() % itemsize == 0]
+        return self.nulls.drop_nulls(rows)
+
+    def scan(self, predicate, start=0, stop=None):
+        """
+        Return the rows whose (non-null) value satisfies `predicate`.
+        """
+        stop = len(self) if stop is None else stop
+        rows = [idx for idx, value in enumerate(self.values[start:stop], start) if predicate(value)]
+        return self.nulls.drop_nulls(rows)
+
+    def filter(self, predicate, rows):
+        """
+        Return the ones of the sorted `rows` whose (non-null) value satisfies `predicate`.
+        Used instead of a scan when only a few candidate rows are left to check.
+        """
+        values = self.values
+        return self.nulls.drop_nulls([idx for idx in rows if predicate(values[idx])])
+
+    def filter_equal(self, value, rows):
+        if (value is None) or isinstance(value, basestring):
+            return []
+        if self.is_integral:
+            if value != int(value):
+                return []
+            value = int(value)
+        return self.filter(lambda v: v == value, rows)
+
+
+class StringColumn(object):
+    """
+    A string column stored as one utf-8 bytes heap plus an offsets array.
+
+    The value at row `i` lives at heap[offsets[i]:offsets[i+1]-1]
+    (the -1 skips the value's terminator).
+    """
+
+    data_type = DATA_TYPE_STRING
+
+    def __init__(self, offsets=None, heap=None, nulls=None):
+        self.offsets = offsets if offsets is not None else array.array('L', [len(STRING_TERMINATOR)])
+        self.heap = heap if heap is not None else bytearray(STRING_TERMINATOR)
+        self.nulls = nulls if nulls is not None else NullBitmap(num_rows=len(self.offsets) - 1)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if self.nulls.is_null(idx):
+            return None
+        return self.heap[self.offsets[idx]:self.offsets[idx + 1] - 1].decode('utf-8')
+
+    def append(self, value):
+        self.nulls.append(value is None)
+        if value is not None:
+            self.heap.extend(encode_string(value))
+        self.heap.append(STRING_TERMINATOR)
+        self.offsets.append(len(self.heap))
+
+    def scan_pattern(self, pattern, start=0, stop=None):
+        """
+        Run a compiled regex over the heap of the whole row range at once,
+        and map every match back to the row it falls in.
+        """
+        stop = len(self) if stop is None else stop
+        if not isinstance(self.offsets, array.array):
+            self.offsets = self.offsets[:] # mapped offsets are decoded the first time they are scanned
+        offsets = self.offsets
+        rows = []
+        last_idx = -1
+        for m in pattern.finditer(self.heap, offsets[start], offsets[stop]):
+            idx = bisect_right(offsets, m.start()) - 1
+            if idx != last_idx:
+                rows.append(idx)
+                last_idx = idx
+        return self.nulls.drop_nulls(rows)
+
+    def scan_equal(self, value, start=0, stop=None):
+        if (value is None) or not isinstance(value, basestring):
+            return []
+        return self.scan_pattern(exact_pattern(value), start, stop)
+
+    def scan(self, predicate, start=0, stop=None):
+        stop = len(self) if stop is None else stop
+        rows = [idx for idx in xrange(start, stop) if predicate(self[idx])]
+        return self.nulls.drop_nulls(rows)
+
+    def filter_pattern(self, pattern, rows):
+        """
+        Return the ones of the sorted `rows` whose value matches a compiled regex.
+        """
+        if not isinstance(self.offsets, array.array):
+            self.offsets = self.offsets[:]
+        heap, offsets, search = self.heap, self.offsets, pattern.search
+        # Each value is searched together with the terminators on both sides of it,
+        # so that the anchored patterns work the same as in `scan_pattern`.
+        rows = [idx for idx in rows if search(heap, offsets[idx] - 1, offsets[idx + 1])]
+        return self.nulls.drop_nulls(rows)
+
+    def filter_equal(self, value, rows):
+        if (value is None) or not isinstance(value, basestring):
+            return []
+        return self.filter_pattern(exact_pattern(value), rows)
+
+    def filter(self, predicate, rows):
+        return self.nulls.drop_nulls([idx for idx in rows if predicate(self[idx])])
+
+
+class DictColumn(object):
+    """
+    A dictionary-encoded string column, for columns with few distinct values.
+
+    Every row holds a small-int code into `dictionary` (itself a `StringColumn` of the
+    distinct values), so the column costs one or two bytes per row. A term is evaluated
+    once per distinct value, and the resulting set of codes is then used to filter the codes.
+    """
+
+    data_type = DATA_TYPE_STRING
+
+    def __init__(self, codes, dictionary, nulls):
+        self.codes = codes
+        self.dictionary = dictionary
+        self.nulls = nulls
+
+    @classmethod
+    def from_column(cls, column):
+        """
+        Dictionary-encode a `StringColumn`, or return None if it has too many distinct values.
+        """
+        heap, offsets = column.heap, column.offsets
+        code_by_value = {}
+        codes = []
+        for idx in xrange(len(column)):
+            value = str(heap[offsets[idx]:offsets[idx + 1] - 1])
+            code = code_by_value.get(value)
+            if code is None:
+                if len(code_by_value) == MAX_DICTIONARY_SIZE:
+                    return None
+                code = code_by_value[value] = len(code_by_value)
+            codes.append(code)
+
+        dictionary = StringColumn()
+        for value in sorted(code_by_value, key=code_by_value.get):
+            dictionary.append(value)
+        return cls(array.array('B' if len(code_by_value) <= 256 else 'H', codes), dictionary, column.nulls)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, idx):
+        if self.nulls.is_null(idx):
+            return None
+        return self.dictionary[self.codes[idx]]
+
+    def raw(self):
+        if hasattr(self.codes, 'raw'): # a memory-mapped array
+            return self.codes.raw()
+        return buffer(self.codes)
+
+    def rows_with_codes(self, codes, start=0, stop=None):
+        """
+        Return the rows holding any of the dictionary `codes`,
+        by searching for their packed bytes in the raw code array.
+        """
+        stop = len(self) if stop is None else stop
+        if not codes:
+            return []
+        if len(codes) == len(self.dictionary):
+            return self.nulls.drop_nulls(range(start, stop))
+        itemsize = self.codes.itemsize
+        packed = [re.escape(array.array(self.codes.typecode, [code]).tostring()) for code in codes]
+        if itemsize == 1:
+            pattern = re.compile('[%s]' % ''.join(packed), re.DOTALL)
+        else:
+            pattern = re.compile('(?=%s)' % '|'.join(packed), re.DOTALL)
+        rows = [m.start() // itemsize for m in pattern.finditer(self.raw(), start * itemsize, stop * itemsize) if m.start() % itemsize == 0]
+        return self.nulls.drop_nulls(rows)
+
+    def scan_pattern(self, pattern, start=0, stop=None):
+        return self.rows_with_codes(self.dictionary.scan_pattern(pattern), start, stop)
+
+    def scan_equal(self, value, start=0, stop=None):
+        return self.rows_with_codes(self.dictionary.scan_equal(value), start, stop)
+
+    def scan(self, predicate, start=0, stop=None):
+        return self.rows_with_codes(self.dictionary.scan(predicate), start, stop)
+
+    def filter_codes(self, codes, rows):
+        """
+        Return the ones of the sorted `rows` that hold any of the dictionary `codes`.
+        """
+        codes = set(codes)
+        values = self.codes
+        return self.nulls.drop_nulls([idx for idx in rows if values[idx] in codes])
+
+    def filter_pattern(self, pattern, rows):
+        return self.filter_codes(self.dictionary.scan_pattern(pattern), rows)
+
+    def filter_equal(self, value, rows):
+        return self.filter_codes(self.dictionary.scan_equal(value), rows)
+
+    def filter(self, predicate, rows):
+        return self.filter_codes(self.dictionary.scan(predicate), rows)
+
+
+# The most distinct values a string column can have and still be dictionary-encoded.
+MAX_DICTIONARY_SIZE = 65536
+
+
+def new_column(data_type):
+    if data_type == DATA_TYPE_STRING:
+        return StringColumn()
+    return NumericColumn(data_type)
+
+
+def dictionary_encode(column):
+    """
+    Dictionary-encode a string column if it has few enough distinct values.
+    """
+    if isinstance(column, StringColumn):
+        return DictColumn.from_column(column) or column
+    return column
+
+
+class ColumnStore(object):
+    """
+    The whole table, as one column per field of `COLUMN_INFO`.
+    """
+
+    def __init__(self, fields, columns, num_rows):
+        self.fields = fields            # field names, in `COLUMN_INFO` index order
+        self.columns = columns          # one column per field, same order
+        self.columns_by_field = dict(izip(fields, columns))
+        self.num_rows = num_rows
+
+    @classmethod
+    def from_rows(cls, rows, column_info):
+        """
+        Build the store from a list of rows (such as the Wasm-formatted json).
+        """
+        fields = sorted(column_info, key=lambda field: column_info[field]['index'])
+        columns = [new_column(column_info[field]['type']) for field in fields]
+        appenders = [(column_info[field]['index'], column.append) for field, column in izip(fields, columns)]
+        num_rows = 0
+        for row in rows:
+            for index, append in appenders:
+                append(row[index])
+            num_rows += 1
+        return cls(fields, [dictionary_encode(column) for column in columns], num_rows)
+
+    def __len__(self):
+        return self.num_rows
+
+    def column(self, field):
+        return self.columns_by_field[field]
+
+    def row(self, idx):
+        return [column[idx] for column in self.columns]
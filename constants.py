@@ -0,0 +1,17 @@
+### Shared type constants.
+### These live in their own module so that the storage/index modules
+### can use them without importing `search.py` itself.
+
+DATA_TYPE_STRING = 0
+DATA_TYPE_INTEGER = 1
+DATA_TYPE_DECIMAL = 2
+DATA_TYPE_DATE = 3
+DATA_TYPE_DATETIME = 4
+DATA_TYPE_TIME = 5
+DATA_TYPE_BOOLEAN = 6
+
+SEARCH_TYPE_OFF = 0
+SEARCH_TYPE_EXACT = 1
+SEARCH_TYPE_STARTSWITH = 2
+SEARCH_TYPE_EDGE = 3
+SEARCH_TYPE_CONTAINS = 4
@@ -0,0 +1,116 @@
+### Date/time searching without formatting every row.
+###
+### A date column holds excel serial numbers (see `excel_date`), and a non-exact search such as
+### "mar" or "2014-01" has to be compared against the *formatted* date ("2014-03-04", "mar 04 2014").
+### But a date column only has a few thousand distinct serials, however many rows it has, so:
+###
+###   (1) each distinct serial is formatted once, and kept in a lookup table per format
+###   (2) a term is turned into the serials whose formatted value it matches. A year or a year-month
+###       ("2014", "2014-01") is turned straight into a range of serials, without formatting anything
+###   (3) the rows holding those serials are read off the column's sorted index, one
+###       slice per run of consecutive serials (see `SortedIndex.lookup_values`).
+
+import datetime
+import re
+from constants import *
+
+
+TIME_FORMAT_1 = '%H:%M:%S' # 01:02:03
+TIME_FORMAT_2 = '%-H:%M %p' # 1:02 am
+DATE_FORMAT_1 = '%Y-%m-%d' # 2014-01-01
+DATE_FORMAT_2 = '%m/%d/%y' # 01/01/14
+DATE_FORMAT_3 = '%b %d %Y' # Jan 1 2014
+DATETIME_FORMAT_1 = '%Y-%m-%d %H:%M:%S'
+DT_FORMATS = [TIME_FORMAT_1, TIME_FORMAT_2, DATE_FORMAT_1, DATE_FORMAT_2, DATE_FORMAT_3, DATETIME_FORMAT_1]
+
+DATE_TYPES = (DATA_TYPE_DATE, DATA_TYPE_DATETIME, DATA_TYPE_TIME)
+EXCEL_EPOCH = datetime.datetime(1899, 12, 30) # Note, not 31st Dec but 30th!
+TIME_EPOCH = datetime.datetime(1900, 1, 1)
+
+# "2014" or "2014-01", at the start of a format that starts with the year and month
+YEAR_MONTH_RE = re.compile(r'^(\d{4})(?:-(\d{2}))?$')
+
+
+def default_format(data_type, date_format=None):
+    if date_format in DT_FORMATS:
+        return date_format
+    return TIME_FORMAT_1 if data_type == DATA_TYPE_TIME else DATETIME_FORMAT_1 if data_type == DATA_TYPE_DATETIME else DATE_FORMAT_1
+
+
+def serial_to_datetime(v, data_type=DATA_TYPE_DATE):
+    return (TIME_EPOCH if data_type == DATA_TYPE_TIME else EXCEL_EPOCH) + datetime.timedelta(days=v)
+
+
+def datetime_to_serial(value):
+    delta = value - EXCEL_EPOCH
+    return delta.days + delta.seconds / 86400.0
+
+
+def format_serial(v, data_type, date_format=None):
+    """
+    Format a serial number as a (lowered) string, e.g. 41640 ==> "2014-01-01".
+    """
+    if data_type not in DATE_TYPES:
+        raise TypeError('Not a date/time type: %s' % data_type)
+    try:
+        return serial_to_datetime(v, data_type).strftime(default_format(data_type, date_format)).lower()
+    except ValueError: # strftime does not go before 1900
+        return ''
+
+
+class SerialFormatter(object):
+    """
+    Formats serial numbers in one format, remembering every serial it has formatted.
+    """
+
+    def __init__(self, data_type, date_format=None):
+        self.data_type = data_type
+        self.date_format = default_format(data_type, date_format)
+        self.formatted = {}
+
+    def __call__(self, v):
+        formatted = self.formatted.get(v)
+        if formatted is None:
+            formatted = self.formatted[v] = format_serial(v, self.data_type, self.date_format)
+        return formatted
+
+    def serial_range(self, term, search_type):
+        """
+        The [lo, hi) range of serials a year or year-month term matches, if it can be
+        worked out without formatting (otherwise None).
+        """
+        m = YEAR_MONTH_RE.match(term)
+        if (m is None) or (search_type not in (SEARCH_TYPE_STARTSWITH, SEARCH_TYPE_EDGE)) or not self.date_format.startswith('%Y-%m'):
+            return None
+        year, month = int(m.group(1)), m.group(2)
+        try:
+            if month is None:
+                return datetime_to_serial(datetime.datetime(year, 1, 1)), datetime_to_serial(datetime.datetime(year + 1, 1, 1))
+            month = int(month)
+            start = datetime.datetime(year, month, 1)
+            end = datetime.datetime(year + 1, 1, 1) if month == 12 else datetime.datetime(year, month + 1, 1)
+        except ValueError: # "2014-13"
+            return (0, 0)
+        return datetime_to_serial(start), datetime_to_serial(end)
+
+    def matching_serials(self, pattern, serials):
+        """
+        The ones of the (distinct) `serials` whose formatted value matches a compiled regex.
+        """
+        # Between terminators, like a value in a string column's heap, so that the anchored patterns work.
+        search = pattern.search
+        return [v for v in serials if search('\x00%s\x00' % self(v)) is not None]
+
+
+_formatters = {}
+
+
+def formatter(data_type, date_format=None):
+    """
+    The shared `SerialFormatter` of a type/format, so its lookup table lasts from one search to the next.
+    """
+    key = (data_type, default_format(data_type, date_format))
+    if key not in _formatters:
+        _formatters[key] = SerialFormatter(data_type, date_format)
+    return _formatters[key]
+
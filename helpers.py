@@ -1,50 +1,59 @@
 ### Note: these functions can basically be ignored.
 ### They are helper functions to more easily work with and print the data.
 
+import csv
+from constants import *
+
+
 def set_default(obj):
     if isinstance(obj, set):
         return list(obj)
     raise TypeError
     
 
-def write_data():
+def read_csv_data(csv_path, column_info):
     """
-    Ignore this function -- it's just a helper to add in data.
+    Read a raw csv export and yield each row formatted like the Wasm data.
     """
     # To be used to dump the Sales1M.csv file into the data struct
     # Similar to what WASM uses. For example:
     
     # Before: ['64333', '3/9/18', '264879', 'NE', 'HDBUY', '9.99', 'USD', '9.99']
     # After:  [134981, 43168.0, 312583, 'AZ', 'SDRENT', 3.99, 'USD', 3.99]
-    data = []
-    with open('Sales1M.csv') as csvfile:
+    from ingest import DateParser
+    excel_date = DateParser() # the same serials, but each date string is only parsed once
+    with open(csv_path) as csvfile:
         reader = csv.reader(csvfile)
-        for num, row in enumerate(reader):
-            if num % 1000 == 0: print num
-            if num == 0:
-                header = row
-                continue
-            raw_data = zip(header,row)
-            formatted_row = []
+        header = next(reader)
+        for row in reader:
+            formatted_row = [None] * len(column_info)
             # format the data 
-            for field, value in raw_data:
+            for field, value in zip(header, row):
+                field_info = column_info[field]
                 if (not value) or value.lower() in ('nil', 'null'):
                     value = None
-                elif self.COLUMN_INFO[field]['type'] == DATA_TYPE_STRING:
+                elif field_info['type'] == DATA_TYPE_STRING:
                     value = value
-                elif self.COLUMN_INFO[field]['type'] == DATA_TYPE_DECIMAL:
-                    value = float(value) if value else None
-                elif self.COLUMN_INFO[field]['type'] == DATA_TYPE_INTEGER:
-                    value = int(value) if value else None
-                elif self.COLUMN_INFO[field]['type'] == DATA_TYPE_BOOLEAN:
-                    value = None if not value else False if value.lower() in ['f', 'false', 'off', '0'] else True
-                elif self.COLUMN_INFO[field]['type'] in (DATA_TYPE_DATE, DATA_TYPE_DATETIME, DATA_TYPE_TIME):
-                    value = excel_date(parse(value)) if value else None
+                elif field_info['type'] == DATA_TYPE_DECIMAL:
+                    value = float(value)
+                elif field_info['type'] == DATA_TYPE_INTEGER:
+                    value = int(value)
+                elif field_info['type'] == DATA_TYPE_BOOLEAN:
+                    value = False if value.lower() in ['f', 'false', 'off', '0'] else True
+                elif field_info['type'] in (DATA_TYPE_DATE, DATA_TYPE_DATETIME, DATA_TYPE_TIME):
+                    value = excel_date(value)
             
-                formatted_row.append(value)
-            data.append(formatted_row)
-            
-    json.dumps('Sales1M_WasmFormatted.json','w').write(formatted_rows)
+                formatted_row[field_info['index']] = value
+            yield formatted_row
+
+
+def write_data(column_info, csv_path='Sales1M.csv', out_path='Sales1M.bin'):
+    """
+    Ignore this function -- it's just a helper to add in data.
+    The csv is converted in chunks, by a pool of processes (see `ingest.py`).
+    """
+    from storage import convert_csv
+    convert_csv(csv_path, out_path, column_info)
 
 
 def filterfalse(predicate, iterable):
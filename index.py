@@ -0,0 +1,721 @@
+### Indexes built over the columns of a `ColumnStore`, so that a term can be
+### resolved to its rows without scanning the column.
+###
+### Row ids in a posting list are stored sorted, as varint-encoded deltas.
+
+import array
+import json
+import mmap
+import os
+import re
+from bisect import bisect_left, bisect_right
+from columns import DictColumn, encode_string, STRING_TERMINATOR
+from constants import *
+from storage import MappedArray, PREAMBLE, ALIGNMENT, data_signature
+
+
+INDEX_MAGIC = 'SRCHINDX'
+INDEX_FORMAT_VERSION = 1
+
+
+# Same definition of a "word" as `\b` in the (non-unicode) edge-search regex.
+WORD_RE = re.compile(r'\w+')
+WORD_TERM_RE = re.compile(r'^\w+$')
+
+GRAM_SIZE = 3 # see `TrigramIndex`
+
+# Stripped from both ends of every word of a search (see `Search.tokenize`), and of every word of a value of a phrase index.
+PUNCTUATIONS = '!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~'
+
+
+def phrase_words(value):
+    """
+    The words of a search, or of a value: split on whitespace, lower-cased, without the punctuation around them.
+    """
+    words = []
+    for word in value.split():
+        word = word.strip().strip(PUNCTUATIONS).replace("'", '').replace(',', '').lower()
+        if word:
+            words.append(word)
+    return words
+
+
+def word_runs(words, max_words=None):
+    """
+    Every run of consecutive `words` of at most `max_words` words (any number if None), by where they start and then by length.
+    """
+    return [words[start:stop] for start in xrange(len(words)) for stop in xrange(start + 1, (len(words) if max_words is None else min(len(words), start + max_words)) + 1)]
+
+
+def normalize_phrase(value):
+    """
+    A value as the words of a search would spell it out (utf-8), e.g. u"Terminator 2!" ==> "terminator 2".
+    """
+    if value is None:
+        return None
+    return encode_string(' '.join(phrase_words(value)))
+
+
+def encode_postings(rows):
+    """
+    Encode a sorted list of row ids as varint deltas.
+    """
+    data = bytearray()
+    append = data.append
+    last = 0
+    for idx in rows:
+        delta = idx - last
+        last = idx
+        while delta >= 0x80:
+            append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        append(delta)
+    return data
+
+
+def decode_postings(data, start=0, stop=None):
+    rows = []
+    append = rows.append
+    value, current, shift = 0, 0, 0
+    for byte in data[start:stop]:
+        current |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            value += current
+            append(value)
+            current, shift = 0, 0
+    return rows
+
+
+def merge_postings(posting_lists):
+    """
+    Union several sorted lists of row ids into one sorted list.
+    """
+    if not posting_lists:
+        return []
+    if len(posting_lists) == 1:
+        return posting_lists[0]
+    return sorted(set().union(*posting_lists))
+
+
+class EdgeIndex(object):
+    """
+    An inverted index over the word-boundary tokens of a SEARCH_TYPE_EDGE string column.
+
+    The tokens (lower-cased, utf-8) are kept in a sorted term dictionary, so every token
+    starting with a prefix is one contiguous range of it. For example, "hdb" is resolved
+    by merging the posting lists of ["hdbuy", "hdrent"...][lo:hi] and never touches the data.
+    """
+
+    kind = 'edge'
+
+    def __init__(self, terms, postings, posting_offsets):
+        self.terms = terms                      # sorted tokens
+        self.postings = postings                # all the posting lists, back to back
+        self.posting_offsets = posting_offsets  # the posting list of terms[i] is postings[offsets[i]:offsets[i+1]]
+
+    def arrays(self):
+        term_heap, term_offsets = pack_strings(self.terms)
+        return {
+            'termHeap': term_heap,
+            'termOffsets': term_offsets,
+            'postings': self.postings,
+            'postingOffsets': array.array('L', self.posting_offsets),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(PackedStrings(arrays['termHeap'], arrays['termOffsets']), arrays['postings'], arrays['postingOffsets'])
+
+    @classmethod
+    def build(cls, column):
+        rows_by_token = {}
+        if isinstance(column, DictColumn):
+            # Tokenize each distinct value once, and walk the codes.
+            dictionary = column.dictionary
+            tokens_by_code = [set(WORD_RE.findall(encode_string(dictionary[code]).lower())) for code in xrange(len(dictionary))]
+            keyed_rows = enumerate(column.codes[:])
+            tokens_of = tokens_by_code.__getitem__
+        else:
+            tokens_by_value = {}
+            keyed_rows = ((idx, column[idx]) for idx in xrange(len(column)))
+            def tokens_of(value):
+                tokens = tokens_by_value.get(value)
+                if tokens is None:
+                    tokens = tokens_by_value[value] = set(WORD_RE.findall(encode_string(value).lower()))
+                return tokens
+
+        nulls = column.nulls
+        has_nulls = nulls.has_nulls()
+        for idx, key in keyed_rows:
+            if has_nulls and nulls.is_null(idx):
+                continue
+            for token in tokens_of(key):
+                if token in rows_by_token:
+                    rows_by_token[token].append(idx)
+                else:
+                    rows_by_token[token] = [idx]
+
+        terms = sorted(rows_by_token)
+        postings = bytearray()
+        posting_offsets = [0]
+        for token in terms:
+            postings.extend(encode_postings(rows_by_token[token]))
+            posting_offsets.append(len(postings))
+        return cls(terms, postings, posting_offsets)
+
+    @staticmethod
+    def can_lookup(term):
+        """
+        Only a term made of word characters can be answered from the token dictionary
+        (something like "4.99" can match across two tokens).
+        """
+        return WORD_TERM_RE.match(encode_string(term)) is not None
+
+    def lookup_prefix(self, prefix):
+        """
+        Return the sorted rows that have a token starting with `prefix`.
+        """
+        prefix = encode_string(prefix).lower()
+        lo = bisect_left(self.terms, prefix)
+        hi = bisect_left(self.terms, prefix + '\xff', lo) # '\xff' never occurs in utf-8
+        offsets = self.posting_offsets
+        return merge_postings([decode_postings(self.postings, offsets[i], offsets[i + 1]) for i in xrange(lo, hi)])
+
+
+class PhraseIndex(object):
+    """
+    An index over the whole values of a multi-word SEARCH_TYPE_EXACT string column (titles, names...).
+
+    Every value is normalized the way a search is tokenized (see `normalize_phrase`), and kept in a sorted
+    dictionary of phrases, with the posting list of its rows. So the runs of words of a search that are a whole
+    value of the column ("terminator 2" in "terminator 2 usd") are found with one probe each (see `find_phrases`),
+    and the rows of one are read straight off its posting list.
+    """
+
+    kind = 'phrase'
+
+    def __init__(self, phrases, postings, posting_offsets, max_words):
+        self.phrases = phrases                  # sorted normalized values
+        self.postings = postings                # all the posting lists, back to back
+        self.posting_offsets = posting_offsets  # the posting list of phrases[i] is postings[offsets[i]:offsets[i+1]]
+        self.max_words = max_words              # the most words in a value
+
+    def arrays(self):
+        phrase_heap, phrase_offsets = pack_strings(self.phrases)
+        return {
+            'phraseHeap': phrase_heap,
+            'phraseOffsets': phrase_offsets,
+            'postings': self.postings,
+            'postingOffsets': array.array('L', self.posting_offsets),
+            'maxWords': array.array('L', [self.max_words]),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(PackedStrings(arrays['phraseHeap'], arrays['phraseOffsets']), arrays['postings'], arrays['postingOffsets'], arrays['maxWords'][0])
+
+    @classmethod
+    def build(cls, column):
+        rows_by_phrase = {}
+        if isinstance(column, DictColumn):
+            # Normalize each distinct value once, and walk the codes.
+            dictionary = column.dictionary
+            phrase_by_code = [normalize_phrase(dictionary[code]) for code in xrange(len(dictionary))]
+            keyed_rows = enumerate(column.codes[:])
+            phrase_of = phrase_by_code.__getitem__
+        else:
+            keyed_rows = ((idx, column[idx]) for idx in xrange(len(column)))
+            phrase_of = normalize_phrase
+
+        nulls = column.nulls
+        has_nulls = nulls.has_nulls()
+        for idx, key in keyed_rows:
+            if has_nulls and nulls.is_null(idx):
+                continue
+            phrase = phrase_of(key)
+            if not phrase: # no words at all: no search can match it
+                continue
+            if phrase in rows_by_phrase:
+                rows_by_phrase[phrase].append(idx)
+            else:
+                rows_by_phrase[phrase] = [idx]
+
+        phrases = sorted(rows_by_phrase)
+        postings = bytearray()
+        posting_offsets = [0]
+        for phrase in phrases:
+            postings.extend(encode_postings(rows_by_phrase[phrase]))
+            posting_offsets.append(len(postings))
+        max_words = max([phrase.count(' ') + 1 for phrase in phrases] or [0])
+        return cls(phrases, postings, posting_offsets, max_words)
+
+    def find(self, phrase):
+        """
+        The position of a (normalized) phrase in the dictionary, or None if no value is that phrase.
+        """
+        phrase = encode_string(phrase)
+        num = bisect_left(self.phrases, phrase)
+        if (num == len(self.phrases)) or (self.phrases[num] != phrase):
+            return None
+        return num
+
+    def find_phrases(self, words):
+        """
+        Return every run of consecutive `words` (of a search, see `phrase_words`) that is a whole value of the column.
+        """
+        return [run for run in word_runs(words, self.max_words) if self.find(' '.join(run)) is not None]
+
+    def lookup_phrase(self, phrase):
+        """
+        Return the sorted rows whose normalized value is `phrase`.
+        """
+        num = self.find(phrase)
+        if num is None:
+            return []
+        return decode_postings(self.postings, self.posting_offsets[num], self.posting_offsets[num + 1])
+
+
+def value_grams(value):
+    """
+    The distinct trigrams of a value (lower-cased, utf-8), with a terminator on both sides,
+    so that a value of one or two bytes still has some.
+    """
+    padded = STRING_TERMINATOR + encode_string(value).lower() + STRING_TERMINATOR
+    return set(padded[i:i + GRAM_SIZE] for i in xrange(len(padded) - GRAM_SIZE + 1))
+
+
+class TrigramIndex(object):
+    """
+    An n-gram index over the trigrams of a SEARCH_TYPE_CONTAINS string column.
+
+    A value contains a term only if it has every trigram of the term, so the rows of a term of three
+    bytes or more are the intersection of its trigrams' posting lists, starting from the shortest.
+    Those are only candidates ("abcd" has "abc" and "bcd", and so does "abcxbcd"), to be checked against
+    the column. A shorter term has no trigram of its own: its rows are those of every trigram that
+    contains it, found by scanning the (fixed-width) trigram dictionary. That one is exact.
+
+    Posting lists are decoded in python, a byte at a time, while a scan of the column runs in C.
+    So a term whose posting lists are long is left to a scan (see `lookup_contains`).
+    """
+
+    kind = 'trigram'
+
+    def __init__(self, grams, postings, posting_offsets):
+        self.grams = grams                      # the sorted trigrams, back to back
+        self.postings = postings                # all the posting lists, back to back
+        self.posting_offsets = posting_offsets  # the posting list of grams[i] is postings[offsets[i]:offsets[i+1]]
+
+    def arrays(self):
+        return {
+            'gramHeap': self.grams.heap,
+            'postings': self.postings,
+            'postingOffsets': array.array('L', self.posting_offsets),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(FixedStrings(arrays['gramHeap'], GRAM_SIZE), arrays['postings'], arrays['postingOffsets'])
+
+    @classmethod
+    def build(cls, column):
+        rows_by_gram = {}
+        if isinstance(column, DictColumn):
+            # The trigrams of each distinct value once, and walk the codes.
+            dictionary = column.dictionary
+            grams_by_code = [value_grams(dictionary[code]) for code in xrange(len(dictionary))]
+            keyed_rows = enumerate(column.codes[:])
+            grams_of = grams_by_code.__getitem__
+        else:
+            keyed_rows = ((idx, column[idx]) for idx in xrange(len(column)))
+            grams_of = value_grams
+
+        nulls = column.nulls
+        has_nulls = nulls.has_nulls()
+        for idx, key in keyed_rows:
+            if has_nulls and nulls.is_null(idx):
+                continue
+            for gram in grams_of(key):
+                if gram in rows_by_gram:
+                    rows_by_gram[gram].append(idx)
+                else:
+                    rows_by_gram[gram] = [idx]
+
+        grams = sorted(rows_by_gram)
+        postings = bytearray()
+        posting_offsets = [0]
+        for gram in grams:
+            postings.extend(encode_postings(rows_by_gram[gram]))
+            posting_offsets.append(len(postings))
+        return cls(FixedStrings(array.array('B', ''.join(grams)), GRAM_SIZE), postings, posting_offsets)
+
+    @staticmethod
+    def is_exact(term):
+        """
+        Whether the rows of `lookup_contains` are exactly those of the term, rather than candidates.
+        """
+        return len(encode_string(term)) < GRAM_SIZE
+
+    def posting_list(self, num):
+        return decode_postings(self.postings, self.posting_offsets[num], self.posting_offsets[num + 1])
+
+    def lookup_contains(self, term, max_rows=None):
+        """
+        Return the sorted rows whose value may contain `term` (see `is_exact`), or None if that would take
+        decoding more than `max_rows` rows (a row takes at least a byte of a posting list).
+        """
+        term = encode_string(term).lower()
+        grams = self.grams
+        offsets = self.posting_offsets
+        if len(term) < GRAM_SIZE:
+            # Every trigram with the term inside it (and not across two of them in the dictionary).
+            pattern = re.compile('(?=%s)' % re.escape(term), re.DOTALL)
+            nums = sorted(set(m.start() // GRAM_SIZE for m in pattern.finditer(grams.raw()) if m.start() % GRAM_SIZE + len(term) <= GRAM_SIZE))
+            if (max_rows is not None) and (sum(offsets[num + 1] - offsets[num] for num in nums) > max_rows):
+                return None
+            return merge_postings([self.posting_list(num) for num in nums])
+
+        sizes = []
+        for gram in set(term[i:i + GRAM_SIZE] for i in xrange(len(term) - GRAM_SIZE + 1)):
+            num = bisect_left(grams, gram)
+            if (num == len(grams)) or (grams[num] != gram):
+                return []
+            sizes.append((offsets[num + 1] - offsets[num], num))
+        sizes.sort()
+        if (max_rows is not None) and (sizes[0][0] > max_rows):
+            return None
+        rows = set(self.posting_list(sizes[0][1]))
+        for size, num in sizes[1:]:
+            # Decoding a list costs about as much as checking that many rows against the column.
+            if size >= len(rows):
+                break
+            rows.intersection_update(self.posting_list(num))
+            if not rows:
+                return []
+        return sorted(rows)
+
+
+class HashIndex(object):
+    """
+    An exact-match hash index for high-cardinality integer columns (ids).
+
+    It is an open-addressing (linear probing) table kept entirely in flat arrays,
+    so that it can be written to disk and memory-mapped back as is:
+    
+        keys[slot]                     ==> the key stored in that slot
+        rows[starts[slot]:starts[slot+1]] ==> the sorted rows holding that key (empty for a free slot)
+    """
+
+    kind = 'hash'
+
+    def __init__(self, keys, starts, rows):
+        self.keys = keys
+        self.starts = starts
+        self.rows = rows
+        self.bits = len(keys).bit_length() - 1
+        self.mask = len(keys) - 1
+
+    def slot(self, key):
+        # Fibonacci hashing, so that sequential ids are spread over the table.
+        return ((key * 11400714819323198485) & 0xffffffffffffffff) >> (64 - self.bits)
+
+    @classmethod
+    def build(cls, column):
+        rows_by_key = {}
+        for idx, value in enumerate(column.values[:]):
+            if value in rows_by_key:
+                rows_by_key[value].append(idx)
+            else:
+                rows_by_key[value] = [idx]
+        if column.nulls.has_nulls():
+            for idx in xrange(len(column)):
+                if column.nulls.is_null(idx):
+                    rows_by_key[column.values[idx]].remove(idx)
+
+        # Keep the table at most ~60% full.
+        size = 2
+        while size * 0.6 < len(rows_by_key):
+            size *= 2
+        keys = array.array('l', [0]) * size
+        slot_rows = [None] * size
+        index = cls(keys, None, None)
+        for key, key_rows in rows_by_key.iteritems():
+            if not key_rows:
+                continue
+            slot = index.slot(key)
+            while slot_rows[slot] is not None:
+                slot = (slot + 1) & index.mask
+            keys[slot] = key
+            slot_rows[slot] = key_rows
+
+        starts = array.array('L', [0])
+        rows = array.array('L')
+        for key_rows in slot_rows:
+            if key_rows is not None:
+                rows.extend(key_rows)
+            starts.append(len(rows))
+        return cls(keys, starts, rows)
+
+    def arrays(self):
+        return {'keys': self.keys, 'starts': self.starts, 'rows': self.rows}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays['keys'], arrays['starts'], arrays['rows'])
+
+    def lookup_equal(self, value):
+        if isinstance(value, basestring) or (value != int(value)):
+            return []
+        value = int(value)
+        keys, starts = self.keys, self.starts
+        slot = self.slot(value)
+        while starts[slot] != starts[slot + 1]:
+            if keys[slot] == value:
+                return list(self.rows[starts[slot]:starts[slot + 1]])
+            slot = (slot + 1) & self.mask
+        return []
+
+
+class SortedIndex(object):
+    """
+    An index for decimal and date columns: the column's (non-null) values sorted, together
+    with the row id permutation that sorts them. A value (or a range of them) is found with two bisects.
+    """
+
+    kind = 'sorted'
+
+    def __init__(self, values, rows):
+        self.values = values
+        self.rows = rows
+        self._distinct = None
+
+    @classmethod
+    def build(cls, column):
+        values = column.values[:]
+        order = column.nulls.drop_nulls(sorted(xrange(len(values)), key=values.__getitem__))
+        return cls(array.array(values.typecode, [values[idx] for idx in order]), array.array('L', order))
+
+    def arrays(self):
+        return {'values': self.values, 'rows': self.rows}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays['values'], arrays['rows'])
+
+    def lookup_equal(self, value):
+        if isinstance(value, basestring):
+            return []
+        lo = bisect_left(self.values, value)
+        hi = bisect_right(self.values, value, lo)
+        return sorted(self.rows[lo:hi])
+
+    def lookup_range(self, lo, hi):
+        """
+        The rows whose value is in [lo, hi).
+        """
+        return sorted(self.rows[bisect_left(self.values, lo):bisect_left(self.values, hi)])
+
+    def lookup_ranges(self, ranges):
+        """
+        The rows whose value is in any of the [lo, hi) ranges.
+        """
+        rows = []
+        for lo, hi in ranges:
+            rows.extend(self.rows[bisect_left(self.values, lo):bisect_left(self.values, hi)])
+        return sorted(rows)
+
+    def lookup_values(self, values):
+        """
+        The rows holding any of the (distinct) `values`. The values are grouped into runs
+        that are next to each other in `distinct_values`, and each run is read as one slice.
+        """
+        values = set(values)
+        rows = []
+        run_start = None
+        for value in self.distinct_values() + [None]:
+            if value in values:
+                if run_start is None:
+                    run_start = value
+                run_end = value
+            elif run_start is not None:
+                rows.extend(self.rows[bisect_left(self.values, run_start):bisect_right(self.values, run_end)])
+                run_start = None
+        return sorted(rows)
+
+    def distinct_values(self):
+        """
+        The sorted distinct values, found by jumping from one value to the next with a bisect.
+        """
+        if self._distinct is None:
+            values = self.values
+            distinct = []
+            idx = 0
+            while idx < len(values):
+                distinct.append(values[idx])
+                idx = bisect_right(values, values[idx], idx)
+            self._distinct = distinct
+        return self._distinct
+
+
+INDEX_CLASSES = dict((cls.kind, cls) for cls in (EdgeIndex, TrigramIndex, PhraseIndex, HashIndex, SortedIndex))
+
+
+class PackedStrings(object):
+    """
+    A read-only list of byte strings stored as a heap plus offsets (enough for `bisect`).
+    """
+
+    def __init__(self, heap, offsets):
+        self.heap = heap
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if not (0 <= idx < len(self)):
+            raise IndexError('PackedStrings index out of range')
+        return self.heap[self.offsets[idx]:self.offsets[idx + 1]].tostring()
+
+
+class FixedStrings(object):
+    """
+    A read-only list of byte strings that all have the same length, back to back in one heap (enough for `bisect`).
+    """
+
+    def __init__(self, heap, width):
+        self.heap = heap
+        self.width = width
+
+    def __len__(self):
+        return len(self.heap) // self.width
+
+    def __getitem__(self, idx):
+        if not (0 <= idx < len(self)):
+            raise IndexError('FixedStrings index out of range')
+        return self.heap[idx * self.width:(idx + 1) * self.width].tostring()
+
+    def raw(self):
+        if hasattr(self.heap, 'raw'): # a memory-mapped array
+            return self.heap.raw()
+        return buffer(self.heap)
+
+
+def pack_strings(strings):
+    heap = array.array('B')
+    offsets = array.array('L', [0])
+    for value in strings:
+        heap.fromstring(value)
+        offsets.append(len(heap))
+    return heap, offsets
+
+
+def index_kinds(column_info, store):
+    """
+    Which kind of index (if any) each field gets, as {field: kind}.
+    """
+    kinds = {}
+    for field, field_info in column_info.items():
+        if (field_info['type'] == DATA_TYPE_STRING) and (field_info['searchType'] == SEARCH_TYPE_EDGE):
+            kinds[field] = EdgeIndex.kind
+        # A dictionary-encoded column is already searched a distinct value at a time, which is quicker.
+        elif (field_info['type'] == DATA_TYPE_STRING) and (field_info['searchType'] == SEARCH_TYPE_CONTAINS) and not isinstance(store.column(field), DictColumn):
+            kinds[field] = TrigramIndex.kind
+        elif (field_info['type'] == DATA_TYPE_STRING) and (field_info['searchType'] == SEARCH_TYPE_EXACT) and (field_info['containsMultipleWords'] is True):
+            kinds[field] = PhraseIndex.kind
+        elif (field_info['searchType'] == SEARCH_TYPE_EXACT) and (field_info['type'] == DATA_TYPE_INTEGER):
+            kinds[field] = HashIndex.kind
+        elif (field_info['searchType'] == SEARCH_TYPE_EXACT) and (field_info['type'] == DATA_TYPE_DECIMAL):
+            kinds[field] = SortedIndex.kind
+        # A numeric prefix search is a union of ranges (see `numeric.py`).
+        elif (field_info['searchType'] != SEARCH_TYPE_OFF) and (field_info['type'] in (DATA_TYPE_INTEGER, DATA_TYPE_DECIMAL)):
+            kinds[field] = SortedIndex.kind
+        # A non-exact date search is also answered from the sorted serials (see `dates.py`).
+        elif (field_info['searchType'] != SEARCH_TYPE_OFF) and (field_info['type'] in (DATA_TYPE_DATE, DATA_TYPE_DATETIME, DATA_TYPE_TIME)):
+            kinds[field] = SortedIndex.kind
+    return kinds
+
+
+def build_indexes(store, column_info):
+    """
+    Build the index of every column that has one, as {field: index}.
+    """
+    indexes = {}
+    for field, kind in index_kinds(column_info, store).items():
+        indexes[field] = INDEX_CLASSES[kind].build(store.column(field))
+    return indexes
+
+
+def save_indexes(path, indexes, signature):
+    """
+    Write the indexes to one file, laid out like a data file (see `storage.py`):
+    a json header saying where each index's arrays are, then the arrays themselves.
+    """
+    header_indexes = []
+    segments = []
+    position = 0
+    for field, index in sorted(indexes.items()):
+        index_header = {'field': field, 'kind': index.kind, 'arrays': {}}
+        for name, values in sorted(index.arrays().items()):
+            typecode = getattr(values, 'typecode', 'B')
+            data = values.tostring() if isinstance(values, array.array) else str(values)
+            index_header['arrays'][name] = [position, len(data) // array.array(typecode).itemsize, typecode]
+            segments.append(data)
+            position += len(data) + (-len(data) % ALIGNMENT)
+        header_indexes.append(index_header)
+
+    header = json.dumps({'signature': signature, 'indexes': header_indexes})
+    data_start = PREAMBLE.size + len(header)
+    data_start += -data_start % ALIGNMENT
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(INDEX_MAGIC, INDEX_FORMAT_VERSION, len(header)))
+        f.write(header)
+        f.write('\x00' * (data_start - PREAMBLE.size - len(header)))
+        for data in segments:
+            f.write(data)
+            f.write('\x00' * (-len(data) % ALIGNMENT))
+    os.rename(tmp_path, path)
+
+
+def load_indexes(path, signature):
+    """
+    Memory-map an index file. Returns None if it is missing,
+    or if it was built from a different version of the data file.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        magic, version, header_length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+        if (magic != INDEX_MAGIC) or (version != INDEX_FORMAT_VERSION):
+            return None
+        header = json.loads(f.read(header_length))
+        if header['signature'] != signature:
+            return None
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    data_start = PREAMBLE.size + header_length
+    data_start += -data_start % ALIGNMENT
+
+    indexes = {}
+    for index_header in header['indexes']:
+        arrays = {}
+        for name, (offset, count, typecode) in index_header['arrays'].items():
+            arrays[name] = MappedArray(buf, data_start + offset, str(typecode), count)
+        indexes[index_header['field']] = INDEX_CLASSES[index_header['kind']].from_arrays(arrays)
+    return indexes
+
+
+def open_indexes(data_path, store, column_info):
+    """
+    Load the indexes persisted next to the data file,
+    building (and saving) them if they are missing or out of date.
+    """
+    index_path = data_path + '.idx'
+    signature = data_signature(data_path)
+    indexes = load_indexes(index_path, signature)
+    if (indexes is None) or (dict((field, index.kind) for field, index in indexes.items()) != index_kinds(column_info, store)):
+        indexes = build_indexes(store, column_info)
+        save_indexes(index_path, indexes, signature)
+    return indexes
@@ -0,0 +1,404 @@
+### Streaming csv ingestion: a raw csv export (such as `Sales1M.csv`) to a data file, in bounded memory.
+###
+###   $ python ingest.py Sales1M.csv Sales1M.bin --workers 4
+###
+### (1) The csv is cut into chunks of about `chunk_bytes`, each ending at the end of a line (so a quoted
+###     value can not span lines). Each chunk is read and converted by a worker process, a column at a
+###     time: the values are typed as `COLUMN_INFO` says, and dates in the usual formats ("3/9/18",
+###     "2014-01-01") are parsed without dateutil, each distinct date string only once (see `DateParser`).
+### (2) The converted chunks come back in order, and each column is appended to temporary files as it
+###     comes (string columns are dictionary-encoded on the way, unless they have too many distinct values).
+###     No more than two chunks per worker are in flight at once, so memory does not grow with the csv.
+### (3) The data file is then written from the temporary files (see `storage.write_columns`). It is the
+###     very same file `storage.write_store` would write from the whole table.
+
+import array
+import csv
+import datetime
+import multiprocessing
+import os
+import re
+import tempfile
+from collections import deque
+from itertools import izip_longest
+from dateutil.parser import parserinfo
+from columns import NullBitmap, StringColumn, TYPECODES, MAX_DICTIONARY_SIZE, STRING_TERMINATOR
+from constants import *
+from storage import write_columns
+
+
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+DEFAULT_WORKERS = multiprocessing.cpu_count()
+BLOCK_SIZE = 1024 * 1024  # bytes read back from a temporary file at a time
+MAX_CACHED_DATES = 100000 # distinct date strings a `DateParser` remembers
+FEW_DISTINCT_VALUES = 256 # a string column of a chunk with no more distinct values than this is coded without a python loop
+NULL_VALUES = ('nil', 'null')
+FALSE_VALUES = ('f', 'false', 'off', '0')
+
+MDY_RE = re.compile(r'^(\d{1,2})/(\d{1,2})/(\d{2}|\d{4})$') # 3/9/18
+YMD_RE = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})$')       # 2014-01-01
+EXCEL_EPOCH = datetime.date(1899, 12, 30)
+
+
+class DateParser(object):
+    """
+    Turns a date string into its serial number, as `search.excel_date` does, but without dateutil
+    for the formats of the csv exports, and only once per distinct string.
+    """
+
+    def __init__(self):
+        self.serials = {}
+        self.info = parserinfo() # two-digit years are put within 50 years of now, as dateutil does
+
+    def __call__(self, value):
+        serial = self.serials.get(value)
+        if serial is None:
+            if len(self.serials) >= MAX_CACHED_DATES:
+                self.serials.clear()
+            serial = self.serials[value] = self.parse(value)
+        return serial
+
+    def parse_all(self, values):
+        """
+        The serials of a list of date strings. Only the strings not seen before are looked at one by one.
+        """
+        serials = map(self.serials.get, values)
+        if None in serials:
+            serials = map(self, values)
+        return serials
+
+    def parse(self, value):
+        try:
+            m = MDY_RE.match(value)
+            if m is not None:
+                year = int(m.group(3))
+                if len(m.group(3)) == 2:
+                    year = self.info.convertyear(year)
+                return (datetime.date(year, int(m.group(1)), int(m.group(2))) - EXCEL_EPOCH).days
+            m = YMD_RE.match(value)
+            if m is not None:
+                return (datetime.date(int(m.group(1)), int(m.group(2)), int(m.group(3))) - EXCEL_EPOCH).days
+        except ValueError: # not a date in that format (such as "13/2/2014"), but dateutil may still read it
+            pass
+        from search import excel_date
+        return excel_date(value)
+
+
+def case_variants(word):
+    variants = ['']
+    for char in word:
+        variants = [variant + c for variant in variants for c in (char.lower(), char.upper())]
+    return variants
+
+
+# Every spelling of a null value, so that they can be found without lowering every value.
+NULL_SPELLINGS = frozenset([''] + [variant for value in NULL_VALUES for variant in case_variants(value)])
+
+
+def null_rows_of(values):
+    """
+    The rows of a tuple of csv values that are null. A column without nulls is not looked at in python.
+    """
+    if NULL_SPELLINGS.isdisjoint(values):
+        return []
+    return [idx for idx, value in enumerate(values) if value in NULL_SPELLINGS]
+
+
+def convert_values(values, data_type, parse_date):
+    """
+    Type a list of (non-null) csv values, as `helpers.read_csv_data` does.
+    """
+    if data_type == DATA_TYPE_DECIMAL:
+        return map(float, values)
+    if data_type == DATA_TYPE_INTEGER:
+        return map(int, values)
+    if data_type == DATA_TYPE_BOOLEAN:
+        return [value.lower() not in FALSE_VALUES for value in values]
+    if data_type in (DATA_TYPE_DATE, DATA_TYPE_DATETIME, DATA_TYPE_TIME):
+        return parse_date.parse_all(values)
+    raise ValueError('Unknown data type: %s' % data_type)
+
+
+def convert_column(values, data_type, parse_date):
+    """
+    Type the csv values of one column of a chunk (a tuple). Returns what the column's writer takes:
+    (the values as bytes, null rows) for a numeric column, and
+    (the distinct values, their codes as bytes, null rows) for a string column.
+    """
+    null_rows = null_rows_of(values)
+    if null_rows:
+        values = list(values)
+        # Stand-ins for the nulls, so that the whole column can go through `map`. They are zeroed (or emptied) below.
+        stand_in = next((value for value in values if value not in NULL_SPELLINGS), '')
+        for idx in null_rows:
+            values[idx] = stand_in
+
+    if data_type == DATA_TYPE_STRING:
+        for idx in null_rows:
+            values[idx] = '' # as a `StringColumn` stores a null
+        distinct = set(values)
+        if len(distinct) <= FEW_DISTINCT_VALUES:
+            # The codes are given in the order the values first appear in, as in `DictColumn.from_column`.
+            distinct = sorted(distinct, key=values.index)
+            code_by_value = dict((value, code) for code, value in enumerate(distinct))
+        else:
+            code_by_value = {}
+            for value in values:
+                if value not in code_by_value:
+                    code_by_value[value] = len(code_by_value)
+            distinct = sorted(code_by_value, key=code_by_value.get)
+        return distinct, array.array('L', map(code_by_value.__getitem__, values)).tostring(), null_rows
+
+    if len(null_rows) == len(values):
+        typed = [0] * len(values)
+    else:
+        typed = convert_values(values, data_type, parse_date)
+        for idx in null_rows:
+            typed[idx] = 0
+    return array.array(TYPECODES[data_type], typed).tostring(), null_rows
+
+
+_csv_path = None # the worker process' csv and columns
+_columns = None
+_parse_date = None
+
+
+def _init_worker(csv_path, columns):
+    global _csv_path, _columns, _parse_date
+    _csv_path, _columns, _parse_date = csv_path, columns, DateParser()
+
+
+def _convert_chunk(args):
+    """
+    Read and convert the bytes [start, stop) of the csv. Returns the number of rows, and each column converted.
+    """
+    start, stop = args
+    with open(_csv_path, 'rb') as f:
+        f.seek(start)
+        rows = list(csv.reader(f.read(stop - start).splitlines()))
+    if len(set(map(len, rows))) <= 1:
+        by_position = zip(*rows)
+    else: # short (or blank) rows: their missing values are null
+        by_position = list(izip_longest(*rows, fillvalue=''))
+    empty = ('',) * len(rows)
+    converted = []
+    for data_type, position in _columns:
+        values = by_position[position] if (position is not None) and (position < len(by_position)) else empty
+        converted.append(convert_column(values, data_type, _parse_date))
+    return len(rows), converted
+
+
+class Spill(object):
+    """
+    A temporary file that a segment of a column is appended to.
+    """
+
+    def __init__(self, directory):
+        self.f = tempfile.TemporaryFile(dir=directory)
+        self.size = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.size += len(data)
+
+    def chunks(self):
+        self.f.seek(0)
+        while True:
+            data = self.f.read(BLOCK_SIZE)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        self.f.close()
+
+
+class NumericWriter(object):
+
+    kind = 'numeric'
+
+    def __init__(self, data_type, directory):
+        self.typecode = TYPECODES[data_type]
+        self.values = Spill(directory)
+        self.nulls = NullBitmap()
+
+    def add(self, num_rows, converted):
+        data, null_rows = converted
+        self.values.write(data)
+        self.nulls.extend(num_rows, null_rows)
+
+    def segments(self):
+        return [('values', self.typecode, self.values.size, self.values.chunks()), ('nulls', 'B', len(self.nulls.bits), [str(self.nulls.bits)])]
+
+    def close(self):
+        self.values.close()
+
+
+class StringWriter(object):
+    """
+    Dictionary-encodes a string column as its chunks come in (like `DictColumn.from_column`),
+    and once it has too many distinct values, writes it as a heap and offsets instead.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.nulls = NullBitmap()
+        self.code_by_value = {}
+        self.values = []                # the distinct values, by code
+        self.codes = Spill(directory)   # the codes of the rows, as 'H' (None once it is a heap)
+        self.heap = self.offsets = None
+        self.heap_size = 0
+
+    @property
+    def kind(self):
+        return 'dictionary' if self.codes is not None else 'string'
+
+    def add(self, num_rows, converted):
+        distinct, data, null_rows = converted
+        self.nulls.extend(num_rows, null_rows)
+        codes = array.array('L')
+        codes.fromstring(data)
+        if self.codes is not None:
+            translation = []
+            for value in distinct:
+                code = self.code_by_value.get(value)
+                if code is None:
+                    if len(self.values) == MAX_DICTIONARY_SIZE:
+                        break
+                    code = self.code_by_value[value] = len(self.values)
+                    self.values.append(value)
+                translation.append(code)
+            else:
+                self.codes.write(array.array('H', [translation[code] for code in codes]).tostring())
+                return
+            self.switch_to_heap()
+        self.append_values([distinct[code] for code in codes])
+
+    def switch_to_heap(self):
+        """
+        Rewrite the rows so far as a heap and offsets.
+        """
+        self.heap, self.offsets = Spill(self.directory), Spill(self.directory)
+        self.heap.write(STRING_TERMINATOR)
+        self.offsets.write(array.array('L', [len(STRING_TERMINATOR)]).tostring())
+        self.heap_size = len(STRING_TERMINATOR)
+        for data in self.codes.chunks():
+            codes = array.array('H')
+            codes.fromstring(data)
+            self.append_values([self.values[code] for code in codes])
+        self.codes.close()
+        self.codes = self.code_by_value = self.values = None
+
+    def append_values(self, values):
+        offsets = array.array('L')
+        position = self.heap_size
+        for value in values:
+            position += len(value) + len(STRING_TERMINATOR)
+            offsets.append(position)
+        if values:
+            self.heap.write(STRING_TERMINATOR.join(values) + STRING_TERMINATOR)
+        self.offsets.write(offsets.tostring())
+        self.heap_size = position
+
+    def segments(self):
+        nulls = ('nulls', 'B', len(self.nulls.bits), [str(self.nulls.bits)])
+        if self.codes is None:
+            return [('offsets', 'L', self.offsets.size, self.offsets.chunks()), ('heap', 'B', self.heap.size, self.heap.chunks()), nulls]
+        dictionary = StringColumn()
+        for value in self.values:
+            dictionary.append(value)
+        if len(self.values) <= 256:
+            codes = ('codes', 'B', self.codes.size // 2, (array.array('B', array.array('H', data)).tostring() for data in self.codes.chunks()))
+        else:
+            codes = ('codes', 'H', self.codes.size, self.codes.chunks())
+        return [codes, nulls, ('dictionaryOffsets', 'L', len(dictionary.offsets) * dictionary.offsets.itemsize, [dictionary.offsets.tostring()]),
+                ('dictionaryHeap', 'B', len(dictionary.heap), [str(dictionary.heap)])]
+
+    def close(self):
+        for spill in (self.codes, self.heap, self.offsets):
+            if spill is not None:
+                spill.close()
+
+
+def chunk_ranges(f, start, size, chunk_bytes):
+    """
+    Cut the bytes [start, size) of a file into ranges of about `chunk_bytes` that end at the end of a line.
+    """
+    while start < size:
+        stop = start + chunk_bytes
+        if stop < size:
+            f.seek(stop - 1)
+            f.readline()
+            stop = f.tell()
+        stop = min(stop, size)
+        yield start, stop
+        start = stop
+
+
+def converted_chunks(csv_path, columns, ranges, workers):
+    """
+    Convert the chunks of the csv, in a pool of `workers` processes, yielding them in order.
+    """
+    if workers <= 1:
+        _init_worker(csv_path, columns)
+        for byte_range in ranges:
+            yield _convert_chunk(byte_range)
+        return
+    pool = multiprocessing.Pool(workers, _init_worker, (csv_path, columns))
+    try:
+        pending = deque()
+        for byte_range in ranges:
+            pending.append(pool.apply_async(_convert_chunk, (byte_range,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def ingest_csv(csv_path, out_path, column_info, workers=DEFAULT_WORKERS, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Convert a raw csv export to a data file (see the top of this file). Returns the number of rows.
+    """
+    with open(csv_path, 'rb') as f:
+        header = next(csv.reader([f.readline()]), [])
+        data_start = f.tell()
+        size = os.fstat(f.fileno()).st_size
+        ranges = list(chunk_ranges(f, data_start, size, chunk_bytes))
+    position_by_field = dict((field, position) for position, field in enumerate(header))
+    fields = sorted(column_info, key=lambda field: column_info[field]['index'])
+    columns = [(column_info[field]['type'], position_by_field.get(field)) for field in fields]
+
+    directory = os.path.dirname(os.path.abspath(out_path))
+    writers = [StringWriter(directory) if data_type == DATA_TYPE_STRING else NumericWriter(data_type, directory) for data_type, position in columns]
+    try:
+        num_rows = 0
+        for chunk_rows, converted in converted_chunks(csv_path, columns, ranges, workers):
+            for writer, column in zip(writers, converted):
+                writer.add(chunk_rows, column)
+            num_rows += chunk_rows
+        write_columns(out_path, num_rows, [(field, writer.kind, writer.nulls.null_count(), writer.segments()) for field, writer in zip(fields, writers)], column_info)
+    finally:
+        for writer in writers:
+            writer.close()
+    return num_rows
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    import time
+    from search import default_column_info
+    parser = argparse.ArgumentParser(description='Convert a csv export to a data file.')
+    parser.add_argument('csv_path')
+    parser.add_argument('out_path')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--chunk-mb', type=float, default=DEFAULT_CHUNK_BYTES / 1024.0 / 1024)
+    args = parser.parse_args()
+
+    t0 = time.time()
+    num_rows = ingest_csv(args.csv_path, args.out_path, default_column_info(), args.workers, int(args.chunk_mb * 1024 * 1024))
+    print >> sys.stderr, 'Wrote %s rows in %.1fs' % (num_rows, time.time() - t0)
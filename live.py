@@ -0,0 +1,207 @@
+### Searching as the user types, on a thread of its own (`LiveSearch`), where each new query cancels the ones before it.
+###
+### Once started, `Search.search` runs to the end: while "hdb" is still being searched, "hdbu" and "hdbuy" would
+### queue up behind it, and each of them would be searched in turn, although only the last one is still wanted.
+### Instead, `LiveSearch.submit(q)`:
+###
+###   (1) cancels the query being searched, and drops the one waiting to be searched, if any: there is only ever
+###       the one search running, and at most one waiting, so the CPU goes to the latest query
+###   (2) returns a `SearchTask` straight away, to wait on, cancel, or read the progress of
+###
+### The task is the search's cancellation token. The search is run a range of rows at a time, in row order (see
+### `Search.execute_ranges`, or a batch at a time when streaming), and the task is checked before each term and each
+### range: a cancelled search stops once the term it is on is done with its range (at most `Search.chunk_size` rows),
+### or with its index lookup. After each range the task has the number of matches so far, and the first ten of them,
+### so the first results can be shown before the search is done (they are final, as the rows go in order).
+###
+### The searches share the result cache of the `Search` they are made from, so "hdbuy" still only checks the rows that
+### "hdb" matched, if that one got to the end (see `cache.py`).
+
+import sys
+import threading
+import time
+import traceback
+from itertools import islice
+
+
+STATE_PENDING = 'pending'
+STATE_RUNNING = 'running'
+STATE_DONE = 'done'
+STATE_CANCELLED = 'cancelled'
+STATE_FAILED = 'failed'
+
+
+class SearchCancelled(Exception):
+    """
+    Raised in a search that was cancelled, and by `SearchTask.wait` for a task that was.
+    """
+    pass
+
+
+class SearchTask(object):
+    """
+    One query submitted to a `LiveSearch`. Each of its attributes is set in one go,
+    so they can be read from any thread.
+    """
+
+    def __init__(self, q, row=None, on_progress=None):
+        self.query = q
+        self.row = row # to read the first matches with
+        self.on_progress = on_progress
+        self.state = STATE_PENDING
+        self.cancelled = False
+        self.result = None  # the `SEARCH_INFO` of the search, once done
+        self.error = None   # the exc_info of a failed search
+        self.progress = {'RowsSearched': 0, 'NumRows': None, 'NumResults': 0, 'FirstTenResults': []}
+        self.submitted = time.time()
+        self.started = self.finished = None
+        self.finished_event = threading.Event()
+
+    def cancel(self):
+        """
+        Ask for the search to stop. It stops at the end of the range of rows it is searching, or never starts.
+        """
+        self.cancelled = True
+
+    def check(self):
+        """
+        Raise `SearchCancelled` if the task was cancelled (called by the search between two ranges of rows).
+        """
+        if self.cancelled:
+            raise SearchCancelled(self.query)
+
+    def report(self, rows_searched, num_rows, matches):
+        """
+        Take the progress of the search: the rows searched so far, and their matches (in row order).
+        """
+        first_ten = self.progress['FirstTenResults']
+        if (len(first_ten) < 10) and (self.row is not None):
+            first_ten = [self.row(idx) for idx in islice(matches, 10)]
+        self.progress = {'RowsSearched': rows_searched, 'NumRows': num_rows, 'NumResults': len(matches), 'FirstTenResults': first_ten}
+        if self.on_progress is not None:
+            self.on_progress(self)
+
+    def done(self):
+        return self.finished_event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the search to finish, and return its `SEARCH_INFO` (None if it is still going after `timeout` seconds).
+        Raises `SearchCancelled` if it was cancelled, and the search's own error if it failed.
+        """
+        if not self.finished_event.wait(timeout):
+            return None
+        if self.state == STATE_CANCELLED:
+            raise SearchCancelled(self.query)
+        if self.state == STATE_FAILED:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.result
+
+    def finish(self, state, result=None, error=None):
+        self.result, self.error = result, error
+        if result is not None:
+            self.progress = dict(self.progress, NumResults=result['NumResults'], FirstTenResults=result['FirstTenResults'])
+        self.finished = time.time()
+        self.state = state
+        self.finished_event.set()
+
+
+class LiveSearch(object):
+    """
+    Searches the latest query submitted to it, with a session of `search` (see `Search.session`) on a thread of its own.
+
+    `on_progress`, if given, is called with the task on that thread after each range of rows it searched,
+    and once when it finishes (whether it was done, cancelled or failed). A task dropped before it started
+    is finished as cancelled by `submit`, without a call.
+    """
+
+    def __init__(self, search, on_progress=None):
+        self.session = search.session()
+        self.on_progress = on_progress
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.pending = None # the latest query, if not started yet
+        self.running = None
+        self.closed = False
+        self.stats = {'Submitted': 0, 'Done': 0, 'Cancelled': 0, 'Failed': 0, 'Dropped': 0} # dropped: never started
+        self.thread = threading.Thread(target=self.work, name='live-search')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, q):
+        """
+        Search for `q` as soon as possible, cancelling the searches that were submitted before it.
+        Returns its `SearchTask`.
+        """
+        task = SearchTask(q, self.session.row, self.on_progress)
+        with self.lock:
+            if self.closed:
+                raise ValueError('LiveSearch is closed')
+            if self.running is not None:
+                self.running.cancel()
+            if self.pending is not None:
+                self.pending.cancel()
+                self.pending.finish(STATE_CANCELLED)
+                self.stats['Dropped'] += 1
+            self.pending = task
+            self.stats['Submitted'] += 1
+            self.wakeup.notify()
+        return task
+
+    def search(self, q, timeout=None):
+        """
+        Submit `q` and wait for it (see `SearchTask.wait`).
+        """
+        return self.submit(q).wait(timeout)
+
+    def work(self):
+        while True:
+            with self.lock:
+                while (self.pending is None) and not self.closed:
+                    self.wakeup.wait()
+                if self.closed:
+                    return
+                task, self.pending = self.pending, None
+                self.running = task
+            self.run(task)
+            with self.lock:
+                self.running = None
+                self.stats[{STATE_DONE: 'Done', STATE_CANCELLED: 'Cancelled', STATE_FAILED: 'Failed'}[task.state]] += 1
+            if self.on_progress is not None:
+                try:
+                    self.on_progress(task)
+                except Exception: # the thread has to keep going for the next query
+                    traceback.print_exc()
+
+    def run(self, task):
+        session = self.session
+        if task.cancelled:
+            task.finish(STATE_CANCELLED)
+            return
+        task.started = time.time()
+        task.state = STATE_RUNNING
+        try:
+            session.search(task.query, task)
+        except SearchCancelled:
+            task.finish(STATE_CANCELLED)
+        except Exception:
+            task.finish(STATE_FAILED, error=sys.exc_info())
+        else:
+            task.finish(STATE_DONE, result=session.SEARCH_INFO)
+
+    def close(self):
+        """
+        Cancel the searches, and stop the thread.
+        """
+        with self.lock:
+            self.closed = True
+            if self.running is not None:
+                self.running.cancel()
+            if self.pending is not None:
+                self.pending.cancel()
+                self.pending.finish(STATE_CANCELLED)
+                self.stats['Dropped'] += 1
+                self.pending = None
+            self.wakeup.notify()
+        self.thread.join()
+        self.session.close()
@@ -0,0 +1,122 @@
+### Numeric prefix/edge search, as numeric intervals instead of string matching.
+###
+### A non-exact search on a number compares the term against the number's string form,
+### e.g. "4.9" against a `price` of 4.95, or "1349" against an `id` of 134921. Rather than casting
+### every row to a string, the term is turned into the intervals of values whose string form it matches:
+###
+###   "4.9"  ==> [4.9, 5.0)
+###   "1349" ==> [1349, 1350), [13490, 13500), [134900, 135000), ... up to the column's maxValue
+###
+### and an EDGE search (which can also start after the '.' or '-') adds the values whose
+### fraction starts with the term, and the negative values. Each interval is then one range
+### of the column's sorted index.
+
+import re
+from bisect import bisect_right
+from constants import *
+
+
+NUMBER_PREFIX_RE = re.compile(r'^(\d+)(?:\.(\d*))?$')
+MAX_DIGITS = 18       # how far up the powers of 10 go when a column has no maxValue
+MAX_INTERVALS = 10000 # past this, the term is matched against the string form of the distinct values instead
+MAX_SCALE = 15
+
+
+def decimal_places(value):
+    """
+    The number of decimals in the shortest string form of a number, e.g. 4.99 ==> 2, 5.0 ==> 0.
+    """
+    text = repr(float(value)).lower()
+    mantissa, _, exponent = text.partition('e')
+    places = len(mantissa.partition('.')[2].rstrip('0')) - int(exponent or 0)
+    return min(max(places, 0), MAX_SCALE)
+
+
+def number_formatter(is_integral, scale):
+    """
+    Formats a number the way the column shows it: an integer as is, a decimal at the column's scale.
+    A zero has no sign (-0.0 + 0.0 is 0.0), as in the intervals, where -0.0 == 0.
+    """
+    if is_integral:
+        return lambda v: '%d' % v
+    scale = max(scale or 0, 1)
+    return lambda v: '%.*f' % (scale, v + 0.0)
+
+
+def merge_intervals(intervals):
+    merged = []
+    for lo, hi in sorted(intervals):
+        if hi <= lo:
+            continue
+        if merged and (lo <= merged[-1][1]):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def prefix_intervals(term, is_integral, scale, min_value=None, max_value=None, search_type=SEARCH_TYPE_STARTSWITH):
+    """
+    The sorted, non-overlapping [lo, hi) intervals of the values whose string form
+    the term matches, or None if that can not be worked out (a CONTAINS search, or too many intervals).
+
+    The values of a column are only as precise as its decimal `scale`, so every bound is moved down
+    by half a unit of the last decimal: that way a float stored as 4.8999999 still counts as 4.90.
+    """
+    if search_type not in (SEARCH_TYPE_STARTSWITH, SEARCH_TYPE_EDGE):
+        return None
+    m = NUMBER_PREFIX_RE.match(term)
+    if m is None:
+        return []
+    whole, fraction = m.group(1), m.group(2)
+    # A float always has a fraction in its string form ("5.0"), an integer never does.
+    scale = 0 if is_integral else max(scale or 0, 1)
+    if (fraction is not None) and (is_integral or (len(fraction) > scale)):
+        return []
+    if (len(whole) > 1) and whole.startswith('0'):
+        return []
+    upper = max_value if max_value is not None else 10 ** MAX_DIGITS
+    lower = min_value if min_value is not None else -upper
+
+    exact = [] # the intervals in exact terms, for the non-negative values
+    if fraction is not None:
+        width = 10 ** -len(fraction) if fraction else 1
+        lo = float('%s.%s' % (whole, fraction)) if fraction else int(whole)
+        exact.append((lo, lo + width))
+    else:
+        start = int(whole)
+        power = 1
+        while True:
+            exact.append((start * power, (start + 1) * power))
+            if (start == 0) or (start * power * 10 > max(abs(upper), abs(lower))):
+                break
+            power *= 10
+
+    if search_type == SEARCH_TYPE_EDGE:
+        # A word can also start right after the '.': "99" matches 4.99
+        if (fraction is None) and not is_integral and (len(whole) <= scale):
+            first, last = int(max(lower, 0)), int(max(abs(upper), abs(lower)))
+            if last - first > MAX_INTERVALS:
+                return None
+            width = 10 ** -len(whole)
+            exact.extend((num + int(whole) * width, num + (int(whole) + 1) * width) for num in xrange(first, last + 1))
+        if len(exact) > MAX_INTERVALS:
+            return None
+
+    half_unit = 0.5 * 10 ** -scale
+    intervals = [(lo - half_unit, hi - half_unit) for lo, hi in exact]
+    # ...and after the '-' of a negative value: "45" matches -45
+    if (search_type == SEARCH_TYPE_EDGE) and (lower < 0):
+        intervals.extend((-hi + half_unit, -lo + half_unit) for lo, hi in exact)
+    return [(max(lo, lower), min(hi, upper + half_unit)) for lo, hi in merge_intervals(intervals) if (hi > lower) and (lo <= upper)]
+
+
+def in_intervals(intervals):
+    """
+    A predicate telling whether a value falls in any of the sorted, non-overlapping intervals.
+    """
+    starts = [lo for lo, hi in intervals]
+    def predicate(v):
+        num = bisect_right(starts, v) - 1
+        return (num >= 0) and (v < intervals[num][1])
+    return predicate
@@ -0,0 +1,73 @@
+### Parallel execution of `search_all` over a process pool.
+###
+### The row range is cut into chunks, and each chunk is searched by a worker process.
+### Workers never receive rows: each one opens its own `Search` over the same data file,
+### which memory-maps the data and the indexes, so all the workers (and the parent)
+### share one copy of them in the page cache. Only the parsed search goes out, and
+### only the matching row indexes come back.
+
+import multiprocessing
+import os
+import time
+
+
+DEFAULT_CHUNK_SIZE = 131072
+
+_searcher = None # the worker process' own `Search`
+_plan_key = None
+_plan = None
+
+
+def _init_worker(data_path, column_info, engine):
+    global _searcher
+    from search import Search
+    _searcher = Search(data_path, engine=engine, column_info=column_info)
+
+
+def _search_chunk(args):
+    """
+    Search the rows [start, stop) in a worker, returning the matches and how long it took.
+    """
+    global _plan_key, _plan
+    search_key, search_info, start, stop = args
+    t0 = time.time()
+    # Compile once per search, as the index lookups are kept on the plan's matchers.
+    if search_key != _plan_key:
+        _searcher.SEARCH_INFO = search_info
+        _plan_key, _plan = search_key, _searcher.compile()
+    matches = _plan.execute(start, stop)
+    return sorted(matches), {'Pid': os.getpid(), 'RowsScanned': stop - start, 'Seconds': time.time() - t0}
+
+
+class ParallelScanner(object):
+    """
+    A pool of worker processes attached to one data file.
+    """
+
+    def __init__(self, data_path, column_info, workers, chunk_size=DEFAULT_CHUNK_SIZE, engine=None):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.pool = multiprocessing.Pool(workers, _init_worker, (data_path, column_info, engine))
+        self.searches = 0
+
+    def search(self, search_info, num_rows):
+        """
+        Search every row, returning the set of matches and the stats of each worker.
+        """
+        self.searches += 1
+        shared_info = dict((key, search_info[key]) for key in ('OriginalSearch', 'TokenizedSearch', 'Parsed'))
+        tasks = [(self.searches, shared_info, start, min(start + self.chunk_size, num_rows)) for start in xrange(0, num_rows, self.chunk_size)]
+
+        matches_at_index = set()
+        worker_stats = {}
+        for matches, chunk_stats in self.pool.imap_unordered(_search_chunk, tasks):
+            matches_at_index.update(matches)
+            stats = worker_stats.setdefault(chunk_stats['Pid'], {'Pid': chunk_stats['Pid'], 'Chunks': 0, 'RowsScanned': 0, 'Seconds': 0.0})
+            stats['Chunks'] += 1
+            stats['RowsScanned'] += chunk_stats['RowsScanned']
+            stats['Seconds'] += chunk_stats['Seconds']
+        return matches_at_index, sorted(worker_stats.values(), key=lambda stats: stats['Pid'])
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
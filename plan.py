@@ -0,0 +1,689 @@
+### Compiles the `Parsed` term objects of `SEARCH_INFO` into an execution plan.
+###
+### Everything that does not change from one row to the next is worked out once, up front:
+### each term object becomes a matcher with its column (and index) already bound, its regex
+### already compiled and its term already cased, and the tokens it covers become a bitmask
+### over `TokenizedSearch`. Executing the plan is then:
+###
+###   (1) every matcher returns the rows it matches (from an index, or one pass over its column).
+###       The tokens are taken most selective first, so that once a token's rows are known the
+###       other matchers only check those rows, or stop right away if there are none.
+###   (2) for each row that some matcher matched, OR the matchers' token masks together
+###       and see if every token of the search is covered. Or, with the bitmap engine,
+###       the same thing a term at a time: OR the rows per token, and AND across tokens.
+
+import time
+from bisect import bisect_left
+from bitmap import combine_bitmaps
+from columns import edge_pattern, startswith_pattern, contains_pattern
+from dates import formatter
+from index import normalize_phrase
+from numeric import prefix_intervals, in_intervals, number_formatter
+from profiling import NULL_PROFILE
+from rank import top_rows, DEFAULT_TOP_K
+from constants import *
+
+
+# How the rows of the matchers are combined (see `Plan.execute`)
+ENGINE_ROWS = 'rows'
+ENGINE_BITMAP = 'bitmap'
+
+# A term is checked row by row, instead of scanned for, when it has fewer than 1/NARROW_FRACTION
+# of the rows left to look at (a scan runs in C, but a check is a python call per row).
+NARROW_FRACTION = 16
+SCAN_COST = 1.0 / NARROW_FRACTION # a scan that runs in C (a regex over a heap, or over the raw bytes of an array)
+PREDICATE_SCAN_COST = 1.0         # a scan that calls a python predicate on every row: no cheaper than checking each row
+SAMPLE_SIZE = 256                 # rows checked to estimate how many rows a scanned-for term matches
+
+SEARCH_TYPE_NAMES = {
+    SEARCH_TYPE_OFF: 'OFF',
+    SEARCH_TYPE_EXACT: 'EXACT',
+    SEARCH_TYPE_STARTSWITH: 'STARTSWITH',
+    SEARCH_TYPE_EDGE: 'EDGE',
+    SEARCH_TYPE_CONTAINS: 'CONTAINS',
+}
+
+
+class Matcher(object):
+    """
+    One `Parsed` term object, bound to its column.
+
+    A matcher's rows come from one of three places, cheapest first:
+    rows that are already known (from an index lookup, or from the result cache), a check of
+    only some candidate rows, or a scan of the whole row range.
+    """
+
+    source = 'column scan'
+    refines_prefix = False # whether the rows of a term are always within the rows of any prefix of it
+    scan_cost = SCAN_COST  # the cost of a scan per row, where checking one row costs 1 (see `Plan.evaluation_order`)
+
+    def __init__(self, term_obj, column, index, mask, column_bit, claims_column):
+        self.term_obj = term_obj
+        self.field = term_obj['Field']
+        self.term = term_obj['searchAs']
+        self.search_type = term_obj['searchType']
+        self.column = column
+        self.index = index
+        self.mask = mask                    # the tokens this term covers, as bits of `TokenizedSearch`
+        self.column_bit = column_bit        # the column, as a bit
+        self.claims_column = claims_column  # once matched, no other term can use this column on that row
+        self.partial_rows = set()           # see `IncompleteExactMatcher`
+        self.known_rows = None              # all the rows of the table that this term matches, once known
+        self.candidates = None              # if set, the only rows this term can match (see `cache.py`)
+        self.from_cache = False
+        self.last_source = None             # where the rows of the last call to `rows` came from, and
+        self.last_evaluated = 0             # how many rows it had to look at (see `profiling.py`)
+        self._range_rows = None             # the rows of the ranges looked at so far, in order, and where they
+        self._range_partial_rows = None     # stop (see `add_range`)
+        self._range_stop = 0
+
+    def is_known(self):
+        """
+        Whether the rows of this term can be had without looking at the column.
+        """
+        return (self.known_rows is not None) or (self.index is not None)
+
+    def rows(self, start=0, stop=None, within=None):
+        """
+        Return the sorted rows in [start, stop) that this term matches.
+
+        If `within` (a sorted list of rows in the range) is given, only those rows need to be
+        looked at: a row outside of it may or may not be returned, even if it does match.
+        """
+        if self.known_rows is not None:
+            self.last_source, self.last_evaluated = 'result cache' if self.from_cache else 'known rows', 0
+            return restrict(self.known_rows, start, stop)
+        if self.index is not None:
+            # An index answers for the whole table at once, so the lookup is kept
+            # for the other row ranges of the same search.
+            self.known_rows = self.lookup()
+            self.last_source, self.last_evaluated = self.source, 0
+            return restrict(self.known_rows, start, stop)
+
+        # The candidates hold every row the term can match, so unlike `within`, they still give all of its rows.
+        whole_range = within is None
+        if self.candidates is not None:
+            candidates = restrict(self.candidates, start, stop)
+            within = candidates if within is None else sorted(set(candidates).intersection(within))
+        range_size = (len(self.column) if stop is None else stop) - start
+        # Checking rows one at a time only beats a scan when there are few enough of them.
+        if (within is not None) and (len(within) < range_size * self.scan_cost):
+            rows = self.filter(within)
+            self.last_source, self.last_evaluated = 'row check', len(within)
+        else:
+            rows = self.scan(start, stop)
+            self.last_source, self.last_evaluated = self.source, range_size
+        if whole_range:
+            self.add_range(start, stop, rows)
+        return rows
+
+    def add_range(self, start, stop, rows):
+        """
+        Keep all the rows of a range that this term matched. The whole table at once, or ranges that follow
+        each other from the first row to the last (see `Search.execute_ranges`), give all the rows of the term.
+        """
+        if (start == 0) and (stop is None):
+            self.known_rows = rows
+            return
+        if start == 0:
+            self._range_rows, self._range_partial_rows = [], set()
+        elif start != self._range_stop:
+            self._range_rows = None # out of order: this search will not see all of them
+        if self._range_rows is None:
+            return
+        self._range_rows.extend(rows)
+        self._range_partial_rows.update(self.partial_rows) # only those of the range, see `IncompleteExactMatcher`
+        self._range_stop = len(self.column) if stop is None else stop
+        if self._range_stop == len(self.column):
+            self.known_rows, self.partial_rows = self._range_rows, self._range_partial_rows
+            self._range_rows = None
+
+    def estimate(self, start, stop):
+        """
+        Estimate how many of the rows in [start, stop) this term matches, from a sample of evenly spaced rows
+        (this is only called when its rows are not known).
+        """
+        range_size = stop - start
+        if self.candidates is not None:
+            return len(restrict(self.candidates, start, stop))
+        if range_size < SAMPLE_SIZE * NARROW_FRACTION:
+            return range_size # not worth a sample: as good as a scan
+        step = range_size // SAMPLE_SIZE
+        partial_rows = self.partial_rows
+        matched = len(self.filter(xrange(start + step // 2, stop, step)))
+        self.partial_rows = partial_rows
+        return matched * step
+
+    def lookup(self):
+        """
+        Return every row that this term matches, from the index.
+        """
+        raise NotImplementedError
+
+    def scan(self, start, stop):
+        """
+        Return the rows in [start, stop) that this term matches, from the column.
+        """
+        raise NotImplementedError
+
+    def filter(self, rows):
+        """
+        Return the ones of the sorted `rows` that this term matches.
+        """
+        raise NotImplementedError
+
+    def explain(self):
+        return '%s %s %r via %s (tokens %s)' % (self.field, SEARCH_TYPE_NAMES[self.search_type], self.term, self.source, ', '.join(sorted(self.term_obj['Tokens'])))
+
+
+class ExactMatcher(Matcher):
+
+    def __init__(self, *args):
+        Matcher.__init__(self, *args)
+        if (self.index is not None) and (self.index.kind in ('hash', 'sorted')):
+            self.source = '%s index' % self.index.kind
+        else:
+            self.index = None
+
+    def lookup(self):
+        return self.index.lookup_equal(self.term)
+
+    def scan(self, start, stop):
+        return self.column.scan_equal(self.term, start, stop)
+
+    def filter(self, rows):
+        return self.column.filter_equal(self.term, rows)
+
+
+class PhraseScan(object):
+    """
+    The rows of a range of a string column, by their normalized value (see `index.normalize_phrase`): without a
+    phrase index, a search has a phrase term for every run of its words, and the values of each range are only
+    normalized once for all of them. Only the last range is kept.
+    """
+
+    def __init__(self, column):
+        self.column = column
+        self.range = None
+        self.rows_by_phrase = {}
+
+    def rows(self, phrase, start, stop):
+        if self.range != (start, stop):
+            column = self.column
+            rows_by_phrase = {}
+            for idx in column.nulls.drop_nulls(range(start, stop)):
+                rows_by_phrase.setdefault(normalize_phrase(column[idx]), []).append(idx)
+            self.range, self.rows_by_phrase = (start, stop), rows_by_phrase
+        return self.rows_by_phrase.get(phrase, [])
+
+
+class PhraseMatcher(Matcher):
+    """
+    An EXACT term on a multi-word string column, such as "terminator 2" against a `title`: the value, cut into
+    words the way a search is (see `index.normalize_phrase`), has to be the term. Answered from the column's
+    phrase index, or else by normalizing the values (once per distinct value of a dictionary-encoded column,
+    and once per range for all the phrase terms on the column otherwise, see `PhraseScan`).
+    """
+
+    scan_cost = PREDICATE_SCAN_COST
+
+    def __init__(self, *args):
+        Matcher.__init__(self, *args)
+        self.phrase = normalize_phrase(self.term)
+        if (self.index is not None) and (self.index.kind == 'phrase'):
+            self.source = 'phrase index'
+        else:
+            self.index = None
+            self.source = 'dictionary scan' if hasattr(self.column, 'dictionary') else 'column scan'
+            if hasattr(self.column, 'dictionary'):
+                self.scan_cost = SCAN_COST
+        self.phrase_scan = None # shared with the other phrase terms on the column, by `compile_plan`
+
+    def predicate(self, value):
+        return normalize_phrase(value) == self.phrase
+
+    def lookup(self):
+        return self.index.lookup_phrase(self.phrase)
+
+    def scan(self, start, stop):
+        if self.phrase_scan is not None:
+            return list(self.phrase_scan.rows(self.phrase, start, len(self.column) if stop is None else stop))
+        return self.column.scan(self.predicate, start, stop)
+
+    def filter(self, rows):
+        return self.column.filter(self.predicate, rows)
+
+
+class PatternMatcher(Matcher):
+    """
+    A STARTSWITH/EDGE/CONTAINS search over a string column. An edge search
+    is answered from the column's word-prefix index when it can be, and a contains
+    search from its trigram index.
+    """
+
+    PATTERNS = {
+        SEARCH_TYPE_STARTSWITH: startswith_pattern,
+        SEARCH_TYPE_EDGE: edge_pattern,
+        SEARCH_TYPE_CONTAINS: contains_pattern,
+    }
+    refines_prefix = True
+
+    def __init__(self, term_obj, column, index, mask, column_bit, claims_column, ignore_case):
+        Matcher.__init__(self, term_obj, column, index, mask, column_bit, claims_column)
+        self.pattern = self.PATTERNS[self.search_type](self.term, ignore_case)
+        # The index is case-insensitive. That is also right for a case-sensitive search, as that only
+        # happens on an isAllUpper/isAllLower column, where the term has already been cased to match.
+        if (self.index is not None) and (self.index.kind == 'edge') and (self.search_type == SEARCH_TYPE_EDGE) and self.index.can_lookup(self.term):
+            self.source = 'edge index'
+        else:
+            trigram_index = self.index if (self.index is not None) and (self.index.kind == 'trigram') and (self.search_type == SEARCH_TYPE_CONTAINS) and self.term else None
+            self.index = None
+            self.source = 'dictionary scan' if hasattr(column, 'dictionary') else 'column scan'
+            # A trigram index only narrows the rows down to the candidates, which are then checked like any other
+            # (see `Matcher.rows`), unless they are the exact rows. They are only worth having if there are few of them.
+            rows = trigram_index.lookup_contains(self.term, int(len(column) * self.scan_cost)) if trigram_index is not None else None
+            if (rows is not None) and trigram_index.is_exact(self.term):
+                self.known_rows = rows
+                self.source = 'trigram index'
+            elif rows is not None:
+                self.candidates = rows
+                self.source = 'trigram index + row check'
+
+    def lookup(self):
+        return self.index.lookup_prefix(self.term)
+
+    def scan(self, start, stop):
+        return self.column.scan_pattern(self.pattern, start, stop)
+
+    def filter(self, rows):
+        return self.column.filter_pattern(self.pattern, rows)
+
+
+class IncompleteExactMatcher(PatternMatcher):
+    """
+    An EXACT string term that has `_AllowIncompleteMatch`: it is treated as an edge search,
+    and the rows where it only matched that way are kept in `partial_rows`.
+    """
+
+    def __init__(self, term_obj, column, index, mask, column_bit, claims_column, ignore_case):
+        edge_term_obj = dict(term_obj, searchType=SEARCH_TYPE_EDGE)
+        PatternMatcher.__init__(self, edge_term_obj, column, index, mask, column_bit, claims_column, ignore_case)
+        self.term_obj = term_obj
+        self.search_type = SEARCH_TYPE_EXACT
+        self.source = 'exact scan + %s' % self.source
+        # The index only answers the edge half, so the matcher as a whole still needs a scan.
+        self.edge_index, self.index = self.index, None
+        self._edge_rows = None
+        self.scan_cost = SCAN_COST if self.edge_index is not None else 2 * SCAN_COST
+
+    def scan(self, start, stop):
+        exact_rows = self.column.scan_equal(self.term, start, stop)
+        if self.edge_index is not None:
+            if self._edge_rows is None:
+                self._edge_rows = self.edge_index.lookup_prefix(self.term)
+            edge_rows = restrict(self._edge_rows, start, stop)
+        else:
+            edge_rows = PatternMatcher.scan(self, start, stop)
+        return self.combine(exact_rows, edge_rows)
+
+    def filter(self, rows):
+        return self.combine(self.column.filter_equal(self.term, rows), PatternMatcher.filter(self, rows))
+
+    def combine(self, exact_rows, edge_rows):
+        exact_rows = set(exact_rows)
+        self.partial_rows = set(edge_rows) - exact_rows
+        return sorted(exact_rows.union(edge_rows))
+
+
+class NumericMatcher(Matcher):
+    """
+    A non-exact search on a numeric column. A prefix/edge term is turned into intervals of values
+    (see `numeric.py`), read off the sorted index or checked with a bisect. Otherwise (CONTAINS),
+    the values are formatted as strings at the column's decimal scale: once per distinct value
+    with an index, or once per row without.
+    """
+
+    refines_prefix = True
+    scan_cost = PREDICATE_SCAN_COST
+
+    def __init__(self, term_obj, column, index, mask, column_bit, claims_column, field_info):
+        Matcher.__init__(self, term_obj, column, index, mask, column_bit, claims_column)
+        self.pattern = PatternMatcher.PATTERNS[self.search_type](self.term, True)
+        is_integral = field_info['type'] == DATA_TYPE_INTEGER
+        self.cast = number_formatter(is_integral, field_info.get('decimalScale'))
+        self.intervals = prefix_intervals(self.term, is_integral, field_info.get('decimalScale'), field_info['minValue'], field_info['maxValue'], self.search_type)
+        if (self.index is not None) and (self.index.kind == 'sorted'):
+            self.source = 'intervals of sorted index' if self.intervals is not None else 'cast distinct values + sorted index'
+        else:
+            self.index = None
+            self.source = 'interval scan' if self.intervals is not None else 'cast column scan'
+
+    def lookup(self):
+        if self.intervals is not None:
+            return self.index.lookup_ranges(self.intervals)
+        distinct = self.index.distinct_values()
+        search, cast = self.pattern.search, self.cast
+        return self.index.lookup_values([v for v in distinct if search('\x00%s\x00' % cast(v))])
+
+    def predicate(self):
+        if self.intervals is not None:
+            return in_intervals(self.intervals)
+        # Between terminators, like a value in a string column's heap, so that the anchored patterns work.
+        search, cast = self.pattern.search, self.cast
+        return lambda v: search('\x00%s\x00' % cast(v)) is not None
+
+    def scan(self, start, stop):
+        return self.column.scan(self.predicate(), start, stop)
+
+    def filter(self, rows):
+        return self.column.filter(self.predicate(), rows)
+
+
+class DateMatcher(Matcher):
+    """
+    A non-exact search on a date/time column. The term is matched against each distinct serial's
+    formatted value once (see `dates.py`), and the rows holding the serials that matched are then
+    read off the sorted index, or found by comparing numbers: no row is ever formatted.
+    """
+
+    refines_prefix = True
+    scan_cost = PREDICATE_SCAN_COST
+
+    def __init__(self, term_obj, column, index, mask, column_bit, claims_column, formatter):
+        Matcher.__init__(self, term_obj, column, index, mask, column_bit, claims_column)
+        self.pattern = PatternMatcher.PATTERNS[self.search_type](self.term, True)
+        self.formatter = formatter
+        self.serial_range = formatter.serial_range(self.term, self.search_type)
+        if (self.index is not None) and (self.index.kind == 'sorted'):
+            self.source = 'serial range of sorted index' if self.serial_range else 'formatted serials + sorted index'
+        else:
+            self.index = None
+            self.source = 'serial range scan' if self.serial_range else 'formatted serials + column scan'
+        self._serials = None
+
+    def serials(self):
+        """
+        The set of serials that the term matches.
+        """
+        if self._serials is None:
+            distinct = self.index.distinct_values() if self.index is not None else sorted(set(self.column.values[:]))
+            if self.serial_range:
+                lo, hi = self.serial_range
+                distinct = distinct[bisect_left(distinct, lo):bisect_left(distinct, hi)]
+                self._serials = set(distinct)
+            else:
+                self._serials = set(self.formatter.matching_serials(self.pattern, distinct))
+        return self._serials
+
+    def lookup(self):
+        if self.serial_range:
+            return self.index.lookup_range(*self.serial_range)
+        return self.index.lookup_values(self.serials())
+
+    def predicate(self):
+        serials = self.serials()
+        return lambda v: v in serials
+
+    def scan(self, start, stop):
+        return self.column.scan(self.predicate(), start, stop)
+
+    def filter(self, rows):
+        return self.column.filter(self.predicate(), rows)
+
+
+def restrict(rows, start, stop):
+    """
+    Return the part of a sorted list of rows that falls in [start, stop).
+    """
+    if (start == 0) and (stop is None):
+        return rows
+    return rows[bisect_left(rows, start):len(rows) if stop is None else bisect_left(rows, stop)]
+
+
+class Plan(object):
+    """
+    The compiled form of one search.
+    """
+
+    def __init__(self, matchers, full_mask, original_search_string, engine=ENGINE_ROWS, profile=None):
+        self.matchers = matchers
+        self.full_mask = full_mask
+        self.original_search_string = original_search_string
+        self.engine = engine
+        self.profile = profile # a `Profile` to record each term's work in, if the search is being profiled
+        self.task = None       # a task to check before each term, if the search can be cancelled (see `live.py`)
+
+    def execute(self, start=0, stop=None):
+        """
+        Return the set of rows in [start, stop) that fully match the search.
+        
+        The matchers' rows are combined either row by row (ENGINE_ROWS), or a whole
+        term at a time with row bitmaps (ENGINE_BITMAP, see `bitmap.py`).
+        """
+        if not self.full_mask:
+            return set()
+        profile = self.profile or NULL_PROFILE
+        with profile.phase('scan'):
+            matcher_rows = self.matcher_rows(start, stop)
+        with profile.phase('combine'):
+            return self.combine(matcher_rows)
+
+    def top(self, k=DEFAULT_TOP_K, deleted=None):
+        """
+        Return the number of rows that fully match the search, and the best `k` of them
+        as (row index, score), best first (see `rank.py`). This is always done with row bitmaps.
+        The rows in `deleted`, if any, are left out.
+        """
+        if not self.full_mask:
+            return 0, []
+        profile = self.profile or NULL_PROFILE
+        with profile.phase('scan'):
+            matcher_rows = self.matcher_rows()
+        with profile.phase('rank'):
+            return top_rows(self, matcher_rows, k, deleted)
+
+    def matcher_rows(self, start=0, stop=None):
+        """
+        Return the rows in [start, stop) of each matcher, looking at as few rows as possible.
+
+        A match has to be one of the rows that some term of each token matched. So once every term of
+        a token has its rows, the terms still to go only need to look at those rows (or at none, if the
+        token matched nothing). The tokens are taken most selective first (see `evaluation_order`),
+        so that most rows are ruled out by the first token or two, and never looked at again.
+        """
+        matchers = self.matchers
+        if not matchers:
+            return []
+        range_size = (len(matchers[0].column) if stop is None else stop) - start
+        with (self.profile or NULL_PROFILE).phase('estimate'):
+            order = self.evaluation_order(start, stop)
+
+        matcher_rows = [None] * len(matchers)
+        within = None
+        for bit in order + [None]: # ...and last, the terms that cover no token
+            covering = [num for num, matcher in enumerate(matchers) if (matcher.mask & bit if bit is not None else not matcher.mask)]
+            for num in covering:
+                if matcher_rows[num] is None:
+                    matcher_rows[num] = self.rows(matchers[num], start, stop, within) if within != [] else []
+            pending = [matchers[num] for num, rows in enumerate(matcher_rows) if rows is None]
+            if (bit is None) or not pending:
+                continue
+            # Only narrow down to a token with few enough rows to make a difference to the terms still
+            # to go, so that building the set is never the expensive part.
+            covering_rows = [matcher_rows[num] for num in covering]
+            if sum(len(rows) for rows in covering_rows) >= range_size * max(matcher.scan_cost for matcher in pending):
+                continue
+            token_rows = set()
+            for rows in covering_rows:
+                token_rows.update(rows)
+            within = sorted(token_rows.intersection(within) if within is not None else token_rows)
+        return matcher_rows
+
+    def evaluation_order(self, start=0, stop=None):
+        """
+        The tokens (as bits), in the order their terms should be evaluated in: fewest estimated rows first,
+        then cheapest first. A term whose rows are known (or can be looked up) costs nothing, and its estimate
+        is exact. The others are estimated from a sample of rows (see `Matcher.estimate`), and cost a scan.
+
+        Note that this is only the order the rows are found in: the plan order still decides
+        which term claims a column on a row (see `match_row`).
+        """
+        matchers = self.matchers
+        token_bits = list(self.token_bits())
+        if len(token_bits) == 1:
+            return token_bits
+        stop_row = len(matchers[0].column) if stop is None else stop
+        estimates = []
+        for matcher in matchers:
+            if matcher.is_known():
+                estimates.append((len(self.rows(matcher, start, stop)), 0.0))
+            else:
+                estimates.append((matcher.estimate(start, stop_row), (stop_row - start) * matcher.scan_cost))
+
+        def token_estimate(bit):
+            covering = [estimate for matcher, estimate in zip(matchers, estimates) if matcher.mask & bit]
+            return (sum(rows for rows, cost in covering), sum(cost for rows, cost in covering))
+        return sorted(token_bits, key=token_estimate)
+
+    def rows(self, matcher, start=0, stop=None, within=None):
+        """
+        The rows of one matcher (see `Matcher.rows`), counted in the profile if there is one.
+        """
+        if self.task is not None:
+            self.task.check()
+        if self.profile is None:
+            return matcher.rows(start, stop, within)
+        t0 = time.time()
+        rows = matcher.rows(start, stop, within)
+        self.profile.add_term(self.matchers.index(matcher), matcher, rows, time.time() - t0, start, len(matcher.column) if stop is None else stop)
+        return rows
+
+    def combine(self, matcher_rows):
+        """
+        Return the set of rows that fully match the search, given the rows of each matcher.
+        """
+        if self.engine == ENGINE_BITMAP:
+            return combine_bitmaps(self, matcher_rows)
+
+        # A row that leaves a token that none of its matchers could cover is dropped straight away,
+        # which is most of them in a search of several tokens: only the rest need the full check.
+        alive = None
+        if self.full_mask & (self.full_mask - 1): # more than one token
+            for bit in self.token_bits():
+                covered = set()
+                for matcher, rows in zip(self.matchers, matcher_rows):
+                    if matcher.mask & bit:
+                        covered.update(rows)
+                alive = covered if alive is None else alive.intersection(covered)
+                if not alive:
+                    return set()
+
+        # Row index ==> the matchers (by position) that match on that row
+        matchers_at_row = {}
+        for num, rows in enumerate(matcher_rows):
+            for idx in rows if alive is None else alive.intersection(rows):
+                if idx in matchers_at_row:
+                    matchers_at_row[idx].append(num)
+                else:
+                    matchers_at_row[idx] = [num]
+
+        return set(idx for idx, nums in matchers_at_row.iteritems() if self.match_row(idx, nums))
+
+    def match_row(self, idx, nums):
+        """
+        Whether a row is a full match, given the matchers (by position, in order) that match on it.
+        """
+        matchers = self.matchers
+        full_mask = self.full_mask
+        matched = 0
+        claimed = 0
+        partial_matchers = None
+        for num in nums:
+            matcher = matchers[num]
+            if claimed & matcher.column_bit:
+                continue
+            matched |= matcher.mask
+            if idx in matcher.partial_rows:
+                partial_matchers = (partial_matchers or []) + [matcher]
+            if matched == full_mask:
+                break
+            if matcher.claims_column:
+                claimed |= matcher.column_bit
+
+        if matched != full_mask:
+            return False
+        # For partial matches, do a reverse search:
+        # the field's value has to be found in the raw search string
+        if partial_matchers and any(m.column[idx].lower() not in self.original_search_string for m in partial_matchers):
+            return False
+        return True
+
+    def token_bits(self):
+        bit = 1
+        while bit <= self.full_mask:
+            yield bit
+            bit <<= 1
+
+    def explain(self):
+        """
+        A readable description of what the plan will do, one line per matcher.
+        """
+        lines = ['%s. %s' % (num, matcher.explain()) for num, matcher in enumerate(self.matchers)]
+        return '\n'.join(lines) if lines else '(nothing to search)'
+
+
+def compile_plan(search_info, column_info, store, indexes, engine=ENGINE_ROWS, profile=None):
+    """
+    Compile `SEARCH_INFO['Parsed']` into a `Plan`.
+    """
+    token_bits = dict((token, 1 << num) for num, token in enumerate(search_info['TokenizedSearch']))
+    field_bits = dict((field, 1 << num) for num, field in enumerate(sorted(column_info)))
+
+    matchers = []
+    phrase_scans = {}
+    for term_obj in search_info['Parsed']:
+        field = term_obj['Field']
+        field_info = column_info[field]
+        data_type = term_obj['dataType']
+        search_type = term_obj['searchType']
+        term = term_obj['searchAs']
+        column = store.column(field)
+        index = indexes.get(field)
+
+        mask = 0
+        for token in term_obj['Tokens']:
+            mask |= token_bits.get(token, 0)
+        claims_column = (data_type != DATA_TYPE_STRING) or (field_info['containsMultipleWords'] is False)
+        args = (term_obj, column, index, mask, field_bits[field], claims_column)
+
+        # Compare against lower since the searchTerm will be lowered.
+        ignore_case = not any([field_info['isAllUpper'], field_info['isAllLower']])
+
+        if search_type == SEARCH_TYPE_EXACT:
+            # A multi-word string column is only searched for whole phrases (see `build_search_info`).
+            if (data_type == DATA_TYPE_STRING) and (field_info['containsMultipleWords'] is True):
+                matcher = PhraseMatcher(*args)
+                if matcher.source == 'column scan':
+                    matcher.phrase_scan = phrase_scans.setdefault(field, PhraseScan(column))
+                matchers.append(matcher)
+            elif term_obj['_AllowIncompleteMatch'] is True:
+                matchers.append(IncompleteExactMatcher(*(args + (ignore_case,))))
+            else:
+                matchers.append(ExactMatcher(*args))
+        elif search_type not in PatternMatcher.PATTERNS:
+            continue
+        # Almost no performance loss when comparing two numbers, so why not try on an exact match to start
+        elif not isinstance(term, basestring):
+            matchers.append(ExactMatcher(*args))
+        elif data_type == DATA_TYPE_STRING:
+            matchers.append(PatternMatcher(*(args + (ignore_case,))))
+        # Dates must be compared as a string based on their dataTypeFormat,
+        # So, for example, we can compare "mar" against "mar 1, 2014".
+        # Or, we can compare "2014-01" against "2014-01-01".
+        elif data_type in (DATA_TYPE_DATE, DATA_TYPE_DATETIME, DATA_TYPE_TIME):
+            matchers.append(DateMatcher(*(args + (formatter(data_type, term_obj.get('dateTypeFormat')),))))
+        elif data_type in (DATA_TYPE_INTEGER, DATA_TYPE_DECIMAL):
+            matchers.append(NumericMatcher(*(args + (field_info,))))
+
+    full_mask = (1 << len(search_info['TokenizedSearch'])) - 1
+    return Plan(matchers, full_mask, search_info['OriginalSearch'].lower(), engine, profile)
@@ -0,0 +1,170 @@
+### Opt-in instrumentation of a search, for when a query is slow and we need to know why.
+###
+### With `Search(profile=True)` (or a `metrics_hook`), every `search()` leaves a `Profile` in
+### `SEARCH_INFO['Profile']`:
+###
+###   - Phases: the wall time of each phase, in order. A phase that runs inside another one
+###             (tokenize inside parse) is not counted twice, so they add up to the whole search.
+###   - Terms:  for each `Parsed` term object, where its rows came from (an index, the result cache,
+###             a check of candidate rows or a column scan), how many rows it evaluated, how many it
+###             did not have to look at, how many it matched, and how long that took.
+###   - Memory: the bytes of the columns and indexes the search used, and the process' peak memory.
+###
+### The `metrics_hook` is then called with the profile and the whole `SEARCH_INFO`, to send them
+### wherever the metrics go. When profiling is off, the phases go to `NULL_PROFILE`, which does nothing.
+
+import array
+import time
+from collections import OrderedDict
+from storage import MappedArray, _column_segments
+
+try:
+    import resource
+except ImportError: # not on windows
+    resource = None
+
+
+def nbytes(segment):
+    """
+    The size of an array-like segment of a column or index (0 if it is not one).
+    """
+    if isinstance(segment, MappedArray):
+        return segment.count * segment.itemsize
+    if isinstance(segment, array.array):
+        return len(segment) * segment.itemsize
+    if isinstance(segment, (str, buffer, bytearray)):
+        return len(segment)
+    return 0
+
+
+def column_bytes(column):
+    return sum(nbytes(segment) for name, segment in _column_segments(column))
+
+
+def index_bytes(index):
+    """
+    The size of an index's arrays, whether they were just built or are mapped from its file.
+    """
+    size = 0
+    for value in vars(index).values():
+        if hasattr(value, 'heap') and hasattr(value, 'offsets'): # `PackedStrings`
+            size += nbytes(value.heap) + nbytes(value.offsets)
+        else:
+            size += nbytes(value)
+    return size
+
+
+def peak_memory_mb():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0 # kilobytes, on linux
+
+
+class Phase(object):
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile.stack.append([time.time(), 0.0])
+        return self
+
+    def __exit__(self, *exc_info):
+        t0, nested = self.profile.stack.pop()
+        elapsed = time.time() - t0
+        self.profile.add_phase(self.name, elapsed - nested)
+        if self.profile.stack:
+            self.profile.stack[-1][1] += elapsed
+
+
+class Profile(object):
+    """
+    What one search spent its time and memory on.
+    """
+
+    def __init__(self):
+        self.phases = OrderedDict() # name ==> seconds
+        self.terms = OrderedDict()  # matcher number ==> stats
+        self.ranges = {}            # matcher number ==> the row ranges already counted in its stats
+        self.stack = []             # [start time, time spent in nested phases] of the open phases
+        self.t0 = time.time()
+
+    def phase(self, name):
+        """
+        Time a phase, as in `with profile.phase('scan'): ...`
+        """
+        return Phase(self, name)
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_term(self, num, matcher, rows, seconds, start, stop):
+        """
+        Count one call to `Matcher.rows` for the rows [start, stop). A matcher can be asked for the
+        rows of the same range more than once (see `Plan.matcher_rows`), and those rows are only counted once.
+        """
+        stats = self.terms.get(num)
+        if stats is None:
+            stats = self.terms[num] = {
+                'Field': matcher.field,
+                'searchType': matcher.search_type,
+                'searchAs': matcher.term,
+                'Tokens': sorted(matcher.term_obj['Tokens']),
+                'Sources': [],
+                'RowsEvaluated': 0,
+                'RowsSkipped': 0,
+                'RowsMatched': 0,
+                'Seconds': 0.0,
+            }
+            self.ranges[num] = set()
+        stats['Seconds'] += seconds
+        # (The matchers of the plans of different segments, see `segments.py`, share their numbers.)
+        key = (id(matcher), start, stop)
+        if key in self.ranges[num]:
+            return
+        self.ranges[num].add(key)
+        if matcher.last_source not in stats['Sources']:
+            stats['Sources'].append(matcher.last_source)
+        stats['RowsEvaluated'] += matcher.last_evaluated
+        stats['RowsSkipped'] += (stop - start) - matcher.last_evaluated
+        stats['RowsMatched'] += len(rows)
+
+    def as_dict(self, store=None, indexes=None, fields=(), cache=None):
+        """
+        The profile as plain data, with the memory of the `fields` the search used.
+        """
+        memory = OrderedDict()
+        for field in fields:
+            memory[field] = {
+                'ColumnBytes': column_bytes(store.column(field)) if store is not None else None,
+                'IndexBytes': index_bytes(indexes[field]) if (indexes is not None) and (field in indexes) else 0,
+            }
+        return {
+            'Seconds': time.time() - self.t0,
+            'Phases': self.phases,
+            'Terms': self.terms.values(),
+            'Memory': {
+                'Fields': memory,
+                'CacheBytes': cache.size if cache is not None else 0,
+                'PeakMemoryMB': peak_memory_mb(),
+            },
+        }
+
+
+class NullProfile(object):
+    """
+    The profile of a search that is not being profiled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def phase(self, name):
+        return self
+
+
+NULL_PROFILE = NullProfile()
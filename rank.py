@@ -0,0 +1,138 @@
+### Ranking the matches of a search (`Search.search_top`), to return the K best of them rather than the first K.
+###
+### A row scores higher when the terms that cover the search on it:
+###
+###   - match exactly, rather than at the start of a value or a word (or anywhere in it)
+###   - cover several tokens at once, such as the three tokens of "mar. 4, 2014" matched as one date
+###   - use fewer fields
+###
+### The score of a row only depends on which terms matched it (and which of them only partially matched it).
+### So rather than scoring the rows one by one, the bitmap of the matches is split by the bitmap of each term
+### into groups of rows that have the same terms, and each group is scored once. The top K are then read off the
+### groups with the best scores, in row order, so no more than K rows are ever taken out of a bitmap, and the
+### number of matches is a count of the bits of the bitmap.
+
+import heapq
+from itertools import islice
+from bitmap import RowBitmap, match_bitmap
+from constants import *
+
+
+DEFAULT_TOP_K = 10
+
+# How much a term adds to the score of a row, per token that it covers
+TERM_QUALITY = {
+    SEARCH_TYPE_EXACT: 3,
+    SEARCH_TYPE_STARTSWITH: 2,
+    SEARCH_TYPE_EDGE: 2,
+    SEARCH_TYPE_CONTAINS: 1,
+}
+PARTIAL_QUALITY = TERM_QUALITY[SEARCH_TYPE_EDGE] # an incomplete exact term on a row where it only matched as an edge
+MULTI_TOKEN_BONUS = 2 # per token, after the first, that a single term covers
+FIELD_PENALTY = 1     # per field used to cover the search
+
+# Past this many groups (a search of many terms, each matching rows of its own), the rows are scored one by one.
+MAX_GROUPS = 256
+
+
+def num_bits(mask):
+    return bin(mask).count('1')
+
+
+def row_score(plan, nums, partial_nums=()):
+    """
+    The score of a row, given the matchers (by position) that matched it, and those that only partially did.
+
+    The matchers that cover the most tokens, and then the best quality ones, are taken first,
+    as long as they cover a token that is not covered yet (and their column is not claimed, see `Plan.match_row`).
+    """
+    matchers = plan.matchers
+
+    def quality(num):
+        return PARTIAL_QUALITY if num in partial_nums else TERM_QUALITY.get(matchers[num].search_type, 0)
+
+    score = 0
+    covered = claimed = 0
+    fields = set()
+    for num in sorted(nums, key=lambda num: (-num_bits(matchers[num].mask), -quality(num), num)):
+        matcher = matchers[num]
+        new_tokens = num_bits(matcher.mask & ~covered)
+        if (claimed & matcher.column_bit) or not new_tokens:
+            continue
+        score += quality(num) * new_tokens + MULTI_TOKEN_BONUS * (new_tokens - 1)
+        fields.add(matcher.field)
+        covered |= matcher.mask
+        if matcher.claims_column:
+            claimed |= matcher.column_bit
+        if covered == plan.full_mask:
+            break
+    return score - FIELD_PENALTY * len(fields)
+
+
+def group_rows(plan, matches, bitmaps):
+    """
+    Split the matches into groups of rows that were matched by the same matchers (and only partially by the same ones).
+    Returns a list of (matcher positions, partial matcher positions, bitmap), or None if there would be more than MAX_GROUPS.
+    """
+    groups = [((), (), matches)]
+    for num, matcher in enumerate(plan.matchers):
+        if not matcher.mask:
+            continue
+        partial = RowBitmap.from_rows(sorted(matcher.partial_rows)) if matcher.partial_rows else None
+        split = []
+        for nums, partial_nums, rows in groups:
+            inside = rows & bitmaps[num]
+            outside = rows - inside if inside else rows
+            if outside:
+                split.append((nums, partial_nums, outside))
+            if not inside:
+                continue
+            if partial is not None:
+                partial_inside = inside & partial
+                if partial_inside:
+                    split.append((nums + (num,), partial_nums + (num,), partial_inside))
+                    inside = inside - partial_inside
+            if inside:
+                split.append((nums + (num,), partial_nums, inside))
+        if len(split) > MAX_GROUPS:
+            return None
+        groups = split
+    return groups
+
+
+def top_rows(plan, matcher_rows, k=DEFAULT_TOP_K, deleted=None):
+    """
+    Return the number of rows that fully match a plan, and the best `k` of them as (row index, score), best first.
+    Rows of the same score are in row order. The rows in `deleted`, if any, are left out.
+    """
+    bitmaps = {}
+    matches = match_bitmap(plan, matcher_rows, bitmaps)
+    if deleted:
+        matches = matches - RowBitmap.from_rows(sorted(deleted))
+    num_matches = len(matches)
+    if (not num_matches) or (k <= 0):
+        return num_matches, []
+    for num, rows in enumerate(matcher_rows):
+        if num not in bitmaps:
+            bitmaps[num] = RowBitmap.from_rows(rows)
+
+    groups = group_rows(plan, matches, bitmaps)
+    if groups is None:
+        # Too many kinds of rows to group: score each one, keeping only the best k.
+        def scored():
+            for idx in matches:
+                nums = [num for num in xrange(len(plan.matchers)) if idx in bitmaps[num]]
+                yield -row_score(plan, nums, set(num for num in nums if idx in plan.matchers[num].partial_rows)), idx
+        return num_matches, [(idx, -negative_score) for negative_score, idx in heapq.nsmallest(k, scored())]
+
+    # Score ==> the groups of that score
+    tiers = {}
+    for nums, partial_nums, rows in groups:
+        tiers.setdefault(row_score(plan, nums, partial_nums), []).append(rows)
+    top = []
+    for score in sorted(tiers, reverse=True):
+        rows = heapq.merge(*tiers[score]) if len(tiers[score]) > 1 else iter(tiers[score][0])
+        top.extend((idx, score) for idx in islice(rows, k - len(top)))
+        if len(top) >= k:
+            break
+    return num_matches, top
@@ -1,4 +1,7 @@
+import copy
 import csv
+import heapq
+from itertools import islice
 from dateutil.parser import *
 import datetime as dt
 import os
@@ -6,27 +9,28 @@ import json
 import time
 import re
 from helpers import set_default, write_data, unique_everseen
+from constants import *
+from storage import open_store, convert_json, data_signature
+from index import open_indexes, phrase_words, word_runs, PUNCTUATIONS
+from stats import open_stats
+from plan import compile_plan, ENGINE_ROWS, ENGINE_BITMAP
+from rank import DEFAULT_TOP_K
+from batch import share_terms
+from parallel import ParallelScanner, DEFAULT_CHUNK_SIZE
+from stream import StreamScanner, DEFAULT_READ_AHEAD
+from bitmap import RowBitmap
+from cache import ResultCache, DEFAULT_CACHE_BYTES
+from profiling import Profile, NULL_PROFILE
+from dates import formatter, TIME_FORMAT_1, TIME_FORMAT_2, DATE_FORMAT_1, DATE_FORMAT_2, DATE_FORMAT_3, DATETIME_FORMAT_1, DT_FORMATS
 
 
-DATA_TYPE_STRING = 0
-DATA_TYPE_INTEGER = 1
-DATA_TYPE_DECIMAL = 2
-DATA_TYPE_DATE = 3
-DATA_TYPE_DATETIME = 4
-DATA_TYPE_TIME = 5
-DATA_TYPE_BOOLEAN = 6
-
-SEARCH_TYPE_OFF = 0
-SEARCH_TYPE_EXACT = 1
-SEARCH_TYPE_STARTSWITH = 2
-SEARCH_TYPE_EDGE = 3
-SEARCH_TYPE_CONTAINS = 4
-
 POSSIBLE_BOOLEAN_TRUE_VALUES = ['y', 'yes', 't', 'true', '1', 'on']
 POSSIBLE_BOOLEAN_FALSE_VALUES = ['n', 'no', 'f', 'false', '0', 'off']
 POSSIBLE_BOOLEAN_VALUES = POSSIBLE_BOOLEAN_TRUE_VALUES + POSSIBLE_BOOLEAN_FALSE_VALUES
 POSSIBLE_MONTH_STARTSWITH = set(['j', 'ja', 'jan', 'f', 'fe', 'feb', 'm', 'ma', 'mar', 'a', 'ap', 'apr', 'm', 'ma', 'may', 'j', 'ju', 'jun', 'j', 'ju', 'jul', 'a', 'au', 'aug', 's', 'se', 'sep', 'o', 'oc', 'oct', 'n', 'no', 'nov', 'd', 'de', 'dec'])
-PUNCTUATIONS = '!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~'
+DATA_PATH = 'Sales1M.bin'
+ITER_FIRST_CHUNK_SIZE = 4096 # rows scanned for the first chunk of `search_iter`, doubling after that
+JSON_DATA_PATH = 'Sales1M_WasmFormatted.json'
 
 ACCEPTABLE_REGEX_DATETIME_PATTERNS = [
     r'\d{4}\-\d{1,2}\-\d{1,2}\s\d{1,2}\:\d{1,2}\:\d{1,2}\.?\d{0,10}', # 2014-01-01 01:02:03
@@ -40,13 +44,6 @@ ACCEPTABLE_REGEX_TIME_PATTERNS = [
     r'\d{1,2}:\d{1,2}:\d{1,2}\.?\d{0,10}' # 01:02:03
 ]
 
-TIME_FORMAT_1 = '%H:%M:%S' # 01:02:03
-TIME_FORMAT_2 = '%-H:%M %p' # 1:02 am
-DATE_FORMAT_1 = '%Y-%M-%D' # 2014-01-01
-DATE_FORMAT_2 = '%m/%d/%y' # 01/01/14
-DATE_FORMAT_3 = '%b %d %Y' # Jan 1 2014
-DATETIME_FORMAT_1 = '%Y-%M-%d %H:%M:%S'
-DT_FORMATS = [TIME_FORMAT_1, TIME_FORMAT_2, DATE_FORMAT_1, DATE_FORMAT_2, DATE_FORMAT_3, DATETIME_FORMAT_1]
 
 def excel_date(date):
     """
@@ -62,22 +59,167 @@ def excel_date(date):
     return int(float(delta.days) + (float(delta.seconds) / 86400))
     
 
+def default_column_info():
+    """
+    The metadata of every field of the Sales table (see the README). Only 'type', 'searchType' and 'index'
+    have to be set: whatever is left as None is filled in from the column statistics.
+    """
+    return {
+        'id': {
+            'type': DATA_TYPE_INTEGER,
+            'searchType': SEARCH_TYPE_EXACT,
+            'dateTypeFormat': None,
+            'minLength': None,
+            'maxLength': None,
+            'minValue': None,
+            'maxValue': None,
+            'decimalScale': None,
+            'isAllLower': None,
+            'isAllUpper': None,
+            'containsNumericStart': None,
+            'containsMultipleWords': None,
+            'maxWords': None,
+            'index': 0,
+        },
+        'date': {
+            'type': DATA_TYPE_DATE,
+            'searchType': SEARCH_TYPE_EXACT,
+            'dateTypeFormat': None,
+            'minLength': None,
+            'maxLength': None,
+            'minValue': None,
+            'maxValue': None,
+            'decimalScale': None,
+            'isAllLower': None,
+            'isAllUpper': None,
+            'containsNumericStart': None,
+            'containsMultipleWords': None,
+            'maxWords': None,
+            'index': 1,
+        },
+        'instance_id': {
+            'type': DATA_TYPE_INTEGER,
+            'searchType': SEARCH_TYPE_EXACT,
+            'dateTypeFormat': None,
+            'minLength': None,
+            'maxLength': None,
+            'minValue': None,
+            'maxValue': None,
+            'decimalScale': None,
+            'isAllLower': None,
+            'isAllUpper': None,
+            'containsNumericStart': None,
+            'containsMultipleWords': None,
+            'maxWords': None,
+            'index': 2,
+        },
+        'territory_id': {
+            'type': DATA_TYPE_STRING,
+            'searchType': SEARCH_TYPE_EDGE,
+            'dateTypeFormat': None,
+            'minLength': None,
+            'maxLength': None,
+            'minValue': None,
+            'maxValue': None,
+            'decimalScale': None,
+            'isAllLower': None,
+            'isAllUpper': None,
+            'containsNumericStart': None,
+            'containsMultipleWords': None,
+            'maxWords': None,
+            'index': 3,
+        },
+        'code':  {
+            'type': DATA_TYPE_STRING,
+            'searchType': SEARCH_TYPE_EDGE,
+            'dateTypeFormat': None,
+            'minLength': None,
+            'maxLength': None,
+            'minValue': None,
+            'maxValue': None,
+            'decimalScale': None,
+            'isAllLower': None,
+            'isAllUpper': None,
+            'containsNumericStart': None,
+            'containsMultipleWords': None,
+            'maxWords': None,
+            'index': 4,
+        },
+        'price': {
+            'type': DATA_TYPE_DECIMAL,
+            'searchType': SEARCH_TYPE_EXACT,
+            'dateTypeFormat': None,
+            'minLength': None,
+            'maxLength': None,
+            'minValue': None,
+            'maxValue': None,
+            'decimalScale': None,
+            'isAllLower': None,
+            'isAllUpper': None,
+            'containsNumericStart': None,
+            'containsMultipleWords': None,
+            'maxWords': None,
+            'index': 5,
+        },
+        'currency_code_id': {
+            'type': DATA_TYPE_STRING,
+            'searchType': SEARCH_TYPE_EDGE,
+            'dateTypeFormat': None,
+            'minLength': None,
+            'maxLength': None,
+            'minValue': None,
+            'maxValue': None,
+            'decimalScale': None,
+            'isAllLower': None,
+            'isAllUpper': None,
+            'containsNumericStart': None,
+            'containsMultipleWords': None,
+            'maxWords': None,
+            'index': 6,
+        },
+        'price_in_usd': {
+            'type': DATA_TYPE_DECIMAL,
+            'searchType': SEARCH_TYPE_EXACT,
+            'dateTypeFormat': None,
+            'minLength': None,
+            'maxLength': None,
+            'minValue': None,
+            'maxValue': None,
+            'decimalScale': None,
+            'isAllLower': None,
+            'isAllUpper': None,
+            'containsNumericStart': None,
+            'containsMultipleWords': None,
+            'maxWords': None,
+            'index': 7,
+        },
+    }
+
+
 class Search:
     
-    def __init__(self):
+    def __init__(self, data_path=DATA_PATH, workers=1, chunk_size=DEFAULT_CHUNK_SIZE, cache_bytes=DEFAULT_CACHE_BYTES, engine=ENGINE_BITMAP,
+                 profile=False, metrics_hook=None, stream_rows=None, read_ahead=DEFAULT_READ_AHEAD, column_info=None, verbose=True):
         self.orignal_search_term = None
+        self.verbose = verbose         # print the searches that are skipped
+        self.engine = engine           # how the terms' rows are combined: ENGINE_BITMAP or ENGINE_ROWS (see `plan.py`)
+        self.workers = workers         # > 1 to search with a pool of processes (see `parallel.py`)
+        self.chunk_size = chunk_size   # rows per task when searching in parallel
+        # To search a table larger than memory, a batch of this many rows at a time (see `stream.py`),
+        # reading up to `read_ahead` batches ahead. Its results are not cached, as they can be as large as the table.
+        self.stream_rows = stream_rows
+        self.read_ahead = read_ahead
+        self.cache = ResultCache(cache_bytes) if (cache_bytes and not stream_rows) else None # see `cache.py`, 0 to turn it off
+        self.scanner = None
         self.matches_at_index = set() # These are all the search matches by row index
         
-        self.SEARCH_INFO = {
-            'OriginalSearch': '',
-            'TokenizedSearch': [],
-            'MissingTokens': [],
-            'Parsed': [
-                
-            ],
-            'NumResults': 0,
-            'FirstTenResults': []
-        }
+        # Profiling (see `profiling.py`): off unless asked for. The hook, if any, is called
+        # with `SEARCH_INFO['Profile']` and `SEARCH_INFO` after every search.
+        self.metrics_hook = metrics_hook
+        self.profiling = profile or (metrics_hook is not None)
+        self.profile = NULL_PROFILE
+        
+        self.SEARCH_INFO = self.new_search_info()
         
         # An example of `Parsed` obj would be: 
         '''
@@ -91,128 +233,75 @@ class Search:
         }
         '''
         
-        self.COLUMN_INFO = {
-            'id': {
-                'type': DATA_TYPE_INTEGER,
-                'searchType': SEARCH_TYPE_EXACT,
-                'dateTypeFormat': None,
-                'minLength': None,
-                'maxLength': None,
-                'minValue': None,
-                'maxValue': None,
-                'isAllLower': None,
-                'isAllUpper': None,
-                'containsNumericStart': None,
-                'containsMultipleWords': None,
-                'index': 0,
-            },
-            'date': {
-                'type': DATA_TYPE_DATE,
-                'searchType': SEARCH_TYPE_EXACT,
-                'dateTypeFormat': None,
-                'minLength': None,
-                'maxLength': None,
-                'minValue': None,
-                'maxValue': None,
-                'isAllLower': None,
-                'isAllUpper': None,
-                'containsNumericStart': None,
-                'containsMultipleWords': None,
-                'index': 1,
-            },
-            'instance_id': {
-                'type': DATA_TYPE_INTEGER,
-                'searchType': SEARCH_TYPE_EXACT,
-                'dateTypeFormat': None,
-                'minLength': None,
-                'maxLength': None,
-                'minValue': None,
-                'maxValue': None,
-                'isAllLower': None,
-                'isAllUpper': None,
-                'containsNumericStart': None,
-                'containsMultipleWords': None,
-                'index': 2,
-            },
-            'territory_id': {
-                'type': DATA_TYPE_STRING,
-                'searchType': SEARCH_TYPE_EDGE,
-                'dateTypeFormat': None,
-                'minLength': None,
-                'maxLength': None,
-                'minValue': None,
-                'maxValue': None,
-                'isAllLower': None,
-                'isAllUpper': None,
-                'containsNumericStart': None,
-                'containsMultipleWords': None,
-                'index': 3,
-            },
-            'code':  {
-                'type': DATA_TYPE_STRING,
-                'searchType': SEARCH_TYPE_EDGE,
-                'dateTypeFormat': None,
-                'minLength': None,
-                'maxLength': None,
-                'minValue': None,
-                'maxValue': None,
-                'isAllLower': None,
-                'isAllUpper': None,
-                'containsNumericStart': None,
-                'containsMultipleWords': None,
-                'index': 4,
-            },
-            'price': {
-                'type': DATA_TYPE_DECIMAL,
-                'searchType': SEARCH_TYPE_EXACT,
-                'dateTypeFormat': None,
-                'minLength': None,
-                'maxLength': None,
-                'minValue': None,
-                'maxValue': None,
-                'isAllLower': None,
-                'isAllUpper': None,
-                'containsNumericStart': None,
-                'containsMultipleWords': None,
-                'index': 5,
-            },
-            'currency_code_id': {
-                'type': DATA_TYPE_STRING,
-                'searchType': SEARCH_TYPE_EDGE,
-                'dateTypeFormat': None,
-                'minLength': None,
-                'maxLength': None,
-                'minValue': None,
-                'maxValue': None,
-                'isAllLower': None,
-                'isAllUpper': None,
-                'containsNumericStart': None,
-                'containsMultipleWords': None,
-                'index': 6,
-            },
-            'price_in_usd': {
-                'type': DATA_TYPE_DECIMAL,
-                'searchType': SEARCH_TYPE_EXACT,
-                'dateTypeFormat': None,
-                'minLength': None,
-                'maxLength': None,
-                'minValue': None,
-                'maxValue': None,
-                'isAllLower': None,
-                'isAllUpper': None,
-                'containsNumericStart': None,
-                'containsMultipleWords': None,
-                'index': 7,
-            },
+        # The metadata of the table's columns, `default_column_info()` unless given (only 'type', 'searchType' and 'index'
+        # have to be set, the rest is filled in from the column statistics).
+        self.base_column_info = column_info
+        self.COLUMN_INFO = self.new_column_info()
+        self.open_data(data_path)
+
+
+    def new_column_info(self):
+        """
+        A copy of the column metadata as it was given, before it is filled in from the column statistics.
+        """
+        return copy.deepcopy(self.base_column_info) if (self.base_column_info is not None) else default_column_info()
+
+
+    def open_data(self, data_path):
+        """
+        Open the binary data file. The first time around (or if the json has changed since),
+        it is built from the Wasm-like json, or from the raw csv if there is no json either.
+        """
+        if not os.path.exists(data_path) or (os.path.exists(JSON_DATA_PATH) and os.path.getmtime(JSON_DATA_PATH) > os.path.getmtime(data_path)):
+            if os.path.exists(JSON_DATA_PATH):
+                convert_json(JSON_DATA_PATH, data_path, self.COLUMN_INFO)
+            else:
+                write_data(self.COLUMN_INFO, out_path=data_path)
+        self.data_path = data_path
+        self.signature = data_signature(data_path)
+        self.store = open_store(data_path, self.COLUMN_INFO)
+        # A streamed search profiles the table a batch at a time too, and does not use the indexes,
+        # as building them would need the whole table in memory.
+        self.fill_column_info(open_stats(data_path, self.store, self.stream_rows))
+        self.indexes = open_indexes(data_path, self.store, self.COLUMN_INFO) if not self.stream_rows else {}
+
+
+    def fill_column_info(self, stats):
+        """
+        Fill in the metadata that has not been set by hand from the column statistics,
+        so that `build_search_info` can prune terms against it.
+        """
+        for field, column_stats in stats.items():
+            for key, value in column_stats.items():
+                if self.COLUMN_INFO[field].get(key) is None:
+                    self.COLUMN_INFO[field][key] = value
+
+
+    def new_search_info(self):
+        return {
+            'OriginalSearch': '',
+            'TokenizedSearch': [],
+            'MissingTokens': [],
+            'Parsed': [
+                
+            ],
+            'NumResults': 0,
+            'FirstTenResults': []
         }
-        # Load the Wasm-like data for testing.
-        self.data = []
-        if not os.path.exists('Sales1M_WasmFormatted.json'):
-            self.data = _write_data()
-        self.data = json.loads(open('Sales1M_WasmFormatted.json').read())
-        
 
-    def tokenize(self, v, MIN_LENGTH=1, MAX_LENGTH=100):
+
+    def prepare(self, q):
+        """
+        Start a new search: reset `SEARCH_INFO` and parse `q` into it.
+        """
+        self.SEARCH_INFO = self.new_search_info()
+        self.SEARCH_INFO['OriginalSearch'] = q
+        self.profile = Profile() if self.profiling else NULL_PROFILE
+        with self.profile.phase('parse'):
+            return self.build_search_info(q)
+
+
+    def tokenize(self, v, MIN_LENGTH=1, MAX_LENGTH=100, unique=True):
         """
         Tokenize terms.
         
@@ -228,22 +317,36 @@ class Search:
         Instead, what we need to do is not search the exact term twice, which would
         be column-specific. For example, the term "bora" would only be searched one time
         against a column, though the term "bora bora" could also be searched against
-        a column that has `containsMultipleWords`=True.
+        a column that has `containsMultipleWords`=True (with `unique`=False, to keep both).
         
         """
         
         # This is the most basic tokenizer possible, we can always add on to this later.
+        # (The values of a phrase index are cut into words the same way, see `index.py`.)
         
         terms = []
-        for term in v.split():
-            term = term.strip().strip(PUNCTUATIONS).replace("'", '').replace(',', '').lower()
+        for term in phrase_words(v):
             if (MIN_LENGTH <= len(term) <= MAX_LENGTH):
                 terms.append(term)
                 
-        terms = list(unique_everseen(terms)) # remove duplicates, but keep order of terms
+        if unique:
+            terms = list(unique_everseen(terms)) # remove duplicates, but keep order of terms
         return terms
 
 
+    def find_phrases(self, field, words):
+        """
+        The runs of consecutive `words` of a search to look for as whole values of a multi-word EXACT field.
+        
+        With a phrase index, only those that are values of the field. Without one (a streamed search), every run of
+        up to `maxWords` words: the ones that are not values of the field match no rows, so the results are the same.
+        """
+        index = self.indexes.get(field)
+        if (index is not None) and (index.kind == 'phrase'):
+            return index.find_phrases(words)
+        return word_runs(words, self.COLUMN_INFO[field].get('maxWords'))
+
+
     def build_search_info(self, q):
         """
         This method will do two things:
@@ -281,6 +384,7 @@ class Search:
             - isAllLower, isAllUpper   (string type)
             - containsNumericStart     (string type)
             - containsMultipleWords    (string type)
+            - maxWords                 (string type)
 
         
         Additionally, it is important to understand that a string field can contains ANY
@@ -311,7 +415,8 @@ class Search:
         
 
         """
-        terms = self.SEARCH_INFO['TokenizedSearch'] = self.tokenize(q)
+        with self.profile.phase('tokenize'):
+            terms = self.SEARCH_INFO['TokenizedSearch'] = self.tokenize(q)
         terms_as_cleaned_string = ' '.join(terms)
 
         
@@ -323,19 +428,22 @@ class Search:
             if (field_info['searchType'] == SEARCH_TYPE_EXACT):
                 
                 # (a) String
+                #     Every run of words of the search that is a whole value of the field is a term:
+                #     "terminator 2 usd" ==> "terminator 2" against `title` (see `find_phrases`).
                 if (field_info.get('containsMultipleWords') is True):
-                    term = terms_as_cleaned_string
-                    search_against_obj = {
-                        'Tokens': set(tokens),
-                        'Field': field,
-                        'searchType': SEARCH_TYPE_EXACT,
-                        'dataType': SEARCH_TYPE_STRING,
-                        'searchAs': term,
-                        'dateTypeFormat': None,
-                        '_AllowIncompleteMatch': False
-                    }
-                    if search_against_obj not in self.SEARCH_INFO['Parsed']: 
-                        self.SEARCH_INFO['Parsed'].append(search_against_obj)
+                    words = self.tokenize(q, unique=False)
+                    for phrase in self.find_phrases(field, words):
+                        search_against_obj = {
+                            'Tokens': set(phrase),
+                            'Field': field,
+                            'searchType': SEARCH_TYPE_EXACT,
+                            'dataType': DATA_TYPE_STRING,
+                            'searchAs': ' '.join(phrase),
+                            'dateTypeFormat': None,
+                            '_AllowIncompleteMatch': False
+                        }
+                        if search_against_obj not in self.SEARCH_INFO['Parsed']: 
+                            self.SEARCH_INFO['Parsed'].append(search_against_obj)
                     
                     
                 # (b) Date/Time
@@ -345,13 +453,17 @@ class Search:
                     all_terms = re.findall(dt_regex, terms_as_cleaned_string)
                     for term in all_terms:
                         mapped_terms = term.split()
+                        # Skip dates that are outside the range of the column
+                        serial = excel_date(term)
+                        if (field_info['minValue'] is not None and serial < field_info['minValue']) or (field_info['maxValue'] is not None and serial > field_info['maxValue']):
+                            continue
                         # Because it's exact, we can convert it into serialTime and do a straight match!
                         search_against_obj = {
                             'Tokens': set(mapped_terms),
                             'Field': field,
                             'searchType': SEARCH_TYPE_EXACT,
                             'dataType': field_info['type'],
-                            'searchAs': excel_date(term),
+                            'searchAs': serial,
                             'dateTypeFormat': field_info['dateTypeFormat'],
                             '_AllowIncompleteMatch': False
                         }
@@ -367,13 +479,13 @@ class Search:
             
             # Let's get basic information on the term in question
             # So that we can skip columns that are not of that type
-            term_is_string, term_is_decimal, term_is_integer = False, False, False
+            term_is_string, term_is_decimal, term_is_integer, term_is_number = False, False, False, False
             try:
-                float(term)
+                term_is_integer = float(term) == int(float(term)) # (fails on "nan" and "inf" too)
             except:
                 term_is_string = True
             else:
-                term_is_integer = float(term) == int(float(term))
+                term_is_number = True
                 term_is_decimal = not term_is_integer
                 term_is_string = term[0] == '0' # Allow a leading 0 item, such as "0005" to be treated as both a string a number
                                                 # Depending on the column it is compared against
@@ -404,11 +516,13 @@ class Search:
                 #    Example: "hello" should skip the field `price` (int)
                 # 2) Skip the field if it's > MAX_NUMBER or < MIN_NUMBER
                 #    Example: 123455 will never match a field that is a TINYINT(1)
+                #    (For a startswith search only the max applies: "1" can still start "10" when the min is 10.
+                #     And neither does for an edge or contains search, which can match inside the value: "99" in 4.99)
                 # 3) Skip the field if the field is an integer and there is a non-zero decimal place in it
                 if field_info['type'] in (DATA_TYPE_INTEGER, DATA_TYPE_DECIMAL):
-                    if term_is_string:
+                    if not term_is_number:
                         continue
-                    elif (field_info['maxValue'] is not None and (float(term) > field_info['maxValue'])) or (field_info['minValue'] is not None and float(term) < field_info['minValue']):
+                    elif (field_info['searchType'] in (SEARCH_TYPE_EXACT, SEARCH_TYPE_STARTSWITH) and field_info['maxValue'] is not None and (float(term) > field_info['maxValue'])) or (field_info['searchType'] == SEARCH_TYPE_EXACT and field_info['minValue'] is not None and float(term) < field_info['minValue']):
                         continue
                     elif (field_info['type'] == DATA_TYPE_INTEGER) and (float(term) != int(float(term))):
                         continue
@@ -425,7 +539,7 @@ class Search:
                 # Allow it to search if it's number between length 1 and 4, or it's part of the date-prefix, such as "Mar", "May", etc.
                 if (field_info['type'] == DATA_TYPE_TIME) and not re.match(r'^\d{0,2}:?\d{0,2}:?\d{0,2}\.?\d{0,10}$', term):
                     continue
-                if field_info['type'] in (DATA_TYPE_DATE, DATA_TYPE_DATETIME) and (term not in POSSIBLE_MONTH_STARTSWITH) and (re.sub(r'\s|:|-|\.', term).isdigit()):
+                if field_info['type'] in (DATA_TYPE_DATE, DATA_TYPE_DATETIME) and (term not in POSSIBLE_MONTH_STARTSWITH) and not (re.sub(r'\s|:|-|\.|/', '', term).isdigit()):
                     continue
                 
                 
@@ -434,21 +548,24 @@ class Search:
                 #   For example: "hello171.02Mar" contains a string, contains a number, contains a date pattern, etc.
                 # - We can store metadata on whether the string field (without multiple words) startswith a numericValue.
                 #   For example, if the string fields only values are ['yes', 'no'], then if there's an integer term we can skip that field.
+                #   (An edge search also matches the start of any other word: "2049" in "Blade Runner 2049")
                 if (field_info['type'] == DATA_TYPE_STRING) and field_info['searchType'] != SEARCH_TYPE_CONTAINS:
-                    if (term[0].isdigit()) and (field_info['containsNumericStart'] is False):
+                    starts_value = (field_info['searchType'] != SEARCH_TYPE_EDGE) or (field_info['containsMultipleWords'] is False)
+                    if (term[0].isdigit()) and (field_info['containsNumericStart'] is False) and starts_value:
                         continue
-                    if (field_info['maxLength'] is not None and (len(term) > field_info['maxLength']) or (field_info['minLength'] is not None and len(term) < field_info['minLength'])):
+                    # (A term shorter than minLength can only be ruled out for an exact search, "hd" can still start "hdbuy")
+                    if (field_info['maxLength'] is not None and (len(term) > field_info['maxLength']) or (field_info['searchType'] == SEARCH_TYPE_EXACT and field_info['minLength'] is not None and len(term) < field_info['minLength'])):
                         continue
 
                 
                 # Insert the term as follows:
                 # As a cased-String if that field is a stringType and is allUpper or allLower
-                # As a number if the field is of a numericType
+                # As a number if the field is of a numericType (of the field's type: "5.0" is 5 for an integer field)
                 # Otherwise insert the term as a string
                 if field_info['type'] == DATA_TYPE_STRING:
-                    formatted_term = term.upper() if field_info.get('isAllLower') else term.lower() if field_info.get('isAllLower') else term
+                    formatted_term = term.upper() if field_info.get('isAllUpper') else term.lower() if field_info.get('isAllLower') else term
                 elif field_info['type'] in (DATA_TYPE_INTEGER, DATA_TYPE_DECIMAL):
-                    formatted_term = term if (field_info['searchType'] != SEARCH_TYPE_EXACT) else float(term) if term_is_decimal else int(term)
+                    formatted_term = term if (field_info['searchType'] != SEARCH_TYPE_EXACT) else float(term) if (field_info['type'] == DATA_TYPE_DECIMAL) else int(float(term))
                 elif field_info['type'] in (DATA_TYPE_DATE, DATA_TYPE_DATETIME, DATA_TYPE_TIME):
                     # full patterns are searched at the beginning, so can just keep things as a string
                     formatted_term = term
@@ -516,174 +633,335 @@ class Search:
 
 
     def format_dt_value(self, v, dt, df):
-        
-        if dt not in (DATE_TYPE_DATE, DATA_TYPE_DATETIME, DATA_TYPE_TIME):
-            raise TypeError()
-            
-        if df not in DT_FORMATS:
-            df = TIME_FORMAT_1 if dt == DATE_TYPE_TIME else DATETIME_FORMAT_1 if  dt == DATE_TYPE_DATETIME else DATE_FORMAT_1
+        """
+        Format a date/time serial number as a lowered string, e.g. 41640 ==> "2014-01-01".
+        Every serial is only formatted once per format (see `dates.py`).
+        """
+        return formatter(dt, df)(v)
 
-         
-        if dt == DATA_TYPE_TIME:
-            base_dt = datetime.datetime(1900, 1, 1) # gives an error because before 1900
-        else:
-            base_dt = datetime.datetime(1899, 12, 30) + datetime.timedelta(days=v)
-            
-        formatted_string = (base_dt + datetime.timedelta(days=v)).strftime(df).lower()
 
-        return formatted_string
-            
-        
+    def compile(self):
+        """
+        Compile `SEARCH_INFO['Parsed']` into an execution plan (see `plan.py`).
+        """
+        with self.profile.phase('plan'):
+            return compile_plan(self.SEARCH_INFO, self.COLUMN_INFO, self.store, self.indexes, self.engine, self.profile if self.profiling else None)
+
+
+    def explain(self, q):
+        """
+        Return a readable description of what searching for `q` would do, without running it.
+        """
+        self.prepare(q)
+        return self.compile().explain()
+
 
-    def search_all(self):
+    def search_all(self, task=None):
+        """
+        Each `Parsed` term object is evaluated over its whole column (or from an index),
+        and then only the rows that matched at least one term are visited to see if
+        all the tokens of the search are covered. See `plan.py`.
         
-        matches_at_index = set()
+        Results are cached (see `cache.py`), so a repeated search is not run again, and a search
+        that adds to the previous one (as the user types) only looks at the rows that one matched.
         
-        term_objs = self.SEARCH_INFO['Parsed']
-        original_search_string = self.SEARCH_INFO['OriginalSearch'].lower()
-        matches_needed = len(self.SEARCH_INFO['TokenizedSearch'])
+        With `stream_rows`, the data file is read and searched a batch of rows at a time instead (see `stream.py`).
         
-        for idx, row in enumerate(self.data):
-            
-            if idx % 25000 == 0: print idx
-            
-            # Debugging
-            if idx == 100000: break # UNCOMMENT FOR TESTING (for quicker testing)
-            # if 3753 not in row: continue # to test an exact row match
-            
-            has_row_match = False
-            fields_with_partial_matches = {}
-            field_to_cast_value = {}
-            matched_terms = set()
-            skip_columns = set()   # If that column is already matched to a term
-                                   # And not a multi-word column, don't allow it to be searched for another term
-
-            for term_obj in term_objs:
-
-                term = term_obj['searchAs']
-                search_type = term_obj['searchType']
-                data_type = term_obj['dataType']
-                field = term_obj['Field']
-                tokens = term_obj['Tokens']
-                date_type_format = term_obj.get('dateTypeFormat')
-                field_value = row[self.COLUMN_INFO[field]['index']]
-                has_term_match = False
-                
-                
-                if field in skip_columns:
-                    continue
+        With a `task` (see `live.py`), the rows are searched a range at a time, in order: `task.check()` is called before
+        each term and each range, and can stop the search by raising, and `task.report(rows searched, number of rows,
+        matches so far)` is called after each range. Such a search is done in this process, even with `workers` > 1.
+        """
+        tokens = self.SEARCH_INFO['TokenizedSearch']
+        matches_at_index = None
+        if self.cache is not None:
+            self.cache.validate(self.signature)
+            matches_at_index = self.cache.get_matches(tokens)
+        
+        if matches_at_index is not None:
+            self.SEARCH_INFO['FromCache'] = True
+        elif self.stream_rows:
+            if self.scanner is None:
+                self.scanner = StreamScanner(self.data_path, self.COLUMN_INFO, self.stream_rows, self.read_ahead)
+            with self.profile.phase('scan'):
+                matches_at_index, self.SEARCH_INFO['StreamStats'] = self.scanner.search(self.SEARCH_INFO, task)
+        elif (self.workers > 1) and (task is None):
+            if self.scanner is None:
+                self.scanner = ParallelScanner(self.data_path, self.COLUMN_INFO, self.workers, self.chunk_size, self.engine)
+            with self.profile.phase('scan'):
+                matches_at_index, self.SEARCH_INFO['WorkerStats'] = self.scanner.search(self.SEARCH_INFO, len(self.store))
+        elif self.cache is not None:
+            # Reuse (or refine) the rows of the terms of the previous searches, and keep the new ones.
+            plan = self.compile()
+            with self.profile.phase('cache'):
+                self.cache.prime(plan)
+            matches_at_index = plan.execute() if task is None else self.execute_ranges(plan, task)
+            with self.profile.phase('cache'):
+                self.cache.store(plan)
+        else:
+            plan = self.compile()
+            matches_at_index = plan.execute() if task is None else self.execute_ranges(plan, task)
+        
+        self.set_results(matches_at_index)
+        return
 
-                if search_type == SEARCH_TYPE_EXACT:
 
-                    if term == field_value:
-                        [matched_terms.add(token) for token in tokens]
-                        has_term_match = True
+    def execute_ranges(self, plan, task):
+        """
+        Execute a plan a range of rows at a time (growing as in `search_iter`), checking `task` before each term
+        and each range, and reporting the matches so far to it (in row order) after each range. The terms that
+        looked at every row of each range still end up with all of their rows, for the result cache (see `Matcher.add_range`).
+        """
+        plan.task = task
+        matches = []
+        num_rows = len(self.store)
+        chunk = ITER_FIRST_CHUNK_SIZE
+        start = 0
+        while start < num_rows:
+            task.check()
+            stop = min(start + chunk, num_rows)
+            matches.extend(sorted(plan.execute(start, stop)))
+            task.report(stop, num_rows, matches)
+            start = stop
+            chunk = min(chunk * 2, self.chunk_size)
+        return set(matches)
+
+
+    def set_results(self, matches_at_index):
+        """
+        Put the matches of the search in `SEARCH_INFO` (and in the result cache).
+        """
+        with self.profile.phase('materialize'):
+            if self.cache is not None:
+                self.cache.put_matches(self.SEARCH_INFO['TokenizedSearch'], matches_at_index)
+            self.matches_at_index = matches_at_index
+            self.SEARCH_INFO['NumResults'] = len(matches_at_index)
+            # A bitmap (of a streamed search) is already in row order.
+            first_ten = islice(matches_at_index, 10) if isinstance(matches_at_index, RowBitmap) else heapq.nsmallest(10, matches_at_index)
+            self.SEARCH_INFO['FirstTenResults'] = [self.row(idx) for idx in first_ten]
 
-                    if (not has_term_match) and (term_obj['_AllowIncompleteMatch'] is True): # treat as an edgesearch
-                        if not any([self.COLUMN_INFO[field]['isAllUpper'], self.COLUMN_INFO[field]['isAllLower']]):
-                            field_value = field_value.lower()
-                        if re.search(r'\b%s' % term, field_value):
-                            fields_with_partial_matches.append(field)
-                            [matched_terms.add(token) for token in tokens]
-                            has_term_match = True
 
-                else:
-                    
+    def row(self, idx):
+        return self.store.row(idx)
 
-                    # Almost no performance loss when comparing two numbers, so why not try on an exact match to start
-                    if isinstance(term, (int)) and (term == field_value):
-                        [matched_terms.add(token) for token in tokens]
-                        has_term_match = True
 
-                    if not has_term_match:
-                        
-                        # Cast the value to a string if it's not already
-                        # We store a lookup for the row so, for example
-                        # We don't cast a date to a string 100 times if
-
-                        # Dates must be cast to a string based on their dataTypeFormat,
-                        # So, for example, we can compare "mar" against "mar 1, 2014".
-                        # Or, we can compare "2014-01" against "2014-01-01".
-                        if field not in field_to_cast_value:
-                        
-                            if data_type in (DATA_TYPE_DATE, DATA_TYPE_DATETIME, DATA_TYPE_TIME):
-                                field_value = self.format_dt_value(v=field_value, dt=data_type, df=date_type_format)
-                            elif (data_type == DATA_TYPE_STRING) and not any([self.COLUMN_INFO[field]['isAllUpper'], self.COLUMN_INFO[field]['isAllLower']]):
-                                field_value = field_value.lower() # compare against lower since the searchTerm will be lowered
-                            else:
-                                field_value = field_value
-                                
-                            field_to_cast_value[field] = field_value
-                        
-                        field_value = field_to_cast_value[field]
-                            
+    def session(self):
+        """
+        A new `Search` over the same store, indexes and cache, with a `SEARCH_INFO` of its own.
+        Each thread of a server (see `server.py`) searches with its own session.
+        """
+        session = copy.copy(self)
+        session.SEARCH_INFO = self.new_search_info()
+        session.matches_at_index = set()
+        session.scanner = None
+        session.profile = NULL_PROFILE
+        return session
 
-                        if search_type == SEARCH_TYPE_STARTSWITH:
-                            if field_value.startswith(term):
-                                [matched_terms.add(token) for token in tokens]
-                                has_term_match = True
 
-                        elif search_type == SEARCH_TYPE_EDGE:
-                            if re.search(r'\b%s' % term, field_value):
-                                [matched_terms.add(token) for token in tokens]
-                                has_term_match = True
+    def close(self):
+        """
+        Shut down the worker processes, if searching in parallel.
+        """
+        if self.scanner is not None:
+            self.scanner.close()
+            self.scanner = None
 
-                        elif field_value == SEARCH_TYPE_CONTAINS:
-                            if term in field_value:
-                                [matched_terms.add(token) for token in tokens]
-                                has_term_match = True
 
-                if has_term_match:
-                    
-                    # Break out of the `row` loop if we have a full match
-                    if len(matched_terms) == matches_needed:
-                        has_row_match = True
-                        break
+    def search_iter(self, q, limit=None, offset=0, cursor=0, columns=None):
+        """
+        Yield (row index, row) for each match, in row order, scanning only as far as needed.
+        
+        - `limit`/`offset`: stop after `limit` matches, skipping the first `offset` of them
+        - `cursor`: the row to start scanning from. To get the next page, pass the last
+                    yielded row index + 1 (which is what `search_page` returns as `NextCursor`).
+        - `columns`: the fields to return for each row (all of them by default)
+        
+        The rows are scanned in growing chunks, so the first page only costs
+        as much as the scan up to its last match.
+        """
+        self.prepare(q)
+        if self.check_if_search_can_be_skipped():
+            return
+        
+        plan = self.compile()
+        projected = [self.store.column(field) for field in columns] if columns else self.store.columns
+        num_rows = len(self.store)
+        chunk = ITER_FIRST_CHUNK_SIZE
+        start = cursor
+        while start < num_rows:
+            stop = min(start + chunk, num_rows)
+            for idx in sorted(plan.execute(start, stop)):
+                if offset:
+                    offset -= 1
+                    continue
+                yield idx, [column[idx] for column in projected]
+                if limit is not None:
+                    limit -= 1
+                    if limit <= 0:
+                        return
+            start = stop
+            chunk = min(chunk * 2, self.chunk_size)
 
-                    # Add in that column to skip if it's not a multi-word column
-                    if (data_type != DATA_TYPE_STRING) or (self.COLUMN_INFO[field]['containsMultipleWords'] is False):
-                        skip_columns.add(field)
 
+    def search_page(self, q, limit=10, cursor=0, columns=None):
+        """
+        Return one page of results, and the cursor for the next one (None on the last page).
+        """
+        results = list(self.search_iter(q, limit=limit, cursor=cursor, columns=columns))
+        return {
+            'Results': [row for idx, row in results],
+            'RowIndexes': [idx for idx, row in results],
+            'NextCursor': results[-1][0] + 1 if len(results) == limit else None,
+        }
 
-            if has_row_match:
 
-                if not fields_with_partial_matches:
-                    matches_at_index.add(idx)
-                else:
-                    # This is simple, we can just do a reverse search
-                    # -- Take the field's value and search against the raw search string
-                    is_ok = True
-                    for field in fields_with_partial_matches:
-                        # make sure all terms match
-                        if row[field].lower() not in original_search_string:
-                            is_ok = False
-                            break
-                    if is_ok:
-                        matches_at_index.add(idx)
-
-
-        self.matches_at_index = matches_at_index
-        self.SEARCH_INFO['NumResults'] = len(matches_at_index)
-        self.SEARCH_INFO['FirstTenResults'] = [self.data[idx] for idx in sorted(matches_at_index)[:10]]
-        return
+    def export_matches(self, q, f, format='jsonl', columns=None):
+        """
+        Write every match to the file `f` as json lines or csv, without collecting them first.
+        """
+        columns = columns or self.store.fields
+        if format == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            write = lambda row: writer.writerow([v.encode('utf-8') if isinstance(v, unicode) else v for v in row])
+        elif format == 'jsonl':
+            write = lambda row: f.write(json.dumps(row) + '\n')
+        else:
+            raise ValueError('Unknown export format: %s' % format)
+        num_rows = 0
+        for idx, row in self.search_iter(q, columns=columns):
+            write(row)
+            num_rows += 1
+        return num_rows
 
 
-    def search(self, q):
-        self.SEARCH_INFO['OriginalSearch'] = q
-        self.build_search_info(q)
+    def search(self, q, task=None):
+        self.prepare(q)
         
         # Don't search if we don't need to
-        if self.check_if_search_can_be_skipped():
-            print 'Skipping search due to missing tokens: %s' % str(self.SEARCH_INFO['MissingTokens'])
+        with self.profile.phase('skip_check'):
+            skip = self.check_if_search_can_be_skipped()
+        if skip:
+            if self.verbose:
+                print 'Skipping search due to missing tokens: %s' % str(self.SEARCH_INFO['MissingTokens'])
+            self.matches_at_index = set()
+            self.SEARCH_INFO['NumResults'] = 0
+            self.SEARCH_INFO['FirstTenResults'] = []
+        else:
+            self.search_all(task)
+        if self.profiling:
+            self.report_profile()
+
+
+    def search_top(self, q, k=DEFAULT_TOP_K, task=None):
+        """
+        Search for `q`, and put its `k` best matches in `SEARCH_INFO['FirstTenResults']`, best first, rather than
+        its first ones (see `rank.py`), with their scores in `SEARCH_INFO['Scores']`. The matches are only counted,
+        so `matches_at_index` only has the top `k` of them.
+        
+        The search is done in this process, even with `workers` > 1. A `task`, if given, is checked before each term
+        (see `search_all`).
+        """
+        self.prepare(q)
+        with self.profile.phase('skip_check'):
+            skip = self.check_if_search_can_be_skipped()
+        num_matches, top = self.top_matches(k, task) if not skip else (0, [])
+        with self.profile.phase('materialize'):
+            self.matches_at_index = set(idx for idx, score in top)
+            self.SEARCH_INFO['NumResults'] = num_matches
+            self.SEARCH_INFO['FirstTenResults'] = [self.row(idx) for idx, score in top]
+            self.SEARCH_INFO['Scores'] = [score for idx, score in top]
+        if self.profiling:
+            self.report_profile()
+        return self.SEARCH_INFO
+
 
-        self.search_all()
+    def top_matches(self, k, task=None):
+        """
+        The number of matches of the search in `SEARCH_INFO`, and its best `k` as (row index, score), best first.
+        The rows of its terms come from (and go to) the result cache, as in `search_all`.
+        """
+        plan = self.compile()
+        plan.task = task
+        if self.cache is not None:
+            self.cache.validate(self.signature)
+            with self.profile.phase('cache'):
+                self.cache.prime(plan)
+        num_matches, top = plan.top(k)
+        if self.cache is not None:
+            with self.profile.phase('cache'):
+                self.cache.store(plan)
+        return num_matches, top
+
+
+    def search_many(self, queries):
+        """
+        Search for each of `queries` (such as the searches of a report), and return the `SEARCH_INFO` of each.
+        
+        All of the queries are planned first, so that the terms they have in common are only evaluated once
+        (see `batch.py`), and a query that is in the batch more than once is only searched once.
+        The batch is searched in this process, even with `workers` > 1.
+        """
+        if self.cache is not None:
+            self.cache.validate(self.signature)
+        batch = []   # (SEARCH_INFO, profile, plan or None, matches if already known, or the query to copy them from)
+        seen = {}    # original search ==> its position in the batch
+        for q in queries:
+            self.prepare(q)
+            plan = matches_at_index = same_as = None
+            if q in seen:
+                same_as = seen[q]
+            elif self.check_if_search_can_be_skipped():
+                matches_at_index = set()
+            else:
+                seen[q] = len(batch)
+                if self.cache is not None:
+                    matches_at_index = self.cache.get_matches(self.SEARCH_INFO['TokenizedSearch'])
+                    if matches_at_index is not None:
+                        self.SEARCH_INFO['FromCache'] = True
+                if matches_at_index is None:
+                    plan = self.compile()
+                    if self.cache is not None:
+                        self.cache.prime(plan)
+            batch.append((self.SEARCH_INFO, self.profile, plan, matches_at_index, same_as))
+        
+        num_terms, num_shared = share_terms([plan for search_info, profile, plan, matches_at_index, same_as in batch if plan is not None])
+        
+        results = []
+        for search_info, profile, plan, matches_at_index, same_as in batch:
+            self.SEARCH_INFO, self.profile = search_info, profile
+            if same_as is not None:
+                matches_at_index = results[same_as][1]
+            elif plan is not None:
+                matches_at_index = plan.execute()
+                if self.cache is not None:
+                    self.cache.store(plan)
+            self.set_results(matches_at_index)
+            search_info['BatchTerms'] = {'Distinct': num_terms, 'Shared': num_shared}
+            if self.profiling:
+                self.report_profile()
+            results.append((search_info, matches_at_index))
+        return [search_info for search_info, matches_at_index in results]
+
+
+    def report_profile(self):
+        """
+        Put the profile of the last search in `SEARCH_INFO['Profile']`, and pass it to the metrics hook.
+        """
+        fields = sorted(set(term_obj['Field'] for term_obj in self.SEARCH_INFO['Parsed']))
+        profile = self.SEARCH_INFO['Profile'] = self.profile.as_dict(self.store, self.indexes, fields, self.cache)
+        if self.metrics_hook is not None:
+            self.metrics_hook(profile, self.SEARCH_INFO)
 
 
 if __name__ == '__main__':
     from sys import argv
-    q = ' '.join(argv[1:])
+    if argv[1:2] == ['--explain']:
+        print Search().explain(' '.join(argv[2:]))
+        raise SystemExit
+    profile = argv[1:2] == ['--profile']
+    q = ' '.join(argv[2:] if profile else argv[1:])
     print "Initializing Data..."
-    s = Search()
+    s = Search(profile=profile)
     t0 = time.time()
     s.search(q)
     print json.dumps(s.SEARCH_INFO, indent=4, sort_keys=True, default=set_default)
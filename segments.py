@@ -0,0 +1,700 @@
+### A table that can be appended to (and deleted from) without rewriting it: a directory of
+### immutable segments, plus a small mutable head.
+###
+###   Sales.segments/
+###     manifest.json              ==> the segments (and their deleted rows) and the head's log
+###     seg-000001.bin             ==> a sealed segment: a data file (see `storage.py`), with its
+###     seg-000001.bin.idx             own indexes and statistics, built once when it is sealed
+###     seg-000001.bin.stats.json
+###     head-000002.jsonl          ==> the appends and deletes since the last seal, one per line
+###
+### (1) New rows go to the head: they are written to its log, then added to an in-memory store
+###     (which is scanned, as it has no indexes). Once the head has `head_rows` rows it is sealed
+###     into a new segment, so an append only costs time in proportion to the rows it adds.
+### (2) A row is deleted by its id: the segment keeps it, but it is left out of every search from
+###     then on. An update is a delete of the id plus an append of the new row.
+### (3) Compaction merges segments into one (by default the newest ones of about the same size, in a
+###     background thread once there are more than `max_segments`), dropping their deleted rows.
+### (4) Every search runs on a `Snapshot`: the segments, deleted rows and head rows of one moment,
+###     which do not change under it, whatever is appended, deleted or compacted meanwhile.
+###     The statistics of the table (for `COLUMN_INFO`) are those of its segments merged.
+###
+### The manifest is only ever replaced (written next to it and renamed). A crash leaves either the
+### table before a seal or compaction or the one after it, and the head is rebuilt from its log.
+
+import bisect
+import heapq
+import itertools
+import json
+import os
+import shutil
+import threading
+from columns import ColumnStore, NumericColumn, StringColumn, NullBitmap, new_column
+from constants import *
+from index import open_indexes, word_runs
+from parallel import DEFAULT_CHUNK_SIZE
+from plan import compile_plan, ENGINE_BITMAP
+from profiling import NULL_PROFILE
+from search import Search, default_column_info, ITER_FIRST_CHUNK_SIZE
+from stats import ColumnProfiler, open_stats, merge_stats
+from storage import open_store, write_store
+
+
+MANIFEST = 'manifest.json'
+MANIFEST_VERSION = 1
+DEFAULT_HEAD_ROWS = 65536 # rows in the head before it is sealed into a segment
+DEFAULT_MAX_SEGMENTS = 8  # sealed segments past which they are compacted in the background
+KEY_FIELD = 'id'          # the field rows are deleted and updated by
+
+
+def freeze_column(column):
+    """
+    A copy of a head column that later appends to the head do not change.
+    """
+    nulls = NullBitmap(bytearray(column.nulls.bits), column.nulls.num_rows)
+    if isinstance(column, StringColumn):
+        return StringColumn(column.offsets[:], str(column.heap), nulls)
+    return NumericColumn(column.data_type, column.values[:], nulls)
+
+
+class Segment(object):
+    """
+    A sealed segment: a data file that does not change, with its own indexes and statistics.
+    """
+
+    def __init__(self, directory, name, column_info, deleted=()):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self.store = open_store(self.path, column_info)
+        self.stats = open_stats(self.path, self.store)
+        # The metadata that is not set by hand comes from the segment's own statistics, as for a `Search`,
+        # so that, for one, a multi-word EXACT column gets its phrase index (see `SegmentedSearch.find_phrases`).
+        column_info = dict((field, dict(field_info, **dict((key, value) for key, value in self.stats.get(field, {}).items() if field_info.get(key) is None)))
+                           for field, field_info in column_info.items())
+        self.indexes = open_indexes(self.path, self.store, column_info)
+        self.deleted = frozenset(deleted) # replaced (never changed), as snapshots hold on to it
+
+    def __len__(self):
+        return len(self.store)
+
+    def find(self, field, values):
+        """
+        The rows holding any of the `values` in `field`, from its index if it has one that can say.
+        """
+        index = self.indexes.get(field)
+        lookup = index.lookup_equal if hasattr(index, 'lookup_equal') else self.store.column(field).scan_equal
+        rows = set()
+        for value in values:
+            rows.update(lookup(value))
+        return rows
+
+    def remove(self):
+        for path in (self.path, self.path + '.idx', self.path + '.stats.json'):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class Head(object):
+    """
+    The rows appended since the last seal, in memory, with their statistics kept up as they come in.
+    """
+
+    def __init__(self, column_info):
+        self.column_info = column_info
+        self.fields = sorted(column_info, key=lambda field: column_info[field]['index'])
+        self.store = ColumnStore(self.fields, [new_column(column_info[field]['type']) for field in self.fields], 0)
+        self.profilers = [ColumnProfiler(column_info[field]['type']) for field in self.fields]
+        self.deleted = frozenset()
+        self.frozen = None # (number of rows, store) of the last `freeze`
+
+    def __len__(self):
+        return len(self.store)
+
+    def append(self, row):
+        for field, column, profiler in zip(self.fields, self.store.columns, self.profilers):
+            value = row[self.column_info[field]['index']]
+            column.append(value)
+            profiler.add(value)
+        self.store.num_rows += 1
+
+    def stats(self):
+        return dict((field, profiler.result()) for field, profiler in zip(self.fields, self.profilers))
+
+    def freeze(self):
+        """
+        A copy of the head's store to search, which is not resized by appends while it is being scanned.
+        """
+        if (self.frozen is None) or (self.frozen[0] != len(self)):
+            self.frozen = (len(self), ColumnStore(self.fields, [freeze_column(column) for column in self.store.columns], len(self)))
+        return self.frozen[1]
+
+
+class Part(object):
+    """
+    A segment (or the head) as a snapshot sees it. Its rows are numbered from `base` in the snapshot.
+    """
+
+    def __init__(self, name, store, indexes, deleted, base):
+        self.name = name
+        self.store = store
+        self.indexes = indexes
+        self.deleted = deleted
+        self.num_rows = len(store)
+        self.base = base
+
+
+class Snapshot(object):
+    """
+    The rows of a table at one moment, numbered across its parts.
+    """
+
+    def __init__(self, parts, version, stats):
+        self.parts = parts
+        self.version = version
+        self.stats = stats
+        self.bases = [part.base for part in parts]
+        self.num_rows = sum(part.num_rows for part in parts)
+        self.num_deleted = sum(len(part.deleted) for part in parts)
+
+    def __len__(self):
+        return self.num_rows
+
+    def part_of(self, idx):
+        return self.parts[bisect.bisect_right(self.bases, idx) - 1]
+
+    def row(self, idx, fields=None):
+        part = self.part_of(idx)
+        if fields:
+            return [part.store.column(field)[idx - part.base] for field in fields]
+        return part.store.row(idx - part.base)
+
+    def execute(self, search_info, column_info, engine=ENGINE_BITMAP, profile=None, task=None):
+        """
+        The rows of every part that fully match the search (see `Plan.execute`), leaving out the deleted ones.
+        A `task`, if given, is checked before each term and each part, and reported to after each part (see `live.py`).
+        """
+        matches = set()
+        found = [] # the matches so far in row order, for the task
+        for part in self.parts:
+            if not part.num_rows:
+                continue
+            if task is not None:
+                task.check()
+            with (profile or NULL_PROFILE).phase('plan'):
+                plan = compile_plan(search_info, column_info, part.store, part.indexes, engine, profile)
+            plan.task = task
+            rows = plan.execute()
+            if part.deleted:
+                rows = rows - part.deleted
+            matches.update([idx + part.base for idx in rows] if part.base else rows)
+            if task is not None:
+                found.extend(sorted(idx + part.base for idx in rows))
+                task.report(part.base + part.num_rows, len(self), found)
+        return matches
+
+    def top(self, search_info, column_info, k, engine=ENGINE_BITMAP, profile=None, task=None):
+        """
+        The number of rows of every part that fully match the search, and the best `k` of them
+        as (row index, score), best first (see `Plan.top`), leaving out the deleted ones.
+        A `task`, if given, is checked before each term and each part.
+        """
+        num_matches = 0
+        top = []
+        for part in self.parts:
+            if not part.num_rows:
+                continue
+            if task is not None:
+                task.check()
+            with (profile or NULL_PROFILE).phase('plan'):
+                plan = compile_plan(search_info, column_info, part.store, part.indexes, engine, profile)
+            plan.task = task
+            part_matches, part_top = plan.top(k, part.deleted)
+            num_matches += part_matches
+            top.extend((idx + part.base, score) for idx, score in part_top)
+        return num_matches, heapq.nsmallest(k, top, key=lambda (idx, score): (-score, idx))
+
+    def iter_matches(self, search_info, column_info, engine=ENGINE_BITMAP, cursor=0, max_chunk=DEFAULT_CHUNK_SIZE):
+        """
+        Yield the matches from row `cursor` on, in row order, scanning each part in growing chunks
+        (like `Search.search_iter`), so that only the parts up to the last match needed are searched.
+        """
+        chunk = ITER_FIRST_CHUNK_SIZE
+        for part in self.parts:
+            if part.base + part.num_rows <= cursor:
+                continue
+            plan = compile_plan(search_info, column_info, part.store, part.indexes, engine)
+            start = max(cursor - part.base, 0)
+            while start < part.num_rows:
+                stop = min(start + chunk, part.num_rows)
+                for idx in sorted(plan.execute(start, stop)):
+                    if idx not in part.deleted:
+                        yield part.base + idx
+                start = stop
+                chunk = min(chunk * 2, max_chunk)
+
+
+class SegmentedTable(object):
+    """
+    A table stored as a directory of segments (see the top of this file).
+    All of its methods can be called from any thread.
+    """
+
+    def __init__(self, path, column_info, head_rows=DEFAULT_HEAD_ROWS, max_segments=DEFAULT_MAX_SEGMENTS, key_field=KEY_FIELD):
+        self.path = path
+        self.column_info = column_info
+        self.fields = sorted(column_info, key=lambda field: column_info[field]['index'])
+        self.head_rows = head_rows
+        self.max_segments = max_segments
+        self.key_field = key_field
+        self.lock = threading.RLock()       # held for every change, and to take a snapshot
+        self.compact_lock = threading.Lock() # one compaction at a time
+        self.compaction = None               # the background compaction thread, if one was started
+        self.version = 0                     # bumped by every change, to tell snapshots apart
+        self.last_snapshot = None
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        manifest_path = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest['version'] != MANIFEST_VERSION:
+                raise ValueError('Unsupported segment manifest version %s (expected %s)' % (manifest['version'], MANIFEST_VERSION))
+        else:
+            manifest = {'version': MANIFEST_VERSION, 'nextNumber': 1, 'segments': [], 'headLog': None}
+        self.next_number = manifest['nextNumber']
+        self.segments = [Segment(path, entry['name'], column_info, entry['deleted']) for entry in manifest['segments']]
+        self.head = Head(column_info)
+        self.head_log = manifest['headLog']
+        if self.head_log is None:
+            self.head_log = self.new_name('head-%06d.jsonl')
+            self.write_manifest()
+        self.replay()
+        self.log = open(os.path.join(path, self.head_log), 'a')
+        if len(self.head) >= self.head_rows:
+            self.seal()
+
+    def __len__(self):
+        """
+        The number of rows that have not been deleted.
+        """
+        snapshot = self.snapshot()
+        return len(snapshot) - snapshot.num_deleted
+
+    def new_name(self, pattern):
+        name = pattern % self.next_number
+        self.next_number += 1
+        return name
+
+    def write_manifest(self):
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'nextNumber': self.next_number,
+            'segments': [{'name': segment.name, 'numRows': len(segment), 'deleted': sorted(segment.deleted)} for segment in self.segments],
+            'headLog': self.head_log,
+        }
+        manifest_path = os.path.join(self.path, MANIFEST)
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(manifest_path + '.tmp', manifest_path)
+
+    # ----- the head's log -----
+
+    def replay(self):
+        """
+        Rebuild the head from its log.
+        """
+        log_path = os.path.join(self.path, self.head_log)
+        if not os.path.exists(log_path):
+            return
+        with open(log_path) as f:
+            for line in f:
+                try:
+                    op = json.loads(line)
+                except ValueError: # the last line of a log that was being written when the process died
+                    break
+                self.apply(op)
+
+    def write_log(self, op):
+        self.log.write(json.dumps(op) + '\n')
+        self.log.flush()
+        os.fsync(self.log.fileno())
+
+    def apply(self, op):
+        """
+        Apply one line of the log: a delete of ids, then an append of rows (an update has both).
+        """
+        count = 0
+        if op.get('delete'):
+            count = self.apply_delete(op['delete'])
+        for row in op.get('append', ()):
+            self.head.append(row)
+        return count
+
+    def apply_delete(self, ids):
+        values = set(ids)
+        count = 0
+        for segment in self.segments:
+            rows = segment.find(self.key_field, values) - segment.deleted
+            if rows:
+                segment.deleted = segment.deleted.union(rows)
+                count += len(rows)
+        key_column = self.head.store.column(self.key_field)
+        rows = [idx for idx in xrange(len(self.head)) if (idx not in self.head.deleted) and (key_column[idx] in values)]
+        if rows:
+            self.head.deleted = self.head.deleted.union(rows)
+            count += len(rows)
+        return count
+
+    # ----- changes -----
+
+    def append(self, rows):
+        """
+        Append rows (formatted like the Wasm data, see `helpers.read_csv_data`). Returns how many.
+        A long iterable of rows is appended (and sealed) a head at a time, never held in memory at once.
+        """
+        rows = iter(rows)
+        count = 0
+        with self.lock:
+            while True:
+                batch = [list(row) for row in itertools.islice(rows, max(self.head_rows - len(self.head), 1))]
+                if not batch:
+                    break
+                self.write_log({'append': batch})
+                self.apply({'append': batch})
+                count += len(batch)
+                self.version += 1
+                if len(self.head) >= self.head_rows:
+                    self.seal()
+        return count
+
+    def delete(self, ids):
+        """
+        Delete the rows with these ids (of `key_field`). Returns how many rows were deleted.
+        """
+        return self.change({'delete': list(ids)})
+
+    def update(self, rows):
+        """
+        Replace the rows with the ids of these rows by them (or append them, for new ids). Returns how many rows were replaced.
+        """
+        rows = [list(row) for row in rows]
+        key_index = self.column_info[self.key_field]['index']
+        return self.change({'delete': [row[key_index] for row in rows], 'append': rows})
+
+    def change(self, op):
+        with self.lock:
+            self.write_log(op)
+            count = self.apply(op)
+            self.version += 1
+            if len(self.head) >= self.head_rows:
+                self.seal()
+        return count
+
+    def import_data(self, data_path):
+        """
+        Add the rows of a data file (see `storage.py`) as a segment of their own, as they are.
+        """
+        with self.lock:
+            name = self.new_name('seg-%06d.bin')
+        shutil.copyfile(data_path, os.path.join(self.path, name) + '.tmp')
+        os.rename(os.path.join(self.path, name) + '.tmp', os.path.join(self.path, name))
+        segment = Segment(self.path, name, self.column_info)
+        with self.lock:
+            self.segments.append(segment)
+            self.write_manifest()
+            self.version += 1
+        self.maybe_compact()
+        return len(segment)
+
+    def seal(self):
+        """
+        Write the head's rows (but the deleted ones) to a new segment, and start a new head.
+        """
+        with self.lock:
+            head = self.head
+            if len(head):
+                live_rows = (head.store.row(idx) for idx in xrange(len(head)) if idx not in head.deleted)
+                store = ColumnStore.from_rows(live_rows, self.column_info)
+                if len(store):
+                    name = self.new_name('seg-%06d.bin')
+                    write_store(os.path.join(self.path, name), store, self.column_info)
+                    self.segments.append(Segment(self.path, name, self.column_info))
+            # The new log only takes over once the manifest says so: a crash before that replays the old one.
+            old_log = self.head_log
+            self.head_log = self.new_name('head-%06d.jsonl')
+            self.write_manifest()
+            self.log.close()
+            os.remove(os.path.join(self.path, old_log))
+            self.log = open(os.path.join(self.path, self.head_log), 'a')
+            self.head = Head(self.column_info)
+            self.version += 1
+        self.maybe_compact()
+
+    # ----- compaction -----
+
+    def maybe_compact(self):
+        if len(self.segments) > self.max_segments:
+            self.compact(background=True)
+
+    def compaction_run(self, full=False):
+        """
+        The segments to merge: all of them, or else the newest ones for as long as the next older one
+        is no bigger than them together (so that a row is only ever rewritten a few times).
+        """
+        segments = self.segments
+        if full:
+            return list(segments) if (len(segments) > 1) or any(segment.deleted for segment in segments) else []
+        if len(segments) < 2:
+            return []
+        run = [segments[-1]]
+        total = len(segments[-1]) - len(segments[-1].deleted)
+        for segment in reversed(segments[:-1]):
+            if len(segment) - len(segment.deleted) > total:
+                break
+            run.insert(0, segment)
+            total += len(segment) - len(segment.deleted)
+        if len(run) < 2:
+            run = segments[-2:]
+        return run
+
+    def compact(self, full=False, background=False):
+        """
+        Merge segments into one, leaving out their deleted rows. Searches, appends and deletes
+        carry on while the new segment is written; it is swapped in at the end.
+        """
+        if background:
+            with self.lock:
+                if (self.compaction is None) or not self.compaction.is_alive():
+                    self.compaction = threading.Thread(target=self.compact, args=(full,), name='segment-compaction')
+                    self.compaction.daemon = True
+                    self.compaction.start()
+                return self.compaction
+
+        with self.compact_lock:
+            with self.lock:
+                run = self.compaction_run(full)
+                if not run:
+                    return None
+                deleted_before = [segment.deleted for segment in run]
+                name = self.new_name('seg-%06d.bin')
+
+            rows = (segment.store.row(idx) for segment, deleted in zip(run, deleted_before) for idx in xrange(len(segment)) if idx not in deleted)
+            store = ColumnStore.from_rows(rows, self.column_info)
+            merged = None
+            if len(store):
+                write_store(os.path.join(self.path, name), store, self.column_info)
+                merged = Segment(self.path, name, self.column_info)
+
+            with self.lock:
+                # Carry over the rows deleted while the segments were being merged, to the merged segment's row numbers.
+                deleted = set()
+                base = 0
+                for segment, before in zip(run, deleted_before):
+                    before = sorted(before)
+                    for idx in segment.deleted.difference(before):
+                        deleted.add(base + idx - bisect.bisect_left(before, idx))
+                    base += len(segment) - len(before)
+                position = self.segments.index(run[0])
+                if merged is not None:
+                    merged.deleted = frozenset(deleted)
+                    self.segments[position:position + len(run)] = [merged]
+                else:
+                    del self.segments[position:position + len(run)]
+                self.write_manifest()
+                self.version += 1
+            # Snapshots that still use the old segments keep their files mapped, which is fine to remove on posix.
+            for segment in run:
+                segment.remove()
+            return merged
+
+    # ----- reading -----
+
+    def snapshot(self):
+        """
+        The table as it is now, to search. Nothing that happens to the table afterwards changes it.
+        """
+        with self.lock:
+            if (self.last_snapshot is not None) and (self.last_snapshot.version == self.version):
+                return self.last_snapshot
+            parts = []
+            base = 0
+            for segment in self.segments:
+                parts.append(Part(segment.name, segment.store, segment.indexes, segment.deleted, base))
+                base += len(segment)
+            parts.append(Part('head', self.head.freeze(), {}, self.head.deleted, base))
+            stats = merge_stats([segment.stats for segment in self.segments] + [self.head.stats()])
+            self.last_snapshot = Snapshot(parts, self.version, stats)
+            return self.last_snapshot
+
+    def info(self):
+        snapshot = self.snapshot()
+        return {
+            'Path': self.path,
+            'Version': snapshot.version,
+            'NumRows': len(snapshot) - snapshot.num_deleted,
+            'Segments': [{'Name': part.name, 'NumRows': part.num_rows, 'Deleted': len(part.deleted)} for part in snapshot.parts],
+        }
+
+    def close(self):
+        """
+        Wait for a background compaction to finish, and close the head's log.
+        """
+        compaction = self.compaction
+        if compaction is not None:
+            compaction.join()
+        with self.lock:
+            self.log.close()
+
+
+class SegmentedSearch(Search):
+    """
+    A `Search` over a `SegmentedTable`. Each search runs on a snapshot of the table as it is when
+    the search starts, so the table can be changed (through `self.table`) while it is being searched.
+    """
+
+    def __init__(self, table_path, head_rows=DEFAULT_HEAD_ROWS, max_segments=DEFAULT_MAX_SEGMENTS, **options):
+        if options.get('workers', 1) > 1:
+            raise ValueError('A segmented table is searched in one process')
+        self.head_rows = head_rows
+        self.max_segments = max_segments
+        Search.__init__(self, table_path, **options)
+
+    def open_data(self, table_path):
+        self.data_path = table_path
+        self.table = SegmentedTable(table_path, self.new_column_info(), self.head_rows, self.max_segments)
+        self.store = None # there is no one store: see `self.snapshot`
+        self.indexes = {}
+        self.snapshot = None
+        self.refresh()
+
+    def refresh(self):
+        """
+        Search the table as it is now, updating `COLUMN_INFO` from its statistics if it has changed.
+        """
+        snapshot = self.table.snapshot()
+        if (self.snapshot is None) or (snapshot.version != self.snapshot.version):
+            self.COLUMN_INFO = self.new_column_info()
+            self.fill_column_info(snapshot.stats)
+        self.snapshot = snapshot
+        self.signature = [self.table.path, snapshot.version]
+
+    def prepare(self, q):
+        self.refresh()
+        return Search.prepare(self, q)
+
+    def find_phrases(self, field, words):
+        """
+        Like `Search.find_phrases`, with the phrase index of every part: a run is looked for if it is a value
+        in any of them. If a part has no phrase index (such as the head), every run is looked for.
+        """
+        indexes = [part.indexes.get(field) for part in self.snapshot.parts if part.num_rows]
+        if not all((index is not None) and (index.kind == 'phrase') for index in indexes):
+            return Search.find_phrases(self, field, words)
+        runs = word_runs(words, max([index.max_words for index in indexes] or [0]))
+        return [run for run in runs if any(index.find(' '.join(run)) is not None for index in indexes)]
+
+    def explain(self, q):
+        self.prepare(q)
+        lines = []
+        for part in self.snapshot.parts:
+            plan = compile_plan(self.SEARCH_INFO, self.COLUMN_INFO, part.store, part.indexes, self.engine)
+            lines.append('%s (%s rows, %s deleted):' % (part.name, part.num_rows, len(part.deleted)))
+            lines.append(plan.explain())
+        return '\n'.join(lines)
+
+    def search_all(self, task=None):
+        """
+        Search every part of the snapshot (see `Snapshot.execute`). Only whole searches are cached,
+        as the rows of a term are only good for the part they were found in.
+        """
+        tokens = self.SEARCH_INFO['TokenizedSearch']
+        matches_at_index = None
+        if self.cache is not None:
+            self.cache.validate(self.signature)
+            matches_at_index = self.cache.get_matches(tokens)
+        if matches_at_index is not None:
+            self.SEARCH_INFO['FromCache'] = True
+        else:
+            matches_at_index = self.snapshot.execute(self.SEARCH_INFO, self.COLUMN_INFO, self.engine, self.profile if self.profiling else None, task)
+
+        self.set_results(matches_at_index)
+
+    def top_matches(self, k, task=None):
+        return self.snapshot.top(self.SEARCH_INFO, self.COLUMN_INFO, k, self.engine, self.profile if self.profiling else None, task)
+
+    def row(self, idx):
+        return self.snapshot.row(idx)
+
+    def search_many(self, queries):
+        """
+        Like `Search.search_many`, but one query at a time: the terms of a batch are not shared across segments.
+        """
+        results = []
+        for q in queries:
+            self.search(q)
+            results.append(self.SEARCH_INFO)
+        return results
+
+    def search_iter(self, q, limit=None, offset=0, cursor=0, columns=None):
+        """
+        Like `Search.search_iter`. The row indexes (and so the cursors) are those of the snapshot,
+        and only stay the same for as long as no segments are sealed or compacted.
+        """
+        self.prepare(q)
+        if self.check_if_search_can_be_skipped():
+            return
+        snapshot = self.snapshot
+        for idx in snapshot.iter_matches(self.SEARCH_INFO, self.COLUMN_INFO, self.engine, cursor, self.chunk_size):
+            if offset:
+                offset -= 1
+                continue
+            yield idx, snapshot.row(idx, columns)
+            if limit is not None:
+                limit -= 1
+                if limit <= 0:
+                    return
+
+    def export_matches(self, q, f, format='jsonl', columns=None):
+        return Search.export_matches(self, q, f, format, columns or self.table.fields)
+
+    def close(self):
+        Search.close(self)
+        self.table.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    from helpers import read_csv_data, set_default
+    parser = argparse.ArgumentParser(description='Manage a segmented table.')
+    parser.add_argument('path', help='the table directory')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('info')
+    subparsers.add_parser('import', help='add a data file as a segment').add_argument('data_path')
+    subparsers.add_parser('append', help='append the rows of a csv export').add_argument('csv_path')
+    subparsers.add_parser('delete', help='delete rows by id').add_argument('ids', type=int, nargs='+')
+    subparsers.add_parser('compact', help='merge all the segments').add_argument('--full', action='store_true')
+    subparsers.add_parser('search').add_argument('q', nargs='*')
+    args = parser.parse_args()
+
+    column_info = default_column_info()
+    if args.command == 'search':
+        s = SegmentedSearch(args.path)
+        s.search(' '.join(args.q))
+        print json.dumps(s.SEARCH_INFO, indent=4, sort_keys=True, default=set_default)
+        s.close()
+        raise SystemExit
+    table = SegmentedTable(args.path, column_info)
+    if args.command == 'import':
+        print >> sys.stderr, 'Imported %s rows' % table.import_data(args.data_path)
+    elif args.command == 'append':
+        print >> sys.stderr, 'Appended %s rows' % table.append(read_csv_data(args.csv_path, column_info))
+    elif args.command == 'delete':
+        print >> sys.stderr, 'Deleted %s rows' % table.delete(args.ids)
+    elif args.command == 'compact':
+        table.compact(full=args.full)
+    table.close()
+    print json.dumps(table.info(), indent=4)
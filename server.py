@@ -0,0 +1,236 @@
+### A long-running search server: the data file and its indexes are opened once, and then
+### every query only costs the search itself.
+###
+###   $ python server.py --port 8000
+###   $ curl 'http://127.0.0.1:8000/search?q=hdbuy+4.99'
+###
+### Endpoints (all GET, all answering json):
+###
+###   /search?q=...   ==> the `SEARCH_INFO` of the search (plus how long it took)
+###   /explain?q=...  ==> the execution plan of the search (see `plan.py`)
+###   /status         ==> the data file being served, how many reloads, queue length, etc.
+###
+### Connections are accepted by the main thread and queued for a fixed pool of worker threads.
+### When the queue is full a request is turned away with a 503 straight away, and a request that
+### waited in the queue for longer than the timeout is turned away too (its client has likely
+### given up on it). A search that is still going after the search timeout is stopped, with a 503,
+### so that a few expensive queries cannot hold on to all the workers (see `SearchDeadline`).
+### Each worker searches with its own session (see `Search.session`),
+### and all the sessions share the one store, indexes and result cache.
+###
+### The data file (and the json it is built from) is checked every few seconds. When either one has
+### changed, a new `Search` is opened in the background and swapped in once it is ready: requests
+### that are running keep searching the old one, which stays valid until they are done with it.
+
+import BaseHTTPServer
+import json
+import os
+import Queue
+import threading
+import time
+import traceback
+import urlparse
+from helpers import set_default
+from live import SearchCancelled
+from search import Search, DATA_PATH, JSON_DATA_PATH
+from storage import data_signature
+
+
+DEFAULT_PORT = 8000
+DEFAULT_THREADS = 4
+DEFAULT_BACKLOG = 64          # requests waiting for a worker, past which they are turned away
+DEFAULT_TIMEOUT = 10.0        # seconds a request can take to send, or wait in the queue
+DEFAULT_SEARCH_TIMEOUT = 10.0 # seconds a search can run
+DEFAULT_RELOAD_INTERVAL = 2.0 # seconds between checks of the data file
+
+
+def source_signature(data_path):
+    """
+    Identifies the version of the data being served: the data file, and the json it is built from.
+    """
+    return (
+        data_signature(data_path) if os.path.exists(data_path) else None,
+        os.path.getmtime(JSON_DATA_PATH) if os.path.exists(JSON_DATA_PATH) else None,
+    )
+
+
+class SearchDeadline(object):
+    """
+    Stops a search that runs for longer than `seconds`. It is given to the search as its task (see `live.py`),
+    so it is checked before each term and each range of rows, and raises `SearchCancelled` once the time is up.
+    """
+
+    def __init__(self, seconds):
+        self.expires = time.time() + seconds
+
+    def check(self):
+        if time.time() >= self.expires:
+            raise SearchCancelled('Timed out')
+
+    def report(self, rows_searched, num_rows, matches):
+        pass
+
+
+class SearchRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    server_version = 'SearchServer/1.0'
+
+    def setup(self):
+        self.timeout = self.server.request_timeout # for reading the request off the socket
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = dict((key, values[-1]) for key, values in urlparse.parse_qs(url.query).items())
+        if time.time() - self.server.local.queued_at > self.server.request_timeout:
+            return self.respond(503, {'Error': 'Timed out waiting for a worker'})
+
+        if url.path == '/search':
+            if ('top' in params) and not params['top'].isdigit():
+                return self.respond(400, {'Error': 'top must be a number of rows'})
+            session = self.server.searcher.session()
+            t0 = time.time()
+            deadline = SearchDeadline(self.server.search_timeout)
+            try:
+                if 'top' in params: # the best matches rather than the first ones (see `rank.py`)
+                    session.search_top(params.get('q', ''), int(params['top']), deadline)
+                else:
+                    session.search(params.get('q', ''), deadline)
+            except SearchCancelled:
+                return self.respond(503, {'Error': 'Timed out searching'})
+            session.SEARCH_INFO['Seconds'] = time.time() - t0
+            return self.respond(200, session.SEARCH_INFO)
+        if url.path == '/explain':
+            return self.respond(200, {'Plan': self.server.searcher.session().explain(params.get('q', ''))})
+        if url.path == '/status':
+            return self.respond(200, self.server.status())
+        return self.respond(404, {'Error': 'Unknown path: %s' % url.path})
+
+    def respond(self, code, obj):
+        body = json.dumps(obj, default=set_default)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class SearchServer(BaseHTTPServer.HTTPServer):
+    """
+    An HTTP server that searches one data file with a bounded pool of worker threads.
+    """
+
+    allow_reuse_address = True
+
+    def __init__(self, address, data_path=DATA_PATH, threads=DEFAULT_THREADS, backlog=DEFAULT_BACKLOG,
+                 request_timeout=DEFAULT_TIMEOUT, reload_interval=DEFAULT_RELOAD_INTERVAL, verbose=False,
+                 search_timeout=DEFAULT_SEARCH_TIMEOUT, **search_options):
+        if search_options.get('workers', 1) != 1:
+            raise ValueError('The server searches each request on one of its threads, so workers has to be 1')
+        self.data_path = data_path
+        # (`verbose` is also for the `Search`, to print the searches it skips)
+        self.search_options = dict(search_options, workers=1, verbose=verbose)
+        self.request_timeout = request_timeout
+        self.search_timeout = search_timeout
+        self.reload_interval = reload_interval
+        self.verbose = verbose
+        self.reloads = 0
+        self.searcher = Search(data_path, **self.search_options)
+        self.signature = source_signature(data_path) # opening it may have (re)built the data file
+
+        self.local = threading.local()
+        self.queue = Queue.Queue(backlog)
+        self.stopping = threading.Event()
+        self.threads = [threading.Thread(target=self.work, name='search-worker-%s' % num) for num in range(threads)]
+        self.threads.append(threading.Thread(target=self.watch, name='search-reloader'))
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+        BaseHTTPServer.HTTPServer.__init__(self, address, SearchRequestHandler)
+
+    def process_request(self, request, client_address):
+        """
+        Queue the connection for a worker (this runs on the thread that accepts connections).
+        """
+        try:
+            self.queue.put_nowait((request, client_address, time.time()))
+        except Queue.Full:
+            body = json.dumps({'Error': 'Too many requests'})
+            try:
+                request.sendall('HTTP/1.0 503 Service Unavailable\r\nContent-Type: application/json\r\nContent-Length: %s\r\n\r\n%s' % (len(body), body))
+            finally:
+                self.shutdown_request(request)
+
+    def work(self):
+        while True:
+            request, client_address, queued_at = self.queue.get()
+            if request is None:
+                return
+            self.local.queued_at = queued_at
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def watch(self):
+        """
+        Reload the data whenever it changes, without stopping to serve it.
+        """
+        while not self.stopping.wait(self.reload_interval):
+            try:
+                signature = source_signature(self.data_path)
+                if signature == self.signature:
+                    continue
+                searcher = Search(self.data_path, **self.search_options)
+                self.searcher, self.signature = searcher, source_signature(self.data_path)
+                self.reloads += 1
+            except Exception:
+                # Most likely the file is still being written: keep serving the old data, and try again.
+                traceback.print_exc()
+
+    def status(self):
+        return {
+            'DataPath': self.data_path,
+            'Signature': self.signature,
+            'NumRows': len(self.searcher.store),
+            'Reloads': self.reloads,
+            'Threads': len(self.threads) - 1,
+            'Queued': self.queue.qsize(),
+        }
+
+    def server_close(self):
+        self.stopping.set()
+        for _ in range(len(self.threads) - 1):
+            self.queue.put((None, None, None))
+        BaseHTTPServer.HTTPServer.server_close(self)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve searches over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--data', default=DATA_PATH, help='the data file to search')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS)
+    parser.add_argument('--backlog', type=int, default=DEFAULT_BACKLOG)
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument('--search-timeout', type=float, default=DEFAULT_SEARCH_TIMEOUT)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    print "Initializing Data..."
+    server = SearchServer((args.host, args.port), args.data, args.threads, args.backlog, args.timeout, verbose=args.verbose,
+                          search_timeout=args.search_timeout)
+    print "Serving %s rows on http://%s:%s/search?q=..." % (len(server.searcher.store), args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,200 @@
+### Column statistics, used to fill in the `COLUMN_INFO` metadata that
+### `build_search_info` prunes with (minValue, maxLength, isAllUpper, etc.).
+###
+### Every column is profiled in a single streaming pass. The result is saved
+### next to the data file and only recomputed when the data file changes.
+### For a table searched a batch of rows at a time (see `stream.py`), the pass reads the data file
+### a batch at a time too, and at most MAX_DISTINCT values of a column are kept, so memory does not
+### grow with the table.
+
+import json
+import os
+from columns import DictColumn
+from constants import *
+from numeric import decimal_places
+from storage import data_signature
+from stream import BatchReader
+
+
+STATS_VERSION = 3   # bumped whenever a statistic is added, so that older saved statistics get recomputed
+MAX_DISTINCT = 65536 # distinct values kept per column: past that many, `distinctCount` is only a lower bound
+
+
+class ColumnProfiler(object):
+    """
+    Accumulates the statistics of one column, one value at a time.
+    """
+
+    def __init__(self, data_type):
+        self.data_type = data_type
+        self.null_count = 0
+        self.distinct = set()
+        self.min_value = self.max_value = None
+        self.min_length = self.max_length = None
+        self.is_all_lower = self.is_all_upper = None
+        self.contains_numeric_start = self.contains_multiple_words = None
+        self.max_words = None
+        self.decimal_scale = 0
+
+    def add(self, value):
+        if value is None:
+            self.null_count += 1
+            return
+        if value in self.distinct:
+            return
+        if len(self.distinct) < MAX_DISTINCT:
+            self.distinct.add(value)
+
+        if self.data_type != DATA_TYPE_STRING:
+            if (self.min_value is None) or (value < self.min_value):
+                self.min_value = value
+            if (self.max_value is None) or (value > self.max_value):
+                self.max_value = value
+            if self.data_type == DATA_TYPE_DECIMAL:
+                self.decimal_scale = max(self.decimal_scale, decimal_places(value))
+            return
+
+        length = len(value)
+        if (self.min_length is None) or (length < self.min_length):
+            self.min_length = length
+        if (self.max_length is None) or (length > self.max_length):
+            self.max_length = length
+        # A value without any cased characters (such as "123") says nothing about the column's case.
+        if value.lower() != value.upper():
+            self.is_all_lower = (self.is_all_lower is not False) and (value == value.lower())
+            self.is_all_upper = (self.is_all_upper is not False) and (value == value.upper())
+        self.contains_numeric_start = bool(self.contains_numeric_start) or value[:1].isdigit()
+        self.contains_multiple_words = bool(self.contains_multiple_words) or (len(value.split()) > 1)
+        self.max_words = max(self.max_words or 0, len(value.split()))
+
+    def result(self):
+        stats = {
+            'distinctCount': len(self.distinct),
+            'nullCount': self.null_count,
+        }
+        if self.data_type == DATA_TYPE_STRING:
+            stats.update({
+                'minLength': self.min_length,
+                'maxLength': self.max_length,
+                'isAllLower': self.is_all_lower,
+                'isAllUpper': self.is_all_upper,
+                'containsNumericStart': self.contains_numeric_start,
+                'containsMultipleWords': self.contains_multiple_words,
+                'maxWords': self.max_words,
+            })
+        else:
+            stats.update({
+                'minValue': self.min_value,
+                'maxValue': self.max_value,
+            })
+        if self.data_type in (DATA_TYPE_INTEGER, DATA_TYPE_DECIMAL):
+            stats['decimalScale'] = self.decimal_scale
+        return stats
+
+
+def profile_column(column):
+    profiler = ColumnProfiler(column.data_type)
+    add_column(profiler, column)
+    return profiler.result()
+
+
+def add_column(profiler, column):
+    """
+    Add the values of a column (or of a batch of its rows) to its profiler.
+    """
+    if isinstance(column, DictColumn):
+        # Only look at each distinct value once.
+        nulls = column.nulls
+        used_codes = set(code for idx, code in enumerate(column.codes[:]) if not nulls.is_null(idx)) if nulls.has_nulls() else set(column.codes[:])
+        for code in sorted(used_codes):
+            profiler.add(column.dictionary[code])
+        profiler.null_count += nulls.null_count()
+    elif column.data_type == DATA_TYPE_STRING:
+        for idx in xrange(len(column)):
+            profiler.add(column[idx])
+    else:
+        nulls = column.nulls
+        if nulls.has_nulls():
+            for idx, value in enumerate(column.values[:]):
+                profiler.add(None if nulls.is_null(idx) else value)
+        else:
+            for value in column.values[:]:
+                profiler.add(value)
+
+
+def profile_store(store):
+    """
+    Profile every column of a `ColumnStore`, as {field: stats}.
+    """
+    return dict((field, profile_column(store.column(field))) for field in store.fields)
+
+
+def profile_batches(data_path, fields, batch_rows):
+    """
+    Profile the `fields` of a data file as {field: stats}, reading `batch_rows` rows of it at a time
+    (see `stream.BatchReader`) rather than mapping it.
+    """
+    reader = BatchReader(data_path)
+    try:
+        profilers = {}
+        for start, store in reader.batches(fields, batch_rows):
+            for field in fields:
+                column = store.column(field)
+                add_column(profilers.setdefault(field, ColumnProfiler(column.data_type)), column)
+    finally:
+        reader.close()
+    return dict((field, profiler.result()) for field, profiler in profilers.items())
+
+
+def open_stats(data_path, store, batch_rows=None):
+    """
+    Load the statistics saved next to the data file,
+    profiling the store (and saving the result) if they are missing or out of date.
+    With `batch_rows`, the data file is profiled that many rows at a time instead (see `profile_batches`).
+    """
+    stats_path = data_path + '.stats.json'
+    signature = data_signature(data_path)
+    if os.path.exists(stats_path):
+        with open(stats_path) as f:
+            saved = json.load(f)
+        if (saved['signature'] == signature) and (saved.get('version') == STATS_VERSION):
+            return saved['columns']
+
+    stats = profile_batches(data_path, store.fields, batch_rows) if batch_rows else profile_store(store)
+    with open(stats_path + '.tmp', 'w') as f:
+        json.dump({'signature': signature, 'version': STATS_VERSION, 'columns': stats}, f)
+    os.rename(stats_path + '.tmp', stats_path)
+    return stats
+
+
+def merge_stat(key, a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if key in ('minValue', 'minLength'):
+        return min(a, b)
+    if key in ('maxValue', 'maxLength', 'maxWords', 'decimalScale'):
+        return max(a, b)
+    if key in ('distinctCount', 'nullCount'):
+        return a + b
+    if key in ('isAllLower', 'isAllUpper'):
+        return a and b
+    return a or b # containsNumericStart, containsMultipleWords
+
+
+def merge_stats(stats_list):
+    """
+    Combine the statistics of several stores (such as the segments of a table, see `segments.py`)
+    into the statistics of all of their rows. The distinct counts are added up, so they are only an upper bound
+    (unless one of them reached MAX_DISTINCT).
+    """
+    merged = {}
+    for stats in stats_list:
+        for field, column_stats in stats.items():
+            if field not in merged:
+                merged[field] = dict(column_stats)
+                continue
+            for key, value in column_stats.items():
+                merged[field][key] = merge_stat(key, merged[field].get(key), value)
+    return merged
@@ -0,0 +1,243 @@
+### Versioned, memory-mapped binary file format for a `ColumnStore`.
+###
+### Layout:
+###
+###   MAGIC (8 bytes) | VERSION (uint32) | HEADER LENGTH (uint32) | HEADER (json) | SEGMENTS...
+###
+### The header holds the schema (derived from `COLUMN_INFO`) and, for each column, where its
+### segments live in the file. Every segment starts on an 8-byte boundary:
+###
+###   - numeric columns ==> `values` (fixed-width array) and `nulls` (bitmap)
+###   - string columns  ==> `offsets` (uint array), `heap` (utf-8 bytes) and `nulls`
+###   - dictionary-encoded string columns ==> `codes`, `nulls`, and the distinct values
+###     as `dictionaryOffsets` and `dictionaryHeap`
+###
+### Opening a file only reads the header; the segments are used straight from the mmap,
+### so startup does not depend on the size of the table, and several processes searching
+### the same file share one copy of it in the page cache.
+
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+from columns import ColumnStore, NumericColumn, StringColumn, DictColumn, NullBitmap
+from constants import *
+
+
+MAGIC = 'SRCHDATA'
+FORMAT_VERSION = 2
+PREAMBLE = struct.Struct('<8sII')
+ALIGNMENT = 8
+
+
+class MappedArray(object):
+    """
+    A read-only, array-like view of a segment of a memory-mapped file.
+
+    Single items are unpacked straight from the map, and a slice is
+    only copied into an `array.array` when it is asked for.
+    """
+
+    def __init__(self, buf, offset, typecode, count):
+        self.buf = buf
+        self.offset = offset
+        self.typecode = typecode
+        self.count = count
+        self.itemsize = array.array(typecode).itemsize
+        self.struct = struct.Struct(typecode)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self.count)
+            values = array.array(self.typecode)
+            if stop > start:
+                values.fromstring(self.buf[self.offset + start * self.itemsize:self.offset + stop * self.itemsize])
+            return values if step == 1 else values[::step]
+        if idx < 0:
+            idx += self.count
+        if not (0 <= idx < self.count):
+            raise IndexError('MappedArray index out of range')
+        return self.struct.unpack_from(self.buf, self.offset + idx * self.itemsize)[0]
+
+    def __iter__(self):
+        chunk = 65536
+        for start in xrange(0, self.count, chunk):
+            for value in self[start:start + chunk]:
+                yield value
+
+    def raw(self):
+        return buffer(self.buf, self.offset, self.count * self.itemsize)
+
+
+def _column_kind(column):
+    if isinstance(column, DictColumn):
+        return 'dictionary'
+    return 'string' if isinstance(column, StringColumn) else 'numeric'
+
+
+def _column_segments(column):
+    """
+    The (name, bytes-like) segments to write for a column.
+    """
+    if isinstance(column, DictColumn):
+        return [('codes', column.codes), ('nulls', column.nulls.bits), ('dictionaryOffsets', column.dictionary.offsets), ('dictionaryHeap', column.dictionary.heap)]
+    if isinstance(column, StringColumn):
+        return [('offsets', column.offsets), ('heap', column.heap), ('nulls', column.nulls.bits)]
+    return [('values', column.values), ('nulls', column.nulls.bits)]
+
+
+def _as_bytes(segment):
+    if isinstance(segment, array.array):
+        return segment.tostring()
+    if isinstance(segment, MappedArray):
+        return str(segment.raw())
+    return str(segment)
+
+
+def write_store(path, store, column_info):
+    """
+    Write a `ColumnStore` to `path`.
+    """
+    columns = []
+    for field, column in zip(store.fields, store.columns):
+        segments = []
+        for name, segment in _column_segments(column):
+            data = _as_bytes(segment)
+            segments.append((name, getattr(segment, 'typecode', 'B'), len(data), [data]))
+        columns.append((field, _column_kind(column), column.nulls.null_count(), segments))
+    write_columns(path, len(store), columns, column_info)
+
+
+def write_columns(path, num_rows, columns, column_info):
+    """
+    Write a data file from the segments of its columns, given as
+    (field, kind, null count, [(segment name, typecode, size in bytes, chunks)]),
+    where `chunks` yields the bytes of the segment (see `ingest.py`, which streams them from temporary files).
+
+    The file is written next to its destination and renamed into place,
+    so a searcher never sees a half-written file.
+    """
+    columns_header = []
+    position = 0
+    for field, kind, null_count, segments in columns:
+        column_header = {
+            'field': field,
+            'type': column_info[field]['type'],
+            'searchType': column_info[field]['searchType'],
+            'index': column_info[field]['index'],
+            'kind': kind,
+            'nullCount': null_count,
+            'segments': {},
+        }
+        for name, typecode, size, chunks in segments:
+            column_header['segments'][name] = [position, size // array.array(typecode).itemsize, typecode]
+            position += size + (-size % ALIGNMENT)
+        columns_header.append(column_header)
+
+    header = json.dumps({
+        'numRows': num_rows,
+        'byteOrder': sys.byteorder,
+        'columns': columns_header,
+    })
+    data_start = PREAMBLE.size + len(header)
+    data_start += -data_start % ALIGNMENT
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        f.write('\x00' * (data_start - PREAMBLE.size - len(header)))
+        for field, kind, null_count, segments in columns:
+            for name, typecode, size, chunks in segments:
+                for data in chunks:
+                    f.write(data)
+                f.write('\x00' * (-size % ALIGNMENT))
+    os.rename(tmp_path, path)
+
+
+def read_header(f):
+    magic, version, header_length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+    if magic != MAGIC:
+        raise ValueError('Not a search data file')
+    if version != FORMAT_VERSION:
+        raise ValueError('Unsupported data file version %s (expected %s)' % (version, FORMAT_VERSION))
+    header = json.loads(f.read(header_length))
+    if header['byteOrder'] != sys.byteorder:
+        raise ValueError('Data file was written with a different byte order')
+    data_start = PREAMBLE.size + header_length
+    return header, data_start + (-data_start % ALIGNMENT)
+
+
+def open_store(path, column_info):
+    """
+    Memory-map a data file and return its `ColumnStore`.
+
+    Raises a ValueError if the file's schema does not match `column_info`.
+    """
+    with open(path, 'rb') as f:
+        header, data_start = read_header(f)
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    num_rows = header['numRows']
+    fields, columns = [], []
+    for column_header in sorted(header['columns'], key=lambda c: c['index']):
+        field = column_header['field']
+        if (field not in column_info) or (column_info[field]['type'] != column_header['type']) or (column_info[field]['index'] != column_header['index']):
+            raise ValueError('Data file schema does not match COLUMN_INFO on field %r' % field)
+
+        segments = {}
+        for name, (offset, count, typecode) in column_header['segments'].items():
+            segments[name] = MappedArray(buf, data_start + offset, str(typecode), count)
+        nulls = NullBitmap(segments['nulls'], num_rows, column_header['nullCount'])
+
+        if column_header['kind'] == 'dictionary':
+            heap = segments['dictionaryHeap']
+            dictionary_size = segments['dictionaryOffsets'].count - 1
+            dictionary_nulls = NullBitmap(bytearray((dictionary_size + 7) // 8), dictionary_size, 0)
+            dictionary = StringColumn(segments['dictionaryOffsets'], buffer(buf, heap.offset, heap.count), dictionary_nulls)
+            column = DictColumn(segments['codes'], dictionary, nulls)
+        elif column_header['kind'] == 'string':
+            heap = segments['heap']
+            column = StringColumn(segments['offsets'], buffer(buf, heap.offset, heap.count), nulls)
+        else:
+            column = NumericColumn(column_header['type'], segments['values'], nulls)
+        fields.append(field)
+        columns.append(column)
+
+    if set(fields) != set(column_info):
+        raise ValueError('Data file schema does not match COLUMN_INFO')
+    store = ColumnStore(fields, columns, num_rows)
+    store.mmap = buf
+    return store
+
+
+def data_signature(data_path):
+    """
+    Identifies one version of a data file, so that whatever is derived
+    from it (indexes, statistics) can tell when it is out of date.
+    """
+    stat = os.stat(data_path)
+    return [stat.st_size, int(stat.st_mtime * 1000)]
+
+
+def convert_json(json_path, out_path, column_info):
+    """
+    Convert the Wasm-formatted json (a list of rows) to a data file.
+    """
+    with open(json_path) as f:
+        rows = json.load(f)
+    write_store(out_path, ColumnStore.from_rows(rows, column_info), column_info)
+
+
+def convert_csv(csv_path, out_path, column_info):
+    """
+    Convert a raw csv export (such as `Sales1M.csv`) to a data file,
+    a chunk at a time in a pool of processes (see `ingest.py`).
+    """
+    from ingest import ingest_csv
+    ingest_csv(csv_path, out_path, column_info)
@@ -0,0 +1,198 @@
+### Out-of-core execution of `search_all`, for data files larger than memory.
+###
+### The data file is memory-mapped, so opening it costs nothing, but a search over the whole table still has
+### every page of its columns, the indexes and the rows of every term in memory at once. Streaming instead:
+###
+###   (1) a reader thread reads the columns of the search, a batch of rows at a time, straight from the file
+###       (only the byte ranges of that batch: values, offsets, heap, codes and null bits)
+###   (2) each batch becomes a small `ColumnStore`, and the plan is compiled and executed over it as usual
+###   (3) the terms' rows are combined with row bitmaps (see `bitmap.py`), and as a batch is a whole number
+###       of bitmap chunks, the chunks of its matches are simply added to those of the search: at most a bit per row
+###
+### The reader stays up to `read_ahead` batches ahead of the matching, so reading the file overlaps with
+### matching the batch before. At most (read_ahead + 2) batches are in memory at any time, whatever the size
+### of the table.
+
+import array
+import Queue
+import sys
+import threading
+import time
+from binascii import hexlify
+from bitmap import RowBitmap, match_bitmap, CHUNK_BITS, CHUNK_SIZE
+from columns import ColumnStore, NumericColumn, StringColumn, DictColumn, NullBitmap
+from plan import compile_plan
+from storage import read_header
+
+
+DEFAULT_BATCH_ROWS = 4 * CHUNK_SIZE # always rounded up to a whole number of bitmap chunks
+DEFAULT_READ_AHEAD = 2
+READ_AHEAD_POLL_SECONDS = 0.1
+
+
+class BatchReader(object):
+    """
+    Reads the columns of a data file a row range at a time, without mapping it.
+    """
+
+    def __init__(self, path):
+        self.f = open(path, 'rb')
+        header, self.data_start = read_header(self.f)
+        self.num_rows = header['numRows']
+        self.headers = dict((column_header['field'], column_header) for column_header in header['columns'])
+        self.dictionaries = {} # field ==> the distinct values of a dictionary-encoded column, read once
+        self.bytes_read = 0
+
+    def read(self, segment, start, stop):
+        """
+        Read the items [start, stop) of one segment of a column, as an array.
+        """
+        offset, count, typecode = segment
+        values = array.array(str(typecode))
+        self.f.seek(self.data_start + offset + start * values.itemsize)
+        values.fromstring(self.f.read((min(stop, count) - start) * values.itemsize))
+        self.bytes_read += len(values) * values.itemsize
+        return values
+
+    def nulls(self, column_header, start, stop):
+        # A batch starts on a byte of the bitmap, so its bits are those bytes as they are.
+        bits = bytearray(self.read(column_header['segments']['nulls'], start >> 3, (stop + 7) >> 3))
+        # Counted in C, as every batch's bitmap is counted before it is used.
+        null_count = bin(int(hexlify(bits), 16)).count('1') if (column_header['nullCount'] and bits) else 0
+        return NullBitmap(bits, stop - start, null_count)
+
+    def strings(self, offsets_segment, heap_segment, start, stop, nulls):
+        """
+        The values [start, stop) of a string column, with their offsets made relative to the part of the heap read.
+        """
+        offsets = self.read(offsets_segment, start, stop + 1)
+        base = offsets[0] - 1 # the heap of a column starts with the terminator of the value before
+        heap = self.read(heap_segment, base, offsets[-1]).tostring()
+        if base:
+            offsets = array.array(offsets.typecode, [offset - base for offset in offsets])
+        return StringColumn(offsets, heap, nulls)
+
+    def column(self, field, start, stop):
+        column_header = self.headers[field]
+        segments = column_header['segments']
+        nulls = self.nulls(column_header, start, stop)
+        if column_header['kind'] == 'dictionary':
+            if field not in self.dictionaries:
+                size = segments['dictionaryOffsets'][1] - 1
+                self.dictionaries[field] = self.strings(segments['dictionaryOffsets'], segments['dictionaryHeap'], 0, size, NullBitmap(bytearray((size + 7) // 8), size, 0))
+            return DictColumn(self.read(segments['codes'], start, stop), self.dictionaries[field], nulls)
+        if column_header['kind'] == 'string':
+            return self.strings(segments['offsets'], segments['heap'], start, stop, nulls)
+        return NumericColumn(column_header['type'], self.read(segments['values'], start, stop), nulls)
+
+    def batches(self, fields, batch_rows):
+        """
+        Yield (first row, `ColumnStore` of only `fields`) for each batch of rows.
+        """
+        batch_rows += -batch_rows % 8 # so that every batch starts on a byte of the null bits
+        for start in xrange(0, self.num_rows, batch_rows):
+            stop = min(start + batch_rows, self.num_rows)
+            yield start, ColumnStore(fields, [self.column(field, start, stop) for field in fields], stop - start)
+
+    def close(self):
+        self.f.close()
+
+
+def read_ahead(items, depth):
+    """
+    Yield the items of an iterator, with a thread getting up to `depth` of them ahead of time.
+    An error in the thread is raised here, and the thread stops if the items are not all used.
+    """
+    if depth <= 0:
+        for item in items:
+            yield item
+        return
+
+    queue = Queue.Queue(depth)
+    stopped = threading.Event()
+    done = object()
+
+    def offer(entry):
+        while not stopped.is_set():
+            try:
+                queue.put(entry, timeout=READ_AHEAD_POLL_SECONDS)
+                return True
+            except Queue.Full:
+                continue
+        return False
+
+    def read():
+        try:
+            for item in items:
+                if not offer((item, None)):
+                    return
+        except Exception:
+            offer((done, sys.exc_info()))
+            return
+        offer((done, None))
+
+    thread = threading.Thread(target=read, name='read-ahead')
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, error = queue.get()
+            if error is not None:
+                raise error[0], error[1], error[2]
+            if item is done:
+                return
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
+
+
+class StreamScanner(object):
+    """
+    Searches a data file a batch of rows at a time (see the top of this file).
+    """
+
+    def __init__(self, data_path, column_info, batch_rows=DEFAULT_BATCH_ROWS, read_ahead=DEFAULT_READ_AHEAD):
+        self.reader = BatchReader(data_path)
+        self.column_info = column_info
+        self.batch_rows = max(batch_rows + (-batch_rows % CHUNK_SIZE), CHUNK_SIZE)
+        self.read_ahead = read_ahead
+
+    def search(self, search_info, task=None):
+        """
+        Search every row, returning the matches as a `RowBitmap`, and the stats of the reading and matching.
+        A `task`, if given, is checked before each batch and reported to after it, as in `Search.search_all`.
+        """
+        fields = sorted(set(term_obj['Field'] for term_obj in search_info['Parsed']))
+        matches = RowBitmap()
+        stats = {'Batches': 0, 'BatchRows': self.batch_rows, 'ReadAhead': self.read_ahead, 'ReadWaitSeconds': 0.0, 'MatchSeconds': 0.0}
+        self.reader.bytes_read = 0
+        batches = read_ahead(self.reader.batches(fields, self.batch_rows), self.read_ahead)
+        try:
+            while True:
+                if task is not None:
+                    task.check()
+                t0 = time.time()
+                batch = next(batches, None)
+                t1 = time.time()
+                stats['ReadWaitSeconds'] += t1 - t0
+                if batch is None:
+                    break
+                start, store = batch
+                # No indexes: they cover the whole table, and would bring all of its rows of a term into memory.
+                plan = compile_plan(search_info, self.column_info, store, {})
+                if plan.full_mask:
+                    first_chunk = start >> CHUNK_BITS
+                    for chunk, container in match_bitmap(plan, plan.matcher_rows()).containers.iteritems():
+                        matches.containers[first_chunk + chunk] = container
+                stats['Batches'] += 1
+                stats['MatchSeconds'] += time.time() - t1
+                if task is not None:
+                    task.report(start + len(store), self.reader.num_rows, matches)
+        finally:
+            batches.close() # stops the reader thread, if the search stopped early
+        stats['BytesRead'] = self.reader.bytes_read
+        return matches, stats
+
+    def close(self):
+        self.reader.close()
@@ -0,0 +1,378 @@
+### Searches over small generated tables whose results are known (run with `python -m unittest test_search`).
+
+import json
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib2
+from benchmark import synthetic_rows
+from columns import ColumnStore
+from constants import *
+from plan import ENGINE_ROWS, ENGINE_BITMAP
+from rank import row_score
+from search import Search, default_column_info
+from segments import SegmentedSearch
+from server import SearchServer
+from stats import ColumnProfiler, profile_batches, profile_store, MAX_DISTINCT
+from storage import open_store, write_store
+
+
+TITLES = ['Terminator 2', 'Blade Runner 2049', 'Ocean 11', 'Up']
+PHRASE_TITLES = ['Terminator 2', 'Terminator', 'The Matrix', 'The Matrix Reloaded', "Ocean's Eleven", 'Up']
+
+
+def title_rows(num_rows, titles=TITLES):
+    """
+    Sales rows, with each of the `titles` as the `code` of as many of them.
+    """
+    rows = list(synthetic_rows(num_rows))
+    for num, row in enumerate(rows):
+        row[4] = titles[num % len(titles)]
+    return rows
+
+
+def exact_code_column_info():
+    """
+    The Sales columns, with `code` searched as EXACT (so, as it holds several words, for whole phrases).
+    """
+    column_info = default_column_info()
+    column_info['code']['searchType'] = SEARCH_TYPE_EXACT
+    return column_info
+
+
+def searched_column_info(search_types):
+    """
+    The Sales columns, with only the fields of `search_types` searched, as given.
+    """
+    column_info = default_column_info()
+    for field, field_info in column_info.items():
+        field_info['searchType'] = search_types.get(field, SEARCH_TYPE_OFF)
+    return column_info
+
+
+def string_match(search_type, term, text):
+    """
+    Whether `term` matches the string `text`, the slow way.
+    """
+    if search_type == SEARCH_TYPE_STARTSWITH:
+        return text.startswith(term)
+    if search_type == SEARCH_TYPE_EDGE:
+        return any(text.startswith(term, start) for start in xrange(len(text)) if (start == 0) or not text[start - 1].isalnum())
+    return term in text
+
+
+def check_every_row(plan, num_rows):
+    """
+    The rows that fully match a plan, the slow way: every term is checked on every row (without its index,
+    or the rows left by the other terms). Returns {row: (matchers that matched it, the ones that only partially did)}.
+    """
+    matched = {}
+    for num, matcher in enumerate(plan.matchers):
+        for idx in matcher.filter(xrange(num_rows)):
+            nums, partial_nums = matched.setdefault(idx, ([], set()))
+            nums.append(num)
+            if idx in matcher.partial_rows:
+                partial_nums.add(num)
+    return dict((idx, nums) for idx, nums in matched.items() if plan.match_row(idx, nums[0]))
+
+
+class TableTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_table(self, rows, column_info, name='table.bin'):
+        path = self.directory + '/' + name
+        write_store(path, ColumnStore.from_rows(rows, column_info), column_info)
+        return path
+
+
+class NumericTermTest(TableTestCase):
+    """
+    A number is searched as a value of the type of each numeric field, whatever it looks like: "5.0" is the integer 5.
+    """
+
+    def test_integral_decimal_term(self):
+        rows = list(synthetic_rows(1000))
+        for num, row in enumerate(rows):
+            row[5] = row[7] = 5.0 if (num % 2 == 0) else 4.99
+        path = self.write_table(rows, default_column_info())
+        for s in (Search(path, cache_bytes=0), Search(path, cache_bytes=0, stream_rows=256)):
+            for q, num_results in (('5.0', 500), ('5', 500), ('4.99', 500), ('8.0', 1), ('0.99', 0)):
+                s.search(q)
+                self.assertEqual(s.SEARCH_INFO['NumResults'], num_results, q)
+        self.assertEqual(s.SEARCH_INFO['MissingTokens'], set(['0.99']))
+
+
+class NumericIntervalTest(TableTestCase):
+    """
+    A non-exact search on a number, answered from intervals of values, finds the rows whose value (as the column
+    shows it) the term matches as a string: with the sorted index, and without it.
+    """
+
+    TERMS = ['4.9', '99', '0', '0.9', '5.00', '134', '1', '12.5', '7', '100']
+
+    def test_against_string_matching(self):
+        rand = random.Random(13)
+        rows = list(synthetic_rows(3000))
+        for row in rows:
+            row[5] = round(rand.uniform(-120, 120), rand.choice([0, 1, 2]))
+        # `price` has 2 decimals at most, and a zero is shown without a sign
+        shown = [('%d' % row[0], '%.2f' % (row[5] + 0.0)) for row in rows]
+        for search_type in (SEARCH_TYPE_STARTSWITH, SEARCH_TYPE_EDGE, SEARCH_TYPE_CONTAINS):
+            column_info = searched_column_info({'id': search_type, 'price': search_type})
+            path = self.write_table(rows, column_info, '%s.bin' % search_type)
+            in_memory = Search(path, cache_bytes=0, column_info=column_info)
+            self.assertEqual(in_memory.indexes['price'].kind, 'sorted')
+            for s in (in_memory, Search(path, cache_bytes=0, stream_rows=1024, column_info=column_info)):
+                for term in self.TERMS:
+                    s.search(term)
+                    expected = sum(1 for values in shown if any(string_match(search_type, term, value) for value in values))
+                    self.assertEqual(s.SEARCH_INFO['NumResults'], expected, (search_type, term))
+
+
+class ServerTest(TableTestCase):
+    """
+    The server answers searches over HTTP, and stops the ones that run for longer than its search timeout.
+    """
+
+    def serve(self, **options):
+        server = SearchServer(('127.0.0.1', 0), self.write_table(title_rows(2000), default_column_info()), threads=2, cache_bytes=0, **options)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return 'http://127.0.0.1:%s' % server.server_address[1]
+
+    def get(self, url):
+        try:
+            response = urllib2.urlopen(url)
+        except urllib2.HTTPError as e:
+            return e.code, json.loads(e.read())
+        return response.getcode(), json.loads(response.read())
+
+    def test_search(self):
+        url = self.serve()
+        self.assertEqual(self.get(url + '/search?q=terminator+2')[1]['NumResults'], 500)
+        code, search_info = self.get(url + '/search?q=terminator+2&top=3')
+        self.assertEqual((code, search_info['NumResults'], len(search_info['FirstTenResults'])), (200, 500, 3))
+
+    def test_search_timeout(self):
+        url = self.serve(search_timeout=0)
+        for path in ('/search?q=terminator+2', '/search?q=terminator+2&top=3'):
+            self.assertEqual(self.get(url + path), (503, {'Error': 'Timed out searching'}))
+
+    def test_workers(self):
+        self.assertRaises(ValueError, SearchServer, ('127.0.0.1', 0), self.write_table(title_rows(10), default_column_info()), workers=2)
+
+
+class EvaluationOrderTest(TableTestCase):
+    """
+    Evaluating the most selective tokens first, and the terms after them only on the rows still in the running,
+    finds the same matches as checking every term on every row.
+    """
+
+    QUERIES = ['usd hd', 'hdbuy 4.99', 'us usd', 'sd', 'hdbuy 4.99 2014-01-01', 'mar 4 2014 usd', 'rent eur', 'ny 2015 sd', '4.99 4.99']
+
+    def test_against_every_row(self):
+        rows = list(synthetic_rows(8000))
+        rand = random.Random(17)
+        # ...and searches of two or three values of a row, which have matches
+        queries = self.QUERIES + [' '.join(str(value).lower() for value in rand.sample(rand.choice(rows)[3:8], rand.choice([2, 3]))) for _ in range(20)]
+        path = self.write_table(rows, default_column_info())
+        searches = [Search(path, cache_bytes=0, engine=engine, verbose=False) for engine in (ENGINE_ROWS, ENGINE_BITMAP, ENGINE_ROWS, ENGINE_BITMAP)]
+        for s in searches[2:]:
+            s.indexes = {} # so that the terms are scanned for, and the later ones only check the rows left
+        num_found, sources = 0, set()
+        for q in queries:
+            s = searches[0]
+            s.prepare(q)
+            if s.check_if_search_can_be_skipped():
+                continue
+            expected = set(check_every_row(s.compile(), len(rows)))
+            num_found += bool(expected)
+            for s in searches:
+                s.prepare(q)
+                plan = s.compile()
+                self.assertEqual(plan.execute(), expected, q)
+                sources.update(matcher.last_source for matcher in plan.matchers)
+                self.assertEqual(s.compile().top()[0], len(expected), q)
+        self.assertGreater(num_found, len(queries) // 2)
+        self.assertIn('row check', sources) # some terms only looked at the rows left by the ones before them
+
+
+class TopTest(TableTestCase):
+    """
+    The best `k` matches, read off groups of rows that have the same terms, are those of scoring every match.
+    """
+
+    # With the territory searched as EXACT, "sd" scores higher as a territory than as the start of "SDBUY"
+    QUERIES = ['usd hd', 'hdbuy 4.99', 'sd', 'u', 'hdbuy 4.99 usd', 'ca sdrent', 'sd usd', 'sd 4.99', 'ca 4.99 usd']
+
+    def test_against_scoring_every_match(self):
+        rows = list(synthetic_rows(5000))
+        column_info = default_column_info()
+        column_info['territory_id']['searchType'] = SEARCH_TYPE_EXACT
+        path = self.write_table(rows, column_info)
+        searches = [Search(path, cache_bytes=0, verbose=False, column_info=column_info), Search(path, cache_bytes=0, verbose=False, column_info=column_info)]
+        searches[1].indexes = {}
+        for q in self.QUERIES:
+            s = searches[0]
+            s.prepare(q)
+            plan = s.compile()
+            scored = sorted((-row_score(plan, nums, partial_nums), idx) for idx, (nums, partial_nums) in check_every_row(plan, len(rows)).items())
+            self.assertTrue(scored, q)
+            for s in searches:
+                s.prepare(q)
+                for k in (1, 10, 100, len(rows)):
+                    self.assertEqual(s.compile().top(k), (len(scored), [(idx, -negative_score) for negative_score, idx in scored[:k]]), (q, k))
+            s.search_top(q, 10)
+            self.assertEqual(s.SEARCH_INFO['Scores'], [-negative_score for negative_score, idx in scored[:10]], q)
+            self.assertEqual(s.SEARCH_INFO['FirstTenResults'], [s.row(idx) for negative_score, idx in scored[:10]], q)
+
+
+class StreamTest(TableTestCase):
+    """
+    A search streamed a batch of rows at a time finds the same matches as one over the mapped table, with its indexes.
+    """
+
+    QUERIES = ['usd', 'hdbuy', 'hdbuy 4.99', 'mar. 4, 2014', 'mar 4 2014 usd', 'terminator 2', '2049', '4.99', 'hd',
+               'sd usd', 'a', '2016-01-01 usd', 'usd hd', 'runner 2049 usd', 'blade']
+
+    def test_against_in_memory(self):
+        rows = list(synthetic_rows(150000)) # three batches, the last one short
+        for row in rows[::3]:
+            row[4] = TITLES[row[0] % len(TITLES)]
+        path = self.write_table(rows, default_column_info())
+        in_memory = Search(path, cache_bytes=0, verbose=False)
+        streamed = [Search(path, stream_rows=65536, read_ahead=read_ahead, verbose=False) for read_ahead in (0, 2)]
+        for q in self.QUERIES:
+            in_memory.search(q)
+            self.assertTrue(in_memory.SEARCH_INFO['NumResults'] or in_memory.SEARCH_INFO['MissingTokens'], q)
+            for s in streamed:
+                s.search(q)
+                self.assertEqual(sorted(s.matches_at_index), sorted(in_memory.matches_at_index), q)
+                self.assertEqual(s.SEARCH_INFO['FirstTenResults'], in_memory.SEARCH_INFO['FirstTenResults'], q)
+        self.assertEqual(streamed[1].SEARCH_INFO['StreamStats']['Batches'], 3)
+
+
+class TrigramTest(TableTestCase):
+    """
+    A CONTAINS search answered from the trigram index finds the rows whose value has every term in it, as a substring.
+    """
+
+    WORDS = ['Blade', 'Runner', '2049', 'Terminator', 'Ocean\'s', 'Eleven', 'the', 'Matrix', 'up', 'O-Ren', 'ISHII', u'Caf\xe9', 'x1']
+    QUERIES = ['a', 'r', '20', 'bla', 'blade', 'runner 2049', 'ade', 'unne', 'ocean\'s', 'ean', 'trix the', 'o-ren', 'ren',
+               'ishii', 'shi', u'caf\xe9', u'f\xe9', 'x1', '1x', "1'", '2x', "'a", 'zzz', 'ner 20', '49 the up']
+
+    def test_against_substrings(self):
+        rand = random.Random(23)
+        # More distinct titles than a dictionary-encoded column can have, so that the column gets a trigram index,
+        # and words few enough of them have that the index is used to look them up
+        rows = list(synthetic_rows(66000))
+        for row in rows:
+            words = [rand.choice(self.WORDS) for _ in xrange(rand.randint(1, 4))] if (rand.random() < 0.05) else []
+            row[4] = ' '.join(words + ['item', str(row[0])])
+        column_info = searched_column_info({'code': SEARCH_TYPE_CONTAINS})
+        path = self.write_table(rows, column_info)
+        in_memory = Search(path, cache_bytes=0, column_info=column_info, verbose=False)
+        self.assertEqual(in_memory.indexes['code'].kind, 'trigram')
+        values = [row[4].lower() for row in rows]
+        sources = set()
+        for q in self.QUERIES:
+            in_memory.prepare(q)
+            sources.update(matcher.source for matcher in in_memory.compile().matchers)
+        self.assertIn('trigram index', sources)              # a term shorter than a trigram
+        self.assertIn('trigram index + row check', sources)  # and the candidates of a longer one
+        for s in (in_memory, Search(path, cache_bytes=0, stream_rows=65536, column_info=column_info, verbose=False)):
+            for q in self.QUERIES:
+                s.search(q)
+                terms = s.SEARCH_INFO['TokenizedSearch']
+                expected = [idx for idx, value in enumerate(values) if all(term in value for term in terms)]
+                self.assertEqual(sorted(s.matches_at_index), expected, q)
+
+
+class StatsTest(TableTestCase):
+    """
+    A data file profiled a batch of rows at a time (as for a streamed search) has the same statistics as its store.
+    """
+
+    def test_batches(self):
+        rows = title_rows(3000, TITLES + ['The Matrix Reloaded'])
+        for num, row in enumerate(rows):
+            if num % 7 == 0:
+                row[4] = None
+            if num % 11 == 0:
+                row[5] = None
+        column_info = default_column_info()
+        path = self.write_table(rows, column_info)
+        store = open_store(path, column_info)
+        self.assertEqual(profile_batches(path, store.fields, 1000), profile_store(store))
+        self.assertEqual(profile_batches(path, store.fields, 999), profile_store(store)) # not on a byte of the null bits
+
+    def test_distinct_values(self):
+        profiler = ColumnProfiler(DATA_TYPE_INTEGER)
+        for value in xrange(2 * MAX_DISTINCT, 0, -1):
+            profiler.add(value)
+        stats = profiler.result()
+        self.assertEqual((stats['distinctCount'], stats['minValue'], stats['maxValue']), (MAX_DISTINCT, 1, 2 * MAX_DISTINCT))
+
+
+class NumericStartTest(TableTestCase):
+    """
+    A term starting with a digit can start any word of a multi-word EDGE column, not just its first one.
+    """
+
+    def test_multi_word_edge_column(self):
+        s = Search(self.write_table(title_rows(2000), default_column_info()), cache_bytes=0)
+        self.assertIs(s.COLUMN_INFO['code']['containsNumericStart'], False)
+        self.assertIs(s.COLUMN_INFO['code']['containsMultipleWords'], True)
+        for q in ('2049', 'runner 2049', 'terminator 2'):
+            s.search(q)
+            self.assertEqual(s.SEARCH_INFO['MissingTokens'], set(), q)
+            self.assertEqual(s.SEARCH_INFO['NumResults'], 500, q)
+
+
+class PhraseModesTest(TableTestCase):
+    """
+    A phrase search has the same results in memory (with a phrase index), streamed and segmented (without one).
+    """
+
+    QUERIES = ['terminator 2', 'terminator 2 usd', 'the matrix ca', 'the matrix reloaded', "ocean's eleven 4.99", 'up up']
+
+    def num_results(self, s):
+        results = []
+        for q in self.QUERIES:
+            s.search(q)
+            results.append(s.SEARCH_INFO['NumResults'])
+        return results
+
+    def test_same_results(self):
+        rows = title_rows(6000, PHRASE_TITLES)
+        column_info = exact_code_column_info()
+        path = self.write_table(rows[:4000], column_info)
+        in_memory = Search(path, cache_bytes=0, column_info=column_info)
+        self.assertEqual(in_memory.indexes['code'].kind, 'phrase')
+        expected = self.num_results(in_memory)
+        self.assertTrue(all(expected), expected)
+        self.assertEqual(self.num_results(Search(path, cache_bytes=0, stream_rows=65536, column_info=column_info)), expected)
+
+        segmented = SegmentedSearch(self.directory + '/table.segments', cache_bytes=0, column_info=column_info)
+        segmented.table.import_data(path)
+        self.assertEqual(segmented.table.snapshot().parts[0].indexes['code'].kind, 'phrase')
+        self.assertEqual(self.num_results(segmented), expected)
+        # With rows in the head too, which has no indexes
+        segmented.table.append(rows[4000:])
+        all_rows = Search(self.write_table(rows, column_info, 'all.bin'), cache_bytes=0, column_info=column_info)
+        self.assertEqual(self.num_results(segmented), self.num_results(all_rows))
+        segmented.table.close()
+
+
+if __name__ == '__main__':
+    unittest.main()